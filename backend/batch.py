@@ -0,0 +1,76 @@
+"""
+Runs corrections through the provider's batch API instead of the workers, for large offline runs
+(see src/services/batch_runner.py). Runs are resumable: running the command again picks up the
+batch jobs an interrupted run left open.
+
+Usage (from backend/):
+    python batch.py run --corpus path/to/texts --prompts copy_editor_corrections,clarity_flow_enhancement
+    python batch.py run --correction-ids 12 13
+    python batch.py status
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+
+from config import LLM_MODEL_NAME, LLM_BATCH_POLL_SECONDS
+from src.utils import get_db_context
+from src.services.batch_runner import BatchRunner
+from src.services.prompt_registry import prompt_registry
+
+
+def create_corpus_corrections(runner: BatchRunner, corpus_dir: str, prompt_id_refs: list) -> list:
+    """Creates one correction per .txt file of corpus_dir."""
+    if not prompt_id_refs:
+        prompt_id_refs = [prompt.prompt_id_ref for prompt in prompt_registry.get_enabled_prompts(runner.db)]
+    correction_ids = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.txt"))):
+        with open(path) as text_file:
+            correction = runner.service.create_new_correction(original_text=text_file.read(), prompt_id_refs=prompt_id_refs)
+        correction_ids.append(correction.correction_id)
+    print(f"Created {len(correction_ids)} corrections from {corpus_dir}")
+    return correction_ids
+
+
+async def run(args):
+    with get_db_context() as db:
+        runner = BatchRunner(db=db, llm_model_name=LLM_MODEL_NAME, poll_interval=args.poll_seconds)
+        correction_ids = args.correction_ids
+        if args.corpus:
+            correction_ids = correction_ids + create_corpus_corrections(runner, args.corpus, args.prompts.split(",") if args.prompts else [])
+        jobs = await runner.run(correction_ids=correction_ids)
+        for job in jobs:
+            print(json.dumps(runner.report(job), default=str))
+
+
+def status(args):
+    with get_db_context() as db:
+        runner = BatchRunner(db=db, llm_model_name=LLM_MODEL_NAME)
+        for job in runner.get_jobs(limit=args.limit):
+            print(json.dumps(runner.report(job), default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Submit pending steps in batch jobs and wait until they are ingested.")
+    run_parser.add_argument("--corpus", help="Directory of .txt files to create corrections from.")
+    run_parser.add_argument("--prompts", help="Comma-separated prompt refs for the corpus corrections (default: all enabled prompts).")
+    run_parser.add_argument("--correction-ids", type=int, nargs="+", default=[], help="Run the pending steps of these corrections.")
+    run_parser.add_argument("--poll-seconds", type=float, default=LLM_BATCH_POLL_SECONDS)
+    status_parser = subparsers.add_parser("status", help="Report cost and throughput of the latest batch jobs.")
+    status_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    if args.command == "run" and not args.correction_ids and not args.corpus:
+        # Pending steps of other corrections belong to the workers.
+        parser.error("run needs --correction-ids or --corpus")
+
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        status(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of the paragraph splitter used when creating correction steps.
+
+Compares split_text_into_paragraphs (one finditer pass) with the previous implementation, which
+searched a copy of the remaining text for every paragraph, and iter_paragraphs over a memory-mapped
+file, on synthetic documents of the given sizes. Checks that all of them produce the same paragraphs.
+
+Usage (from backend/):
+    python -m benchmarks.bench_paragraph_splitter --sizes-mb 1 10 50
+"""
+import argparse
+import mmap
+import random
+import re
+import tempfile
+import time
+
+from src.services.text_utils import split_text_into_paragraphs, iter_paragraphs
+
+
+def split_text_into_paragraphs_legacy(text):
+    paragraphs_with_offsets = []
+    if not text.strip():
+        return []
+
+    start_offset = 0
+    while start_offset < len(text):
+        end_of_paragraph_marker = re.search(r'\n\s*\n', text[start_offset:])
+        if end_of_paragraph_marker:
+            paragraph_text = text[start_offset:start_offset + end_of_paragraph_marker.start()]
+            next_para_start_offset = start_offset + end_of_paragraph_marker.end()
+        else:
+            paragraph_text = text[start_offset:]
+            next_para_start_offset = len(text)
+        if paragraph_text.strip():
+            paragraphs_with_offsets.append((paragraph_text, start_offset))
+        start_offset = next_para_start_offset
+    return paragraphs_with_offsets
+
+
+def make_document(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    separators = ["\n\n", "\n\n\n", "\n  \n", "\n\t\n\n"]
+    sentence = "The quick brown fox jumps over the lazy dog, as described in Section 2. "
+    target_size = int(size_mb * 1_000_000)
+    parts, size = [], 0
+    while size < target_size:
+        paragraph = sentence * rng.randint(1, 12) + rng.choice(separators)
+        parts.append(paragraph)
+        size += len(paragraph)
+    return "".join(parts)
+
+
+def split_memory_mapped(path: str):
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # Only the paragraph count is kept, as a streaming consumer would.
+        return sum(1 for _ in iter_paragraphs(mapped))
+
+
+def timed(function, *args, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--skip-legacy-above", type=float, default=2, help="Do not run the quadratic splitter above this size (MB).")
+    args = parser.parse_args()
+
+    print(f"{'size (MB)':>9} {'paragraphs':>11} {'finditer (s)':>13} {'mmap stream (s)':>16} {'legacy (s)':>11} {'speedup':>8}")
+    for size_mb in args.sizes_mb:
+        text = make_document(size_mb)
+        split_time, paragraphs = timed(split_text_into_paragraphs, text)
+
+        with tempfile.NamedTemporaryFile(suffix=".txt") as file:
+            file.write(text.encode("utf-8"))
+            file.flush()
+            stream_time, streamed_count = timed(split_memory_mapped, file.name)
+        assert streamed_count == len(paragraphs), "Streaming splitter disagrees"
+
+        if size_mb > args.skip_legacy_above:
+            print(f"{size_mb:>9g} {len(paragraphs):>11} {split_time:>13.4f} {stream_time:>16.4f} {'-':>11} {'-':>8}")
+            continue
+
+        legacy_time, legacy_paragraphs = timed(split_text_into_paragraphs_legacy, text, repeat=1)
+        assert paragraphs == legacy_paragraphs, "Splitters disagree"
+        print(f"{size_mb:>9g} {len(paragraphs):>11} {split_time:>13.4f} {stream_time:>16.4f} {legacy_time:>11.4f} {legacy_time / split_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
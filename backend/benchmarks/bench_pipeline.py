@@ -0,0 +1,278 @@
+"""
+End-to-end benchmark of the correction pipeline, runnable offline: synthetic documents, the mock LLM
+backend (lognormal latency and injected failures, see LLM_MOCK_* in config.py) and a local Postgres.
+
+Runs three phases over --jobs documents and reports, per phase, latency percentiles, SQL statements
+per job and (with --memory) the tracemalloc peak:
+    submit   CorrectionService.create_new_correction, one job after the other
+    run      CorrectionService.run_correction, all jobs released at once, --concurrency at a time;
+             job latency is from the release to completion, and steps/sec is over the whole phase
+    results  CorrectionService.get_correction_results, one job after the other
+
+The results are written as JSON (--output) together with the commit and parameters, and --compare
+prints the change of the headline numbers against an earlier results file.
+
+The tables are created if needed and the benchmark prompts are added (bench_*); point POSTGRES_DB at
+a scratch database. The LLM response cache is off unless --llm-cache, so repeated runs do the same work.
+
+Usage (from backend/):
+    LLM_MOCK_LATENCY_MEDIAN_SECONDS=0.2 python -m benchmarks.bench_pipeline --jobs 20 --paragraphs 30 --output bench.json
+    python -m benchmarks.bench_pipeline --jobs 20 --paragraphs 30 --rpm 600 --llm-concurrency 20 --compare bench.json
+"""
+from typing import List, Dict, Any, Optional
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+
+from config import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_BURST, CONCURRENT_LLM_CALLS, LLM_MOCK_SEED
+from src.models import Prompt, CorrectionStep, CorrectionStatusEnum, InputGranularityEnum
+from src.utils import init_db, engine, async_engine, get_db_context, count_queries
+from src.services.correction import CorrectionService
+from src.services.llm_backends import MOCK_PROVIDER, get_backend, parse_model_name
+from src.services.llm_cache import llm_response_cache
+from src.services.llm_resilience import llm_call_metrics
+from src.services.llm_scheduler import LocalRateLimiter, llm_scheduler
+
+BENCH_PROMPT_TEXT = """\
+## ROLE:
+You are a meticulous copy editor.
+
+## TASK:
+Find spelling, grammar and punctuation errors in the TEXT below.
+
+## INSTRUCTIONS:
+Report each error with the snippet, the sentence containing it, the issue and a revision.
+
+## TEXT:
+{{ input_text }}"""
+
+VOCABULARY = ("analysis", "measurement", "participants", "distribution", "significant", "observation", "behaviour", "population",
+              "the", "of", "and", "a", "to", "in", "is", "that", "for", "it", "as", "with", "on", "by", "we", "were", "this")
+
+
+def make_document(paragraphs: int, words_per_paragraph: int, seed: int) -> str:
+    """Paragraphs of sentences of 8 to 20 words; the long words give the mock LLM issues to report."""
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) ** 0.5 for rank in range(len(VOCABULARY))]
+    document = []
+    for _ in range(paragraphs):
+        sentences, word_count = [], 0
+        while word_count < words_per_paragraph:
+            length = rng.randint(8, 20)
+            words = rng.choices(VOCABULARY, weights=weights, k=length)
+            sentences.append(" ".join(words).capitalize() + ".")
+            word_count += length
+        document.append(" ".join(sentences))
+    return "\n\n".join(document)
+
+
+def ensure_bench_prompts(granularities: List[InputGranularityEnum]) -> List[str]:
+    """Adds one bench_<granularity> prompt per granularity if missing; returns their refs."""
+    refs = [f"bench_{granularity.value}" for granularity in granularities]
+    with get_db_context() as db:
+        existing = {prompt.prompt_id_ref for prompt in db.query(Prompt).filter(Prompt.prompt_id_ref.in_(refs))}
+        for ref, granularity in zip(refs, granularities):
+            if ref not in existing:
+                db.add(Prompt(prompt_id_ref=ref, description=f"Benchmark prompt ({granularity.value})", text=BENCH_PROMPT_TEXT,
+                              input_granularity=granularity, is_enabled=True))
+    return refs
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+    return {"count": len(ordered), "mean": sum(ordered) / len(ordered), "p50": percentile(50), "p90": percentile(90),
+            "p95": percentile(95), "p99": percentile(99), "max": ordered[-1]}
+
+
+@contextmanager
+def measure(memory: bool):
+    """Counts the statements sent on both engines inside the block, and traces allocations if memory is set."""
+    stats: Dict[str, Any] = {}
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        sync_queries = stack.enter_context(count_queries(engine))
+        async_queries = stack.enter_context(count_queries(async_engine))
+        try:
+            yield stats
+        finally:
+            stats["wall_seconds"] = time.perf_counter() - started
+            stats["queries"] = sync_queries.count + async_queries.count
+            if memory:
+                stats["peak_memory_mib"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+
+
+def submit_jobs(documents: List[str], prompt_id_refs: List[str], model_name: str, memory: bool) -> Dict[str, Any]:
+    correction_ids, latencies = [], []
+    with measure(memory) as stats, get_db_context() as db:
+        service = CorrectionService(db=db, llm_model_name=model_name)
+        for document in documents:
+            started = time.perf_counter()
+            correction_ids.append(service.create_new_correction(original_text=document, prompt_id_refs=prompt_id_refs).correction_id)
+            latencies.append(time.perf_counter() - started)
+    with get_db_context() as db:
+        steps = db.query(CorrectionStep).filter(CorrectionStep.correction_id.in_(correction_ids)).count()
+    return {"correction_ids": correction_ids, "steps": steps, "latency_seconds": summarize(latencies), **stats}
+
+
+async def run_jobs(correction_ids: List[int], model_name: str, concurrency: int, memory: bool) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def run_job(correction_id: int, released_at: float):
+        async with semaphore:
+            # One session per job, as with the workers.
+            with get_db_context() as db:
+                await CorrectionService(db=db, llm_model_name=model_name).run_correction(correction_id=correction_id)
+        latencies.append(time.perf_counter() - released_at)
+
+    with measure(memory) as stats:
+        released_at = time.perf_counter()
+        await asyncio.gather(*(run_job(correction_id, released_at) for correction_id in correction_ids))
+    with get_db_context() as db:
+        step_statuses = [status for (status,) in db.query(CorrectionStep.status).filter(CorrectionStep.correction_id.in_(correction_ids))]
+    completed = sum(status == CorrectionStatusEnum.COMPLETED for status in step_statuses)
+    return {
+        "job_latency_seconds": summarize(latencies),
+        "completed_steps": completed,
+        "failed_steps": sum(status == CorrectionStatusEnum.FAILED for status in step_statuses),
+        "steps_per_second": completed / stats["wall_seconds"],
+        **stats,
+    }
+
+
+def fetch_results(correction_ids: List[int], model_name: str, memory: bool) -> Dict[str, Any]:
+    latencies, issues = [], 0
+    with measure(memory) as stats, get_db_context() as db:
+        service = CorrectionService(db=db, llm_model_name=model_name)
+        for correction_id in correction_ids:
+            started = time.perf_counter()
+            results = service.get_correction_results(correction_id=correction_id)
+            latencies.append(time.perf_counter() - started)
+            issues += sum(len(segment.issues) for segment in results.rich_segments or [])
+    return {"latency_seconds": summarize(latencies), "issues": issues, **stats}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    llm_response_cache.enabled = args.llm_cache
+    llm_scheduler.rate_limiter = LocalRateLimiter(requests_per_minute=args.rpm, tokens_per_minute=RATE_LIMIT_TPM, burst=RATE_LIMIT_BURST)
+    llm_scheduler.max_concurrency = args.llm_concurrency
+    llm_scheduler.concurrency_limit = float(args.llm_concurrency)
+
+    init_db()
+    prompt_id_refs = ensure_bench_prompts([InputGranularityEnum(granularity) for granularity in args.granularities])
+    documents = [make_document(args.paragraphs, args.words_per_paragraph, seed=args.seed + i) for i in range(args.jobs)]
+
+    submit = submit_jobs(documents, prompt_id_refs, args.model, args.memory)
+    correction_ids = submit.pop("correction_ids")
+    run = await run_jobs(correction_ids, args.model, args.concurrency, args.memory)
+    results = fetch_results(correction_ids, args.model, args.memory)
+    for phase in (submit, run, results):
+        phase["queries_per_job"] = phase["queries"] / len(correction_ids)
+
+    provider, _ = parse_model_name(args.model)
+    return {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parameters": {**vars(args), "mock_seed": LLM_MOCK_SEED, "document_chars": sum(map(len, documents)) // len(documents)},
+        "submit": submit,
+        "run": run,
+        "results": results,
+        "llm_calls": llm_call_metrics.stats(),
+        "mock_backend": get_backend(MOCK_PROVIDER).stats() if provider == MOCK_PROVIDER else None,
+        # ru_maxrss is in KiB on Linux.
+        "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+# (label, path in the results, whether higher is better)
+HEADLINE_METRICS = [
+    ("submit p50 (s)", ("submit", "latency_seconds", "p50"), False),
+    ("submit queries/job", ("submit", "queries_per_job"), False),
+    ("job latency p50 (s)", ("run", "job_latency_seconds", "p50"), False),
+    ("job latency p95 (s)", ("run", "job_latency_seconds", "p95"), False),
+    ("steps/sec", ("run", "steps_per_second"), True),
+    ("run queries/job", ("run", "queries_per_job"), False),
+    ("results p50 (s)", ("results", "latency_seconds", "p50"), False),
+    ("results queries/job", ("results", "queries_per_job"), False),
+    ("submit peak MiB", ("submit", "peak_memory_mib"), False),
+    ("run peak MiB", ("run", "peak_memory_mib"), False),
+    ("results peak MiB", ("results", "peak_memory_mib"), False),
+]
+
+
+def _lookup(results: Dict[str, Any], path) -> Optional[float]:
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def print_comparison(baseline: Dict[str, Any], current: Dict[str, Any]):
+    print(f"{'metric':<22} {baseline.get('commit') or 'baseline':>12} {current.get('commit') or 'current':>12} {'change':>9}")
+    for label, path, higher_is_better in HEADLINE_METRICS:
+        before, after = _lookup(baseline, path), _lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before:+.1%}" if before else "-"
+        worse = (after < before) if higher_is_better else (after > before)
+        print(f"{label:<22} {before:>12.4g} {after:>12.4g} {change:>9}{'  worse' if worse and before and abs(after - before) / before > 0.1 else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per document.")
+    parser.add_argument("--words-per-paragraph", type=int, default=80)
+    parser.add_argument("--granularities", nargs="+", default=["paragraph", "whole_text"], choices=[g.value for g in InputGranularityEnum],
+                        help="One benchmark prompt per granularity is applied to every document.")
+    parser.add_argument("--model", default=MOCK_PROVIDER, help="LLM model, e.g. mock, or openai:mock against src/services/mock_llm_server.py.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs run at the same time in the run phase.")
+    parser.add_argument("--rpm", type=int, default=RATE_LIMIT_RPM, help="LLM requests per minute (default: RATE_LIMIT_RPM).")
+    parser.add_argument("--llm-concurrency", type=int, default=CONCURRENT_LLM_CALLS, help="Concurrent LLM calls (default: CONCURRENT_LLM_CALLS).")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache on.")
+    parser.add_argument("--memory", action="store_true", help="Trace allocations for the peak memory of each phase (slows the phases down).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic documents; the mock LLM uses LLM_MOCK_SEED.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    print(json.dumps({phase: results[phase] for phase in ("submit", "run", "results")}, indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_comparison(json.load(baseline_file), results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark of the rich-segment builder used by CorrectionService.get_correction_results.
+
+Compares build_rich_segments (sweep line) with the previous implementation, which checked every
+issue for every segment, on synthetic documents, and checks that both produce the same segments.
+
+Usage (from backend/):
+    python -m benchmarks.bench_rich_segments --issues 100 1000 5000
+"""
+import argparse
+import random
+import time
+
+from src.schemas.schemas_api import RichSegment, RichSegmentIssue
+from src.services.text_utils import build_rich_segments
+
+
+def build_rich_segments_legacy(original_text, located_issues):
+    points = {0, len(original_text)}
+    for start, end, _ in located_issues:
+        if start is not None and end >= 0 and start < end:
+            points.add(start)
+            points.add(end)
+    unique_sorted_points = sorted(points)
+
+    rich_segments = []
+    for i in range(len(unique_sorted_points) - 1):
+        start_char = unique_sorted_points[i]
+        end_char = unique_sorted_points[i + 1]
+        issues_for_segment = [issue for start, end, issue in located_issues if start <= start_char and end >= end_char]
+        rich_segments.append(RichSegment(text=original_text[start_char:end_char], start_char=start_char, end_char=end_char, issues=issues_for_segment))
+    rich_segments.sort()
+    return rich_segments
+
+
+def make_document(issue_count: int, seed: int = 0):
+    rng = random.Random(seed)
+    text = "lorem ipsum dolor sit amet " * max(100, issue_count * 4)
+    located_issues = []
+    for i in range(issue_count):
+        if rng.random() < 0.05:
+            located_issues.append((-1, -1, RichSegmentIssue(prompt_id_ref="p", issue=f"issue {i}", revision="r")))
+            continue
+        start = rng.randrange(0, len(text) - 200)
+        end = start + rng.randint(1, 200)
+        located_issues.append((start, end, RichSegmentIssue(prompt_id_ref=f"p{i % 5}", issue=f"issue {i}", revision="r")))
+    return text, located_issues
+
+
+def timed(function, *args, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--skip-legacy-above", type=int, default=5000, help="Do not run the quadratic builder above this issue count.")
+    args = parser.parse_args()
+
+    print(f"{'issues':>8} {'segments':>9} {'sweep (s)':>10} {'legacy (s)':>11} {'speedup':>8}")
+    for issue_count in args.issues:
+        text, located_issues = make_document(issue_count)
+        sweep_time, segments = timed(build_rich_segments, text, located_issues)
+        if issue_count > args.skip_legacy_above:
+            print(f"{issue_count:>8} {len(segments):>9} {sweep_time:>10.4f} {'-':>11} {'-':>8}")
+            continue
+
+        legacy_time, legacy_segments = timed(build_rich_segments_legacy, text, located_issues, repeat=1)
+        assert [segment.model_dump() for segment in segments] == [segment.model_dump() for segment in legacy_segments], "Builders disagree"
+        print(f"{issue_count:>8} {len(segments):>9} {sweep_time:>10.4f} {legacy_time:>11.4f} {legacy_time / sweep_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
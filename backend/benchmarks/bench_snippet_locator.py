@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of the snippet locator used to turn LLM issues into text offsets.
+
+Compares SegmentSnippetLocator with the previous implementation (str.find on the sentence context,
+then on the snippet) on a synthetic whole-text segment. The issues mimic LLM output: some repeat a
+snippet that occurs several times, some echo the text with altered whitespace, quotes or a typo.
+Reports the time and how many issues were located at their true position.
+
+Usage (from backend/):
+    python -m benchmarks.bench_snippet_locator --issues 100 1000 5000
+"""
+import argparse
+import random
+import time
+
+from src.services.text_utils import SegmentSnippetLocator
+
+COMMON_WORDS = ["the", "of", "and", "a", "to", "in", "is", "that", "for", "it", "as", "with", "on", "by"]
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    """A few very frequent words and a long tail, roughly like natural text."""
+    tail = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10))) for _ in range(size)]
+    words = COMMON_WORDS + tail
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+
+def locate_snippet_in_segment_legacy(segment_text, segment_global_start_offset, snippet, sentence_context):
+    full_sentence_context_start_pos = segment_text.find(sentence_context)
+    if full_sentence_context_start_pos == -1:
+        snippet_start_pos = segment_text.find(snippet)
+    else:
+        full_sentence_context = segment_text[full_sentence_context_start_pos:full_sentence_context_start_pos + len(sentence_context)]
+        snippet_start_pos = full_sentence_context_start_pos + full_sentence_context.find(snippet)
+    if snippet_start_pos == -1:
+        return -1, -1
+    return segment_global_start_offset + snippet_start_pos, segment_global_start_offset + snippet_start_pos + len(snippet)
+
+
+def perturb(text: str, rng: random.Random) -> str:
+    """Alters a context the way LLMs tend to when echoing it."""
+    choice = rng.random()
+    if choice < 0.4:
+        return text.replace(" ", "  ", 1).replace("\n", " ")
+    if choice < 0.7:
+        return text.replace('"', "“", 1)
+    position = rng.randrange(len(text) - 1)
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def make_document(issue_count: int, seed: int = 0):
+    rng = random.Random(seed)
+    vocabulary, weights = make_vocabulary(5000, rng)
+    sentences, issues, offset = [], [], 0
+    for i in range(issue_count):
+        words = rng.choices(vocabulary, weights, k=rng.randint(8, 20))
+        words[rng.randrange(len(words))] = f'"{rng.choice(vocabulary)}"'
+        # Every fifth sentence repeats a word, and the LLM reports both occurrences as separate issues.
+        repeated = i % 5 == 0
+        if repeated:
+            words[1] = words[-2] = f"teh{i}"
+        sentence = " ".join(words).capitalize() + "."
+        sentences.append(sentence)
+
+        snippet_words = [1, len(words) - 2] if repeated else [rng.randrange(len(words))]
+        for word_index in snippet_words:
+            snippet = words[word_index]
+            start = offset + len(" ".join(words[:word_index])) + (1 if word_index > 0 else 0)
+            context = perturb(sentence, rng) if rng.random() < 0.3 else sentence
+            issues.append((snippet, context, start, start + len(snippet)))
+        offset += len(sentence) + (2 if i % 4 == 3 else 1)
+        sentences.append("\n\n" if i % 4 == 3 else " ")
+    return "".join(sentences), issues
+
+
+def run_legacy(text, issues):
+    return [locate_snippet_in_segment_legacy(text, 0, snippet, context) for snippet, context, _, _ in issues]
+
+
+def run_locator(text, issues):
+    locator = SegmentSnippetLocator(text, 0)
+    return [locator.locate(snippet, context) for snippet, context, _, _ in issues]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    print(f"{'issues':>8} {'chars':>9} {'locator (s)':>12} {'correct':>8} {'lost':>6} {'legacy (s)':>11} {'correct':>8} {'lost':>6}")
+    for issue_count in args.issues:
+        text, issues = make_document(issue_count)
+        rows = []
+        for function in (run_locator, run_legacy):
+            elapsed, spans = timed(function, text, issues)
+            correct = sum(span == (start, end) for span, (_, _, start, end) in zip(spans, issues))
+            lost = sum(span == (-1, -1) for span in spans)
+            rows.append(f"{elapsed:>12.4f} {correct:>8} {lost:>6}")
+        print(f"{len(issues):>8} {len(text):>9} {rows[0]} {rows[1][1:]}")
+
+
+if __name__ == "__main__":
+    main()
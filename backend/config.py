@@ -14,9 +14,153 @@ print(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, GOOGLE_API_KEY)
 
 # Construct database URL with psycopg2 adapter
 SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# The API and the workers use asyncpg so that database I/O does not block the event loop driving the LLM calls.
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-LLM_MODEL_NAME = "gemini-2.5-pro" # This is likely the best model for this task.
+# Connection pools, one per engine (sync and async) and process. The API handlers, the step writer
+# flushes and the worker's queue operations each check out a connection for a short transaction only.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10')) # Extra connections opened under load and closed when returned.
+DB_POOL_TIMEOUT_SECONDS = 30 # How long a checkout waits for a free connection before failing.
+DB_POOL_RECYCLE_SECONDS = 1800 # Replace connections older than this, before the server or a proxy drops them.
+DB_POOL_PRE_PING = True # Test connections on checkout and transparently replace dead ones.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000')) # 0 disables the timeout.
+# Set when connecting through PgBouncer in transaction pooling mode: PgBouncer does the pooling, so the
+# engines open a connection per checkout, and asyncpg's prepared statement caches are turned off.
+# Startup parameters are not forwarded, so set statement_timeout on the database role instead.
+DB_PGBOUNCER_MODE = os.getenv('DB_PGBOUNCER_MODE', 'false').lower() == 'true'
+
+# Default model; a prompt can override it with Prompt.model_name. Names may carry a provider prefix,
+# "openai:<model>" or "mock" (see src/services/llm_backends.py); unprefixed names are Gemini models.
+LLM_MODEL_NAME = os.getenv('LLM_MODEL_NAME', "gemini-2.5-pro") # This is likely the best model for this task.
 # LLM_MODEL_NAME="gemini-2.5-flash-preview-05-20"
 # LLM_MODEL_NAME="gemini-1.5-flash-8b" # This is the cheapest model.
+# Any server implementing the OpenAI chat completions API, e.g. vLLM or src/services/mock_llm_server.py.
+LLM_OPENAI_BASE_URL = os.getenv('LLM_OPENAI_BASE_URL', 'https://api.openai.com/v1')
+LLM_OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+LLM_HTTP_TIMEOUT_SECONDS = 300
+# Mock backend for offline load tests: lognormal latency around the median, and injected failures.
+LLM_MOCK_LATENCY_MEDIAN_SECONDS = float(os.getenv('LLM_MOCK_LATENCY_MEDIAN_SECONDS', '1.0'))
+LLM_MOCK_LATENCY_SIGMA = float(os.getenv('LLM_MOCK_LATENCY_SIGMA', '0.5'))
+LLM_MOCK_ERROR_RATE = float(os.getenv('LLM_MOCK_ERROR_RATE', '0.0')) # Share of calls failing with a server error
+LLM_MOCK_RATE_LIMIT_RATE = float(os.getenv('LLM_MOCK_RATE_LIMIT_RATE', '0.0')) # Share of calls rejected with a 429
+LLM_MOCK_SEED = int(os.getenv('LLM_MOCK_SEED', '0'))
 RATE_LIMIT_RPM = 50
-CONCURRENT_LLM_CALLS = 10
\ No newline at end of file
+RATE_LIMIT_TPM = 1_000_000 # Input tokens per minute, estimated with CHARS_PER_TOKEN.
+RATE_LIMIT_BURST = 5 # Requests that may be sent back to back before RATE_LIMIT_RPM pacing kicks in.
+CONCURRENT_LLM_CALLS = 10 # Upper bound; the scheduler lowers it while the backend answers with 429s (AIMD).
+LLM_MIN_CONCURRENCY = 1
+LLM_AIMD_DECREASE_FACTOR = 0.5
+LLM_AIMD_DECREASE_COOLDOWN_SECONDS = 5.0 # 429s within this window count as one signal.
+# Retries of a failed LLM call, by error class (see src/services/llm_resilience.py). Backoff is
+# exponential with full jitter; a delay asked for by the backend (retry-after) is honoured.
+LLM_MAX_ATTEMPTS = 3 # Timeouts, connection errors and 5xx
+LLM_RATE_LIMIT_MAX_ATTEMPTS = 6 # 429s
+LLM_SCHEMA_MAX_ATTEMPTS = 2 # Answers that do not validate against the response schema
+LLM_RETRY_BASE_DELAY_SECONDS = 3
+LLM_RETRY_MAX_DELAY_SECONDS = 60
+# Per-model circuit breaker: after this many consecutive transient failures, calls to the model
+# fail fast for LLM_CIRCUIT_RESET_SECONDS, then a single probe call decides whether to resume.
+LLM_CIRCUIT_FAILURE_THRESHOLD = 5
+LLM_CIRCUIT_RESET_SECONDS = 30
+# Hedging: a call still running after the LLM_HEDGE_PERCENTILE latency of its model (over its last
+# LLM_HEDGE_WINDOW calls) gets a duplicate, and the first answer wins. At most LLM_HEDGE_MAX_RATIO of the calls are hedged.
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'false').lower() == 'true'
+LLM_HEDGE_PERCENTILE = 95
+LLM_HEDGE_WINDOW = 200
+LLM_HEDGE_MIN_SAMPLES = 20 # No hedging until this many latencies are known.
+LLM_HEDGE_MAX_RATIO = 0.1
+# Fallback tiers: models tried in turn for a step whose model gave up after its retries (or whose circuit is open).
+# The model that answered is recorded on the step (CorrectionStep.llm_model_name).
+LLM_FALLBACK_MODELS = {
+    "gemini-2.5-pro": ["gemini-2.5-flash"],
+}
+CHARS_PER_TOKEN = 4
+# Token budget of a step for 'chunk' prompts, and how much of the previous chunk is repeated at its start.
+CHUNK_MAX_TOKENS = 2000
+CHUNK_OVERLAP_TOKENS = 100
+# Fused mode: the prompts of a correction that look at the same segment are answered by one LLM call
+# with a composite response schema, instead of one call per prompt (see src/services/prompt_fusion.py).
+LLM_FUSED_PROMPTS_ENABLED = os.getenv('LLM_FUSED_PROMPTS_ENABLED', 'false').lower() == 'true'
+LLM_FUSED_MAX_PROMPTS = 6
+# Context caching: a prompt prefix shared by several pending steps of a correction (the whole text under
+# several whole-text prompts, or long static instructions) is uploaded once as provider-side cached
+# content and referenced by each step (see src/services/llm_context_cache.py). Gemini only caches
+# contents of at least 4096 tokens for 2.5 Pro (1024 for 2.5 Flash); smaller prefixes are sent inline.
+LLM_CONTEXT_CACHE_ENABLED = os.getenv('LLM_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CONTEXT_CACHE_MIN_TOKENS = 4096
+LLM_CONTEXT_CACHE_MIN_USES = 2 # Pending steps that must share a prefix before it is worth uploading.
+LLM_CONTEXT_CACHE_TTL_SECONDS = 3600 # Deleted when the correction completes; the TTL only bounds leaks.
+# Answers LLM calls with the deterministic in-process client of src/services/fake_genai.py, e.g. for local runs without an API key.
+LLM_FAKE_CLIENT = os.getenv('LLM_FAKE_CLIENT', 'false').lower() == 'true'
+# "local" paces the LLM calls of this process only; "postgres" shares the budget between all
+# workers pointing at the same database (e.g. several uvicorn workers).
+LLM_RATE_LIMITER_BACKEND = os.getenv('LLM_RATE_LIMITER_BACKEND', 'local')
+# CONCURRENT_LLM_CALLS is enforced per process. With the postgres rate limiter it is split between the processes
+# sharing the budget: set this to their number across all nodes (worker.py counts at least its own --processes).
+LLM_SHARED_PROCESSES = int(os.getenv('LLM_SHARED_PROCESSES', '1'))
+
+# Enabled prompts are kept in memory per process (see src/services/prompt_registry.py) and reloaded
+# when the prompts table changes, which is checked at most this often.
+PROMPT_REGISTRY_REFRESH_SECONDS = 5.0
+PROMPT_TEMPLATE_CACHE_SIZE = 512 # Compiled Jinja templates, keyed by prompt text
+
+# Cache of validated LLM responses keyed on (model, rendered prompt, response schema).
+LLM_CACHE_ENABLED = True
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+LLM_CACHE_MAX_MEMORY_ENTRIES = 2048 # In-process LRU in front of the llm_response_cache table.
+LLM_CACHE_MAX_DB_ENTRIES = 100_000
+LLM_CACHE_EVICTION_INTERVAL = 100 # Run TTL/size eviction on the table every N writes.
+LLM_CACHE_TOUCH_INTERVAL_SECONDS = 60 # Hits update hit_count and last_accessed_at in the table at most this often, in one statement.
+
+# Job queue and worker (see worker.py). Steps are leased to a worker, which renews the lease with
+# heartbeats; steps of a worker that died are requeued once their lease expires.
+JOB_LEASE_SECONDS = 300
+JOB_HEARTBEAT_SECONDS = 30
+JOB_MAX_ATTEMPTS = 3
+WORKER_POLL_SECONDS = 1.0
+WORKER_MAX_IN_FLIGHT_STEPS = 2 * CONCURRENT_LLM_CALLS
+WORKER_DRAIN_TIMEOUT_SECONDS = 120
+
+# Batch mode for large offline runs (see batch.py): pending steps are sent through the provider's batch
+# API, which is cheaper and not subject to RATE_LIMIT_RPM, and their results are ingested in bulk.
+LLM_BATCH_DIR = os.getenv('LLM_BATCH_DIR', os.path.join(PROJECT_DIR, 'batch_jobs')) # Input and output JSONL files
+LLM_BATCH_MAX_STEPS = 10_000 # Steps per batch job
+LLM_BATCH_POLL_SECONDS = 30
+LLM_BATCH_LEASE_SECONDS = 48 * 60 * 60 # Steps of a batch are leased until it is ingested; Gemini batches finish within 24h.
+LLM_BATCH_COST_FACTOR = 0.5 # Batch price relative to interactive calls
+LLM_MOCK_BATCH_SECONDS = float(os.getenv('LLM_MOCK_BATCH_SECONDS', '5')) # Time the mock backend takes to run a batch
+# USD per million (input, output) tokens of interactive calls, for the cost metrics and the cost reports of batch jobs.
+LLM_PRICES_PER_MILLION_TOKENS = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+}
+
+# Finished steps are buffered and persisted in batches (see src/services/step_writer.py).
+STEP_WRITER_BATCH_SIZE = 50
+STEP_WRITER_FLUSH_SECONDS = 1.0
+
+# Completed corrections keep their results as gzip-compressed JSON (see src/services/results_snapshot.py),
+# served as stored to clients accepting gzip. Other API responses above the minimum size are gzipped on the fly.
+RESULTS_SNAPSHOT_GZIP_LEVEL = 9 # Compressed once per correction, so the smallest payload is worth the CPU
+RESPONSE_GZIP_MINIMUM_BYTES = 1024
+RESPONSE_GZIP_LEVEL = 5
+
+# Clients showing part of a long document fetch windows of its results, in pages of at most this many segments.
+RESULTS_PAGE_MAX_SEGMENTS = 5000
+
+# Observability (see src/services/telemetry.py). The API serves Prometheus metrics at /metrics, and each
+# worker process on WORKER_METRICS_PORT + its index if set. With OTEL_ENABLED, OpenTelemetry spans (API
+# request, step, LLM attempt, step persistence) are exported over OTLP, configured with the standard
+# OTEL_EXPORTER_OTLP_* variables; this needs the opentelemetry-sdk and opentelemetry-exporter-otlp packages.
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '0'))
+OTEL_ENABLED = os.getenv('OTEL_ENABLED', 'false').lower() == 'true'
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'llm-editor')
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300) # Seconds
+
+# How workers tell the API that steps finished: "postgres" uses LISTEN/NOTIFY and works across
+# processes and nodes. "memory" only reaches streams served by the process running the steps, and the
+# API never runs steps itself, so it only suits code running steps next to the streams in one process
+# (e.g. tests calling run_correction on the app's event loop); worker.py rejects it.
+CORRECTION_EVENTS_BACKEND = os.getenv('CORRECTION_EVENTS_BACKEND', 'postgres')
+CORRECTION_STREAM_REFRESH_SECONDS = 15.0 # Streams re-read progress at least this often, which also keeps connections alive.
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+from typing import List, Optional
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+# The tests never touch POSTGRES_DB, where workers would pick up their steps: they run against a throwaway database
+# created for the session and dropped at its end. Set before config.py reads the environment.
+CONFIGURED_DB_NAME = os.getenv("POSTGRES_DB")
+TEST_DB_NAME = os.getenv("POSTGRES_TEST_DB", f"{CONFIGURED_DB_NAME}_test")
+if TEST_DB_NAME == CONFIGURED_DB_NAME:
+    raise RuntimeError(f"POSTGRES_TEST_DB must differ from POSTGRES_DB ({CONFIGURED_DB_NAME}), it is dropped after the tests")
+os.environ["POSTGRES_DB"] = TEST_DB_NAME
+
+from sqlalchemy import select, text
+
+import src.services.llm_interaction as llm_interaction_module
+from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from src.models import Base, Prompt, InputGranularityEnum, CorrectionStep, CorrectionStatusEnum, AnalysisResult
+from src.services.correction import CorrectionService
+from src.services.llm_backends import MockBackend
+from src.services.llm_cache import llm_response_cache
+from src.services.llm_scheduler import llm_scheduler, LocalRateLimiter
+from src.services.prompt_registry import prompt_registry
+from src.utils import engine, async_engine, get_db_context, init_db
+
+TEST_PROMPT_TEXT = """\
+## TASK:
+Find spelling, grammar and punctuation errors in the TEXT below.
+
+## TEXT:
+{{ input_text }}"""
+
+VOCABULARY = ("analysis", "measurement", "participants", "distribution", "significant", "observation",
+              "the", "of", "and", "a", "to", "in", "is", "that", "for", "it", "with", "we", "were", "this")
+
+
+def _execute_on_server(*statements: str):
+    """Runs statements outside a transaction on the server's maintenance database, e.g. CREATE DATABASE."""
+    connection = psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, dbname="postgres")
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    finally:
+        connection.close()
+
+
+@pytest.fixture(scope="session")
+def test_database():
+    """Creates the throwaway database with the tables of src/models.py, and drops it after the session."""
+    _execute_on_server(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}" WITH (FORCE)', f'CREATE DATABASE "{TEST_DB_NAME}"')
+    init_db()
+    yield TEST_DB_NAME
+    engine.dispose()
+    _execute_on_server(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}" WITH (FORCE)')
+
+
+@pytest.fixture
+def database(test_database):
+    """
+    Empties the tables after the test, so every test starts from an empty database. The caches kept per process are
+    emptied too, as they would otherwise answer from rows of earlier tests.
+    """
+    yield test_database
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} CASCADE"))
+    llm_response_cache._memory.clear()
+    llm_response_cache._pending_touches.clear()
+    prompt_registry._version = None
+
+
+@pytest.fixture
+def run():
+    """
+    Runs a coroutine to completion in a new event loop. The pooled connections of the async engine
+    belong to the loop that opened them, so they are disposed of before the loop closes.
+    """
+    def run_coroutine(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return run_coroutine
+
+
+@pytest.fixture
+def mock_backend(monkeypatch):
+    """
+    Answers every LLM call with the mock backend right away, without the pacing of the process-wide scheduler.
+    Its batches finish as soon as they are submitted.
+    """
+    backend = MockBackend(latency_median_seconds=0.0, latency_sigma=0.0, error_rate=0.0, rate_limit_rate=0.0, batch_seconds=0.0)
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    monkeypatch.setattr(llm_scheduler, "rate_limiter", LocalRateLimiter(requests_per_minute=100_000, tokens_per_minute=10**9, burst=1000))
+    return backend
+
+
+@pytest.fixture
+def make_document():
+    """Makes a document of paragraphs of sentences of 8 to 20 words, the same for the same seed."""
+    def make(paragraphs: int, words_per_paragraph: int = 40, seed: int = 0) -> str:
+        rng = random.Random(seed)
+        document = []
+        for _ in range(paragraphs):
+            sentences, word_count = [], 0
+            while word_count < words_per_paragraph:
+                length = rng.randint(8, 20)
+                sentences.append(" ".join(rng.choices(VOCABULARY, k=length)).capitalize() + ".")
+                word_count += length
+            document.append(" ".join(sentences))
+        return "\n\n".join(document)
+    return make
+
+
+@pytest.fixture
+def make_prompts(database):
+    """Adds one enabled test_<granularity> prompt per granularity, and returns their refs."""
+    def make(*granularities: InputGranularityEnum, text: str = TEST_PROMPT_TEXT, model_name: Optional[str] = None) -> List[str]:
+        refs = [f"test_{granularity.value}" for granularity in granularities]
+        with get_db_context() as db:
+            db.add_all(Prompt(prompt_id_ref=ref, description=f"Test prompt ({granularity.value})", text=text,
+                              input_granularity=granularity, model_name=model_name, is_enabled=True)
+                       for ref, granularity in zip(refs, granularities))
+        return refs
+    return make
+
+
+@pytest.fixture
+def prompt_id_refs(make_prompts):
+    return make_prompts(InputGranularityEnum.PARAGRAPH, InputGranularityEnum.WHOLE_TEXT)
+
+
+@pytest.fixture
+def service(database):
+    with get_db_context() as db:
+        yield CorrectionService(db=db, llm_model_name="mock")
+
+
+@pytest.fixture
+def create_completed_correction(service, prompt_id_refs):
+    """
+    Makes a finalized correction with one issue at the start of each step, written directly instead of going through
+    the LLM. Returns its id.
+    """
+    def create(text: str) -> int:
+        correction_id = service.create_new_correction(original_text=text, prompt_id_refs=prompt_id_refs).correction_id
+        steps = service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == correction_id))
+        for step in steps:
+            step.status = CorrectionStatusEnum.COMPLETED
+            step.llm_response = {"issues": []}
+            start = step.original_text_start_char
+            service.db.add(AnalysisResult(correction_step_id=step.correction_step_id, snippet=text[start:start + 5],
+                                          issue="issue", revision="revision",
+                                          original_text_start_char=start, original_text_end_char=start + 5))
+        service.db.commit()
+        service.finalize_corrections(correction_ids=[correction_id])
+        service.db.expire_all()
+        return correction_id
+    return create
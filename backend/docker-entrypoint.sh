@@ -10,7 +10,8 @@ if [ ! -f "$STATE_FILE" ]; then
   # write a timestamp so we can log when init happened
   date > "$STATE_FILE"
 else
-  echo "[entrypoint] init already done on $(cat "$STATE_FILE"), skipping"
+  echo "[entrypoint] init already done on $(cat "$STATE_FILE"), upgrading tables"
+  python /app/init.py --upgrade
 fi
 
 # Hand off to the main process (PID 1)
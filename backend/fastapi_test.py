@@ -1,21 +1,49 @@
 from fastapi.testclient import TestClient
-from main import app
+import pytest
 import time
+import os
+
+import src.services.llm_interaction as llm_interaction_module
+from main import app
+from config import PROJECT_DIR, LLM_MODEL_NAME
+from src.models import InputGranularityEnum
+from src.services.correction import AsyncCorrectionService
+from src.services.fake_genai import FakeGenAIClient
+from src.services.llm_backends import GeminiBackend
+from src.services.llm_scheduler import llm_scheduler, LocalRateLimiter
+from src.utils import get_async_db_context
 
-client = TestClient(app)
+
+@pytest.fixture
+def client(make_prompts, monkeypatch):
+    make_prompts(InputGranularityEnum.PARAGRAPH, InputGranularityEnum.WHOLE_TEXT)
+    # Steps are answered by the deterministic fake client, without pacing.
+    backend = GeminiBackend(client=FakeGenAIClient())
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    monkeypatch.setattr(llm_scheduler, "rate_limiter", LocalRateLimiter(requests_per_minute=100_000, tokens_per_minute=10**9, burst=1000))
+    # Entered, so that every request runs on the same event loop as the app's lifespan and connection pool.
+    with TestClient(app) as client:
+        yield client
 
 def load_text():
-    text_path = '/Users/andrea/Desktop/PhD/llm_editor/frontend/public/text.txt'
+    text_path = os.path.join(PROJECT_DIR, '..', 'frontend', 'public', 'text.txt')
     with open(text_path, 'r') as file:
         text = file.read()
     return text
 
-def test_list_prompts():
+def run_worker(client, correction_id):
+    """Runs the pending steps of a correction on the app's event loop, which is what worker.py does in production."""
+    async def run_correction():
+        async with get_async_db_context() as db:
+            await AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME).run_correction(correction_id=correction_id)
+    client.portal.call(run_correction)
+
+def test_list_prompts(client):
     response = client.get("/api/v1/prompts")
     print(response.json())
     assert response.status_code == 200
 
-def test_create_correction():
+def test_create_correction(client):
     text = load_text()
     list_prompts = client.get("/api/v1/prompts").json()["prompts"]
     prompt_id_refs = [prompt["prompt_id_ref"] for prompt in list_prompts[:5]]
@@ -23,25 +51,29 @@ def test_create_correction():
     print(response.json())
     assert response.status_code == 200
 
-def test_all():
+def test_all(client):
     text = load_text()
     list_prompts = client.get("/api/v1/prompts").json()["prompts"]
     prompt_id_refs = [prompt["prompt_id_ref"] for prompt in list_prompts[:6]]
     response = client.post("/api/v1/corrections", json={"text_content": text, "prompt_id_refs": prompt_id_refs})
     correction_id = response.json()["correction_id"]
+    run_worker(client, correction_id)
 
+    deadline = time.monotonic() + 30
     while True:
         response = client.get(f"/api/v1/corrections/{correction_id}/status")
         print(response.json())
         if response.json()["status"] == "completed":
             break
+        assert time.monotonic() < deadline, "correction did not complete"
         time.sleep(1)
 
     response = client.get(f"/api/v1/corrections/{correction_id}/results")
     print(response.json())
     assert response.status_code == 200
+    assert response.json()["rich_segments"]
 
 
 
 if __name__ == "__main__":
-    test_all()
\ No newline at end of file
+    pytest.main([__file__, "-s"])
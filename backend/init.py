@@ -1,4 +1,8 @@
+import argparse
 import asyncio
+import os
+
+from config import PROJECT_DIR
 
 def test_etl():
     from src.etl.etl import ETLServiceMia
@@ -15,7 +19,7 @@ async def test_correction():
     from src.services.correction import CorrectionService
     from src.utils import get_db_context
     from src.models import Prompt
-    text_path = '/Users/andrea/Desktop/PhD/llm_editor/frontend/public/text.txt'
+    text_path = os.path.join(PROJECT_DIR, '..', 'frontend', 'public', 'text.txt')
     with open(text_path, 'r') as file:
         text = file.read()
 
@@ -40,5 +44,11 @@ def load_prompts_to_db():
         etl_service.load_prompts_from_yaml_to_db()
 
 if __name__ == "__main__":
-    load_prompts_to_db()
+    parser = argparse.ArgumentParser(description="Create the database with the prompts, or upgrade the tables of an existing one.")
+    parser.add_argument("--upgrade", action="store_true", help="Only bring existing tables up to date, keeping their data.")
+    if parser.parse_args().upgrade:
+        from src.utils import upgrade_db
+        upgrade_db()
+    else:
+        load_prompts_to_db()
     # asyncio.run(test_correction())
\ No newline at end of file
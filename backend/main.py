@@ -1,20 +1,35 @@
 
 # src/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+from contextlib import asynccontextmanager
+import time
+from config import RESPONSE_GZIP_MINIMUM_BYTES, RESPONSE_GZIP_LEVEL
 from src.api import router as corrections_router # Your router
-from src.utils import init_db, engine # Your DB init
+from src.utils import init_db, engine, async_engine # Your DB init
 from src.models import Base # Your SQLAlchemy Base
+from src.services.telemetry import metrics_registry, record_http_request, span, PROMETHEUS_CONTENT_TYPE
 
 # Optional: Create DB tables if they don't exist (for development)
 # In production, you'd use migrations (e.g., Alembic)
 # Base.metadata.create_all(bind=engine) # Or call init_db()
 # init_db() # If you prefer your function
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled asyncpg connections belong to the event loop that opened them: the app starts with a new pool (connections
+    # of another loop are left to it rather than closed from this one), and closes its connections before its loop stops.
+    await async_engine.dispose(close=False)
+    yield
+    await async_engine.dispose()
+
 app = FastAPI(
     title="LLM Editor Backend",
     description="API for managing text corrections using LLM prompts.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 app.include_router(corrections_router)
@@ -29,6 +44,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Responses that already have a Content-Encoding (results snapshots) and event streams are passed through.
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_GZIP_MINIMUM_BYTES, compresslevel=RESPONSE_GZIP_LEVEL)
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    started_at = time.monotonic()
+    with span(f"{request.method} {request.url.path}", **{"http.method": request.method, "http.target": request.url.path}) as current_span:
+        response = await call_next(request)
+        if current_span is not None:
+            current_span.set_attribute("http.status_code", response.status_code)
+    # Labelled by route template, so that ids in the path do not make a label value each. Streams are timed until their headers are sent.
+    route = request.scope.get("route")
+    record_http_request(request.method, route.path if route else "unmatched", response.status_code, time.monotonic() - started_at)
+    return response
+
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the LLM Editor API!"}
\ No newline at end of file
+    return {"message": "Welcome to the LLM Editor API!"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of this API process (see src/services/telemetry.py)."""
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
\ No newline at end of file
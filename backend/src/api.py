@@ -1,16 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, status as http_status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status as http_status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import json
 
 # Assuming your modules are structured like this
-from config import LLM_MODEL_NAME
-from src.utils import get_db, logger # Your DB session dependency and logger
-from src.services.correction import CorrectionService # Your service layer
+from config import LLM_MODEL_NAME, RESULTS_PAGE_MAX_SEGMENTS
+from src.utils import get_async_db, get_pool_stats, logger # Your DB session dependency and logger
+from src.services.correction import AsyncCorrectionService # Your service layer
+from src.services.llm_cache import llm_response_cache
+from src.services.llm_scheduler import llm_scheduler
+from src.services.llm_context_cache import llm_context_caches
+from src.services.llm_resilience import llm_call_metrics
+from src.services.prompt_registry import prompt_registry
+from src.services.correction_stream import iter_correction_events
 from src.schemas.schemas_api import ( # Your Pydantic models
-    CorrectionCreateRequest, CorrectionCreateResponse,
-    CorrectionStatusResponse, CorrectionResultResponse, PromptList, Prompt
+    CorrectionCreateRequest, CorrectionCreateResponse, CorrectionRevisionRequest, CorrectionRevisionResponse,
+    CorrectionStatusResponse, CorrectionResultResponse, PromptList, Prompt, SystemStats
 )
-from src.models import Prompt as PromptModel
+
+# Application close codes are 4000-4999; 4404 mirrors HTTP 404.
+WEBSOCKET_CLOSE_NOT_FOUND = 4404
 
 router = APIRouter(
     prefix="/api/v1", # Base prefix for this router
@@ -22,73 +32,219 @@ router = APIRouter(
              summary="Submit text for correction and initiate processing")
 async def create_correction_submission(
     request_data: CorrectionCreateRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db) 
+    db: AsyncSession = Depends(get_async_db) 
 ):
     """
     Submits a piece of text and a list of prompt IDs for correction.
-    The processing is done in the background.
+    The processing is done by the workers (see worker.py), which pick up the pending steps.
     """
     logger.debug(f"Received correction request for {len(request_data.prompt_id_refs)} prompts.")
-    correction_service = CorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
-    correction_create_response = correction_service.create_new_correction(
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    correction_create_response = await correction_service.create_new_correction(
         original_text=request_data.text_content,
         prompt_id_refs=request_data.prompt_id_refs
     )
     if not correction_create_response:
         logger.error("Failed to create correction submission.")
         raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to initiate correction process.")
-    
-    background_tasks.add_task(correction_service.run_correction, correction_id=correction_create_response.correction_id)
+
     return correction_create_response
 
 
+@router.post("/corrections/{correction_id}/revisions",
+             response_model=CorrectionRevisionResponse,
+             summary="Submit an edited version of a corrected text and re-correct only what changed")
+async def create_correction_revision(
+    correction_id: int,
+    request_data: CorrectionRevisionRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Creates a new correction for the edited text. Paragraphs that are unchanged with respect to
+    the parent correction reuse its results; only changed paragraphs are sent to the LLM.
+    """
+    logger.debug(f"Received revision request for correction_id: {correction_id}")
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    revision_response = await correction_service.create_revision(
+        parent_correction_id=correction_id,
+        original_text=request_data.text_content,
+        prompt_id_refs=request_data.prompt_id_refs
+    )
+    if not revision_response:
+        logger.warning(f"Revision requested for non-existent correction_id: {correction_id}")
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail="Correction ID not found.")
+
+    return revision_response
+
+
 @router.get("/corrections/{correction_id}/status",
             response_model=CorrectionStatusResponse,
             summary="Get the status of a correction job")
 async def get_correction_job_status(
     correction_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Retrieves the current status and progress of a correction job.
     """
     logger.debug(f"Fetching status for submission_id: {correction_id}")
-    correction_service = CorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
-    status_data = correction_service.get_correction_status(correction_id=correction_id)
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    status_data = await correction_service.get_correction_status(correction_id=correction_id)
     if not status_data:
         logger.warning(f"Status requested for non-existent correction_id: {correction_id}")
         raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail="Correction ID not found.")
     return status_data
 
 
+@router.get("/corrections/{correction_id}/stream",
+            summary="Stream progress and issues of a correction job as Server-Sent Events")
+async def stream_correction_job(
+    correction_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Streams `issues` events with the located issues of each completed step, `progress` events and a
+    final `completed` event, instead of polling the status endpoint.
+    """
+    logger.debug(f"Streaming events for correction_id: {correction_id}")
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    if not await correction_service.get_correction_status(correction_id=correction_id):
+        logger.warning(f"Stream requested for non-existent correction_id: {correction_id}")
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail="Correction ID not found.")
+
+    async def server_sent_events():
+        async for event, data in iter_correction_events(correction_id=correction_id):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(server_sent_events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/corrections/{correction_id}/ws")
+async def correction_job_websocket(
+    websocket: WebSocket,
+    correction_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    WebSocket variant of the stream endpoint: sends {"event": ..., "data": ...} messages.
+    Unknown correction ids are closed with code 4404, the counterpart of the stream endpoint's 404.
+    """
+    await websocket.accept()
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    if not await correction_service.get_correction_status(correction_id=correction_id):
+        logger.warning(f"WebSocket requested for non-existent correction_id: {correction_id}")
+        await websocket.close(code=WEBSOCKET_CLOSE_NOT_FOUND, reason="Correction ID not found.")
+        return
+    try:
+        async for event, data in iter_correction_events(correction_id=correction_id):
+            await websocket.send_json({"event": event, "data": data})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug(f"WebSocket for correction_id {correction_id} disconnected")
+
+
 @router.get("/corrections/{correction_id}/results",
             response_model=CorrectionResultResponse,
-            summary="Get the results of a completed correction job")
+            summary="Get the results of a completed correction job, or of a window of it")
 async def get_correction_job_results(
     correction_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    start_char: Optional[int] = Query(None, ge=0, description="Start of a character window of the results."),
+    end_char: Optional[int] = Query(None, ge=0, description="End (exclusive) of a character window of the results."),
+    paragraph_start: Optional[int] = Query(None, ge=0, description="First paragraph of a paragraph window of the results."),
+    paragraph_end: Optional[int] = Query(None, ge=0, description="Paragraph after the last one of a paragraph window of the results."),
+    cursor: Optional[int] = Query(None, ge=0, description="next_cursor of the previous page."),
+    limit: Optional[int] = Query(None, ge=1, le=RESULTS_PAGE_MAX_SEGMENTS, description="Maximum number of segments per page."),
+    include_text: bool = Query(True, description="Include the whole original_text."),
+    issues_only: bool = Query(False, description="Only return the segments with issues."),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Retrieves the processed results for a correction job, including rich text segments.
+    Completed corrections are served from the snapshot stored when they completed: the compressed
+    bytes as is to clients accepting gzip, with a strong ETag and 304 Not Modified for If-None-Match.
+
+    With a character or paragraph window, a cursor or limit, include_text=false or issues_only, only
+    that part of the results is looked up and returned, for clients that show part of a long document.
     """
     logger.debug(f"Fetching results for correction_id: {correction_id}")
-    correction_service = CorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
-    result_data = correction_service.get_correction_results(correction_id=correction_id)
+    correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+    window = dict(start_char=start_char, end_char=end_char, paragraph_start=paragraph_start, paragraph_end=paragraph_end, cursor=cursor, limit=limit)
+    if any(value is not None for value in window.values()) or not include_text or issues_only:
+        if (start_char is not None or end_char is not None) and (paragraph_start is not None or paragraph_end is not None):
+            raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="Give either a character or a paragraph window, not both.")
+        result_data = await correction_service.get_correction_results_window(
+            correction_id=correction_id, start_char=start_char or 0, end_char=end_char, paragraph_start=paragraph_start, paragraph_end=paragraph_end,
+            cursor=cursor, limit=limit, include_text=include_text, issues_only=issues_only
+        )
+    else:
+        snapshot = await correction_service.get_results_snapshot(correction_id=correction_id)
+        if snapshot:
+            gzipped = _accepts_gzip(request.headers.get("accept-encoding"))
+            headers = {"ETag": snapshot.get_etag(gzipped), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+            if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+                return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers)
+            if gzipped:
+                return Response(content=snapshot.body, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+            return Response(content=snapshot.decompress(), media_type="application/json", headers=headers)
+        result_data = await correction_service.get_correction_results(correction_id=correction_id)
+
     if not result_data:
         logger.warning(f"Results requested for non-existent correction_id: {correction_id}")
         raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail="Correction ID not found.")
     return result_data
 
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag (weak comparison, as for GET requests)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip, listed itself or as *, with a non-zero q."""
+    qualities = {}
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        quality = params.strip().lower().removeprefix("q=")
+        try:
+            qualities[name.strip().lower()] = float(quality) if quality else 1.0
+        except ValueError:
+            continue
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
 @router.get("/prompts",
             response_model=PromptList,
             summary="List all available and enabled prompts")
 async def list_available_prompts(
-    db: Session = Depends(get_db) 
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db) 
 ):
     """
     Returns a list of all prompts that are currently enabled and can be used for corrections.
+    Served from the in-memory prompt registry, with an ETag: clients sending it back in
+    If-None-Match get an empty 304 Not Modified until the prompts change.
     """
     logger.debug("Fetching list of available prompts.")
-    prompts = db.query(PromptModel).filter(PromptModel.is_enabled == True).all()
-    return PromptList(prompts=[Prompt(prompt_id_ref=prompt.prompt_id_ref, prompt_description=prompt.description) for prompt in prompts])
\ No newline at end of file
+    prompts, etag = await db.run_sync(prompt_registry.get_enabled_prompts_with_etag)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return PromptList(prompts=[Prompt(prompt_id_ref=prompt.prompt_id_ref, prompt_description=prompt.description) for prompt in prompts])
+
+@router.get("/stats",
+            response_model=SystemStats,
+            summary="Get process-level statistics (LLM response and context caches, prompt registry, LLM scheduler, call errors and latencies, DB connection pools)")
+async def get_system_stats():
+    """
+    Returns counters of the current API process, e.g. LLM response cache hits and misses.
+    """
+    return SystemStats(llm_cache=llm_response_cache.stats(), llm_context_cache=llm_context_caches.stats(),
+                       prompt_registry=prompt_registry.stats(),
+                       llm_scheduler=llm_scheduler.stats(), llm_calls=llm_call_metrics.stats(), db_pools=get_pool_stats())
\ No newline at end of file
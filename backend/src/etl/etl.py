@@ -27,7 +27,8 @@ class ETLService:
                 prompt_id_ref=prompt['prompt_id_ref'],
                 description=prompt['description'],
                 input_granularity=InputGranularityEnum(prompt['input_granularity']),
-                text=prompt['prompt']
+                text=prompt['prompt'],
+                model_name=prompt.get('model_name')
             )
             self.db.add(prompt_model)
         self.db.commit()
@@ -1,7 +1,7 @@
 import enum
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum as SAEnum, Identity
+from sqlalchemy import inspect, create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, LargeBinary, Index, Enum as SAEnum, Identity
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.orm import relationship, declarative_base, deferred
 from sqlalchemy.sql import func # For server-side default timestamps
 
 # Define a Base for declarative models
@@ -11,12 +11,21 @@ Base = declarative_base()
 class InputGranularityEnum(enum.Enum):
     WHOLE_TEXT = "whole_text"
     PARAGRAPH = "paragraph"
+    SENTENCE = "sentence"
+    CHUNK = "chunk" # Adjacent paragraphs packed up to CHUNK_MAX_TOKENS
 
 class CorrectionStatusEnum(enum.Enum):
     PENDING = "pending"
     COMPLETED = "completed"
     FAILED = "failed"
 
+class BatchJobStatusEnum(enum.Enum):
+    CREATED = "created" # Steps assigned, not submitted to the provider yet
+    SUBMITTED = "submitted"
+    SUCCEEDED = "succeeded" # Finished on the provider side, results not ingested yet
+    INGESTED = "ingested"
+    FAILED = "failed"
+
 class Prompt(Base):
     __tablename__ = "prompts"
 
@@ -25,6 +34,7 @@ class Prompt(Base):
     description = Column(Text, nullable=True)
     text = Column(Text, nullable=False)
     input_granularity = Column(SAEnum(InputGranularityEnum), nullable=False)
+    model_name = Column(Text, nullable=True) # Overrides config.LLM_MODEL_NAME for this prompt, e.g. "gemini-2.5-flash" or "mock"
     is_enabled = Column(Boolean, default=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -41,6 +51,11 @@ class Correction(Base):
     correction_id = Column(Integer, Identity(always=True), primary_key=True)
     original_text = Column(Text, nullable=False)
     status = Column(SAEnum(CorrectionStatusEnum), default=CorrectionStatusEnum.PENDING, nullable=False)
+    parent_correction_id = Column(Integer, ForeignKey("corrections.correction_id"), nullable=True) # Set for revisions of an earlier correction
+    # Gzip-compressed JSON of the results, set when the correction completes (see src/services/results_snapshot.py).
+    # Deferred, so that loading a correction does not load it.
+    results_snapshot = deferred(Column(LargeBinary, nullable=True))
+    results_etag = Column(Text, nullable=True)
 
     # Relationship: A Correction can have many CorrectionSteps
     steps = relationship("CorrectionStep", back_populates="correction", cascade="all, delete-orphan")
@@ -55,22 +70,111 @@ class CorrectionStep(Base):
     correction_id = Column(Integer, ForeignKey("corrections.correction_id"), nullable=False)
     prompt_id = Column(Integer, ForeignKey("prompts.prompt_id"), nullable=False)
     
-    input_text_sent_to_llm = Column(Text, nullable=False)
+    # The step's input is the span [original_text_start_char, original_text_end_char) of the correction's
+    # original_text, which is stored once rather than copied into every step.
     original_text_start_char = Column(Integer, nullable=False)
-    paragraph_index = Column(Integer, nullable=True) # Null if prompt is 'whole_text'
+    original_text_end_char = Column(Integer, nullable=False)
+    paragraph_index = Column(Integer, nullable=True) # Only set if prompt is 'paragraph'
+    overlap_char_count = Column(Integer, default=0, nullable=False) # Leading chars of the input repeated from the previous chunk, for context only
     
     status = Column(SAEnum(CorrectionStatusEnum), default=CorrectionStatusEnum.PENDING, nullable=False)
     llm_response = Column(JSONB, nullable=True)
+    llm_model_name = Column(Text, nullable=True) # Model that produced llm_response; a fallback tier's if the prompt's model gave up
     error_message = Column(Text, nullable=True)
 
+    # Job queue bookkeeping (see src/services/job_queue.py)
+    lease_owner = Column(Text, nullable=True) # Id of the worker currently running the step
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True) # Extended by heartbeats; expired leases are requeued
+    attempts = Column(Integer, default=0, nullable=False)
+    batch_job_id = Column(Integer, ForeignKey("batch_jobs.batch_job_id"), nullable=True) # Set while the step runs in a provider batch
+
+    # Instrumentation of the LLM call that answered the step (see LLMCallTrace), summed over its attempts.
+    # Null for steps answered by the LLM response cache or copied from a parent correction.
+    queue_wait_seconds = Column(Float, nullable=True) # Waiting for a scheduler slot
+    pacing_delay_seconds = Column(Float, nullable=True) # Waiting for the rate limiter
+    llm_latency_seconds = Column(Float, nullable=True)
+    llm_retries = Column(Integer, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True) # Shared out between the steps of a fused call
+    output_tokens = Column(Integer, nullable=True)
+    persist_seconds = Column(Float, nullable=True) # From the result to the flush that stored it (see StepResultWriter)
+
     # Relationships
     correction = relationship("Correction", back_populates="steps")
     prompt = relationship("Prompt", back_populates="correction_steps")
     analysis_results = relationship("AnalysisResult", back_populates="correction_step", cascade="all, delete-orphan")
 
+    @property
+    def input_text_sent_to_llm(self) -> str:
+        """
+        The text of the step's span. CorrectionRepository.get_pending_steps sets it for the steps it loads to run;
+        otherwise it is sliced from the correction's original_text, which must already be loaded.
+        """
+        input_text = self.__dict__.get("_input_text_sent_to_llm")
+        if input_text is not None:
+            return input_text
+        correction = None if "correction" in inspect(self).unloaded else self.correction
+        if correction is None or "original_text" in inspect(correction).unloaded:
+            raise RuntimeError(f"The text of correction step {self.correction_step_id} is not loaded, see CorrectionRepository.get_pending_steps")
+        return correction.original_text[self.original_text_start_char:self.original_text_end_char]
+
+    @input_text_sent_to_llm.setter
+    def input_text_sent_to_llm(self, input_text: str):
+        self._input_text_sent_to_llm = input_text
+
     def __repr__(self):
         return f"<CorrectionStep(correction_step_id={self.correction_step_id}, status='{self.status.value}')>"
 
+class LLMResponseCacheEntry(Base):
+    __tablename__ = "llm_response_cache"
+
+    # sha256 of (model name, rendered prompt, response schema), see LLMResponseCache.make_key
+    cache_key = Column(Text, primary_key=True)
+    model_name = Column(Text, nullable=False)
+    llm_response = Column(JSONB, nullable=False)
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<LLMResponseCacheEntry(cache_key='{self.cache_key[:12]}...', model_name='{self.model_name}')>"
+
+class LLMContextCache(Base):
+    __tablename__ = "llm_context_caches"
+
+    # Provider-side cached contents of a correction, see LLMContextCacheManager
+    correction_id = Column(Integer, ForeignKey("corrections.correction_id"), primary_key=True)
+    content_key = Column(Text, primary_key=True) # sha256 of (model name, cached content)
+    model_name = Column(Text, nullable=False)
+    provider_cache_name = Column(Text, nullable=False) # e.g. "cachedContents/abc123"
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<LLMContextCache(correction_id={self.correction_id}, provider_cache_name='{self.provider_cache_name}')>"
+
+class BatchJob(Base):
+    __tablename__ = "batch_jobs"
+
+    # A provider batch running pending steps of one model, see src/services/batch_runner.py
+    batch_job_id = Column(Integer, Identity(always=True), primary_key=True)
+    model_name = Column(Text, nullable=False)
+    status = Column(SAEnum(BatchJobStatusEnum), default=BatchJobStatusEnum.CREATED, nullable=False)
+    provider_batch_name = Column(Text, nullable=True) # e.g. "batches/abc123", set once submitted
+    input_path = Column(Text, nullable=True)
+    step_count = Column(Integer, nullable=False)
+    completed_steps = Column(Integer, default=0, nullable=False)
+    failed_steps = Column(Integer, default=0, nullable=False) # Returned to the job queue
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    output_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, nullable=True) # Estimated from LLM_PRICES_PER_MILLION_TOKENS, if the model is listed
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    submitted_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True) # Ingested or failed
+
+    def __repr__(self):
+        return f"<BatchJob(batch_job_id={self.batch_job_id}, status='{self.status.value}')>"
+
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
 
@@ -87,5 +191,20 @@ class AnalysisResult(Base):
     # Relationship
     correction_step = relationship("CorrectionStep", back_populates="analysis_results")
 
+    # Range lookups of results windows (see CorrectionRepository.get_analysis_results_with_prompt_refs).
+    __table_args__ = (Index("ix_analysis_results_step_start_char", "correction_step_id", "original_text_start_char"),)
+
     def __repr__(self):
         return f"<AnalysisResult(analysis_result_id={self.analysis_result_id}, snippet_from_llm='{self.snippet[:30]}...')>"
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    # Token-bucket state of PostgresRateLimiter, shared by all workers using the same database.
+    name = Column(Text, primary_key=True)
+    request_tokens = Column(Float, nullable=False)
+    llm_tokens = Column(Float, nullable=False)
+    updated_at_epoch = Column(Float, nullable=False) # Database clock, so that all workers agree on elapsed time
+
+    def __repr__(self):
+        return f"<RateLimitBucket(name='{self.name}', request_tokens={self.request_tokens:.2f})>"
@@ -0,0 +1,162 @@
+from typing import List, Dict, Optional, Tuple, Iterable
+from datetime import datetime
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload, joinedload
+
+from src.models import Correction, CorrectionStep, AnalysisResult, CorrectionStatusEnum, Prompt
+
+
+class CorrectionRepository:
+    """
+    Purpose-built queries over corrections, steps and analysis results. Every method loads what
+    its caller walks in a constant number of statements, instead of relying on lazy relationships.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_correction(self, correction_id: int) -> Optional[Correction]:
+        return self.db.get(Correction, correction_id)
+
+    def get_correction_with_results(self, correction_id: int) -> Optional[Correction]:
+        """Loads a correction with its steps, their prompts and analysis results (3 statements)."""
+        return self.db.scalars(
+            select(Correction)
+            .options(
+                selectinload(Correction.steps).joinedload(CorrectionStep.prompt),
+                selectinload(Correction.steps).selectinload(CorrectionStep.analysis_results)
+            )
+            .where(Correction.correction_id == correction_id)
+        ).first()
+
+    def get_results_snapshot(self, correction_id: int) -> Optional[Tuple[CorrectionStatusEnum, Optional[bytes], Optional[str]]]:
+        """(status, results_snapshot, results_etag) of a correction in one statement, without its text or steps."""
+        row = self.db.execute(
+            select(Correction.status, Correction.results_snapshot, Correction.results_etag).where(Correction.correction_id == correction_id)
+        ).first()
+        return tuple(row) if row else None
+
+    def get_pending_step_ids(self, correction_id: int) -> List[int]:
+        return self.db.scalars(
+            select(CorrectionStep.correction_step_id)
+            .where(CorrectionStep.correction_id == correction_id, CorrectionStep.status == CorrectionStatusEnum.PENDING)
+            .order_by(CorrectionStep.correction_step_id)
+        ).all()
+
+    def get_pending_steps(self, correction_step_ids: Iterable[int]) -> List[CorrectionStep]:
+        """
+        Loads pending steps with their prompts, and sets their input_text_sent_to_llm from the text of
+        their corrections, which is loaded once per correction (2 statements).
+        """
+        steps = self.db.scalars(
+            select(CorrectionStep)
+            .options(joinedload(CorrectionStep.prompt))
+            .where(CorrectionStep.correction_step_id.in_(list(correction_step_ids)), CorrectionStep.status == CorrectionStatusEnum.PENDING)
+            .order_by(CorrectionStep.correction_step_id)
+        ).all()
+        if not steps:
+            return steps
+
+        original_texts = dict(self.db.execute(
+            select(Correction.correction_id, Correction.original_text)
+            .where(Correction.correction_id.in_({step.correction_id for step in steps}))
+        ).all())
+        # Steps of different prompts over the same span share one string.
+        segments: Dict[Tuple[int, int, int], str] = {}
+        for step in steps:
+            span = (step.correction_id, step.original_text_start_char, step.original_text_end_char)
+            if span not in segments:
+                segments[span] = original_texts[step.correction_id][step.original_text_start_char:step.original_text_end_char]
+            step.input_text_sent_to_llm = segments[span]
+        return steps
+
+    def get_status_with_step_counts(self, correction_id: int) -> Optional[Tuple[CorrectionStatusEnum, Dict[CorrectionStatusEnum, int]]]:
+        """
+        Returns the status of a correction and its number of steps per status with a single
+        COUNT ... GROUP BY, without loading any step. Returns None if the correction does not exist.
+        """
+        rows = self.db.execute(
+            select(Correction.status, CorrectionStep.status, func.count(CorrectionStep.correction_step_id))
+            .outerjoin(CorrectionStep, CorrectionStep.correction_id == Correction.correction_id)
+            .where(Correction.correction_id == correction_id)
+            .group_by(Correction.status, CorrectionStep.status)
+        ).all()
+        if not rows:
+            return None
+
+        step_counts = {step_status: count for _, step_status, count in rows if step_status is not None}
+        return rows[0][0], step_counts
+
+    def count_pending_steps_per_segment(self, correction_ids: Iterable[int]) -> Dict[Tuple[int, int, int], int]:
+        """
+        Number of pending steps per (correction_id, original_text_start_char, segment length). Steps are
+        slices of their correction's text, so equal keys mean the same segment under different prompts.
+        """
+        segment_length = CorrectionStep.original_text_end_char - CorrectionStep.original_text_start_char
+        rows = self.db.execute(
+            select(CorrectionStep.correction_id, CorrectionStep.original_text_start_char, segment_length, func.count())
+            .where(CorrectionStep.correction_id.in_(list(correction_ids)), CorrectionStep.status == CorrectionStatusEnum.PENDING)
+            .group_by(CorrectionStep.correction_id, CorrectionStep.original_text_start_char, segment_length)
+        ).all()
+        return {(correction_id, start_char, length): count for correction_id, start_char, length, count in rows}
+
+    def count_pending_steps_per_prompt(self, correction_ids: Iterable[int]) -> Dict[Tuple[int, int], int]:
+        """Number of pending steps per (correction_id, prompt_id)."""
+        rows = self.db.execute(
+            select(CorrectionStep.correction_id, CorrectionStep.prompt_id, func.count())
+            .where(CorrectionStep.correction_id.in_(list(correction_ids)), CorrectionStep.status == CorrectionStatusEnum.PENDING)
+            .group_by(CorrectionStep.correction_id, CorrectionStep.prompt_id)
+        ).all()
+        return {(correction_id, prompt_id): count for correction_id, prompt_id, count in rows}
+
+    def get_completed_step_ids(self, correction_id: int) -> List[int]:
+        return self.db.scalars(
+            select(CorrectionStep.correction_step_id)
+            .where(CorrectionStep.correction_id == correction_id, CorrectionStep.status == CorrectionStatusEnum.COMPLETED)
+        ).all()
+
+    def get_analysis_results_with_prompt_refs(self, correction_id: int, correction_step_ids: Optional[List[int]] = None,
+                                              located_only: bool = False, window: Optional[Tuple[int, int]] = None) -> List[Tuple[AnalysisResult, str]]:
+        """
+        Returns (analysis_result, prompt_id_ref) pairs of a correction in step order, resolving
+        the prompt refs in the same statement. With a (start_char, end_char) window, only the
+        located issues overlapping it, looked up on (correction_step_id, original_text_start_char).
+        """
+        statement = (
+            select(AnalysisResult, Prompt.prompt_id_ref)
+            .join(CorrectionStep, AnalysisResult.correction_step_id == CorrectionStep.correction_step_id)
+            .join(Prompt, CorrectionStep.prompt_id == Prompt.prompt_id)
+            .where(CorrectionStep.correction_id == correction_id)
+            .order_by(CorrectionStep.correction_step_id, AnalysisResult.analysis_result_id)
+        )
+        if correction_step_ids is not None:
+            statement = statement.where(AnalysisResult.correction_step_id.in_(correction_step_ids))
+        if located_only or window is not None:
+            statement = statement.where(
+                AnalysisResult.original_text_start_char >= 0,
+                AnalysisResult.original_text_start_char < AnalysisResult.original_text_end_char
+            )
+        if window is not None:
+            start_char, end_char = window
+            statement = statement.where(AnalysisResult.original_text_start_char < end_char, AnalysisResult.original_text_end_char > start_char)
+        return self.db.execute(statement).all()
+
+    def get_text_window(self, correction_id: int, start_char: int, end_char: Optional[int]) -> Optional[Tuple[CorrectionStatusEnum, int, str]]:
+        """
+        (status, text length, original_text[start_char:end_char]) of a correction in one statement, without
+        sending the rest of the text over. end_char None means up to the end of the text.
+        """
+        # substr counts characters from 1, like Python strings count code points from 0.
+        window_text = (func.substr(Correction.original_text, start_char + 1) if end_char is None
+                       else func.substr(Correction.original_text, start_char + 1, max(end_char - start_char, 0)))
+        row = self.db.execute(
+            select(Correction.status, func.length(Correction.original_text), window_text).where(Correction.correction_id == correction_id)
+        ).first()
+        return tuple(row) if row else None
+
+    def get_enabled_prompts(self) -> List[Prompt]:
+        return self.db.scalars(select(Prompt).where(Prompt.is_enabled == True).order_by(Prompt.prompt_id)).all()
+
+    def get_prompts_version(self) -> Tuple[Optional[datetime], int]:
+        """(max(updated_at), count) of the prompts table, which changes whenever a prompt is added, removed or updated."""
+        return tuple(self.db.execute(select(func.max(Prompt.updated_at), func.count(Prompt.prompt_id))).one())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict
 
 class Prompt(BaseModel):
     prompt_id_ref: str
@@ -15,6 +15,16 @@ class CorrectionCreateRequest(BaseModel):
 class CorrectionCreateResponse(BaseModel):
     correction_id: int
 
+class CorrectionRevisionRequest(BaseModel):
+    text_content: str
+    prompt_id_refs: Optional[List[str]] = None # Defaults to the prompts of the parent correction
+
+class CorrectionRevisionResponse(BaseModel):
+    correction_id: int
+    parent_correction_id: int
+    reused_steps: int
+    pending_steps: int
+
 class CorrectionStatusResponse(BaseModel):
     correction_id: int
     status: str
@@ -34,8 +44,95 @@ class RichSegment(BaseModel):
     def __lt__(self, other):
         return self.start_char < other.start_char
 
+class RichSegmentIssueDelta(BaseModel):
+    start_char: int
+    end_char: int
+    snippet: str
+    prompt_id_ref: str
+    issue: str
+    revision: str
+
+class CorrectionIssuesEvent(BaseModel):
+    correction_id: int
+    issues: List[RichSegmentIssueDelta]
+
 class CorrectionResultResponse(BaseModel):
     correction_id: int
-    original_text: str
+    original_text: str | None # Left out on request for windows of the results
     status: str
-    rich_segments: List[RichSegment] | None = None
\ No newline at end of file
+    rich_segments: List[RichSegment] | None = None
+    # Only set for windows of the results: the characters [start_char, end_char) covered by rich_segments,
+    # and the cursor of the next page if the window holds more segments than the page.
+    start_char: int | None = None
+    end_char: int | None = None
+    next_cursor: int | None = None
+
+class LLMCacheStats(BaseModel):
+    enabled: bool
+    memory_entries: int
+    memory_hits: int
+    db_hits: int
+    misses: int
+    writes: int
+    evictions: int
+    hit_rate: float
+
+class LLMContextCacheStats(BaseModel):
+    enabled: bool
+    active: int # Cached contents this process knows of
+    created: int
+    reused: int
+    failures: int
+    deleted: int
+
+class PromptRegistryStats(BaseModel):
+    prompts: int # Enabled prompts in memory
+    reloads: int
+    templates: int # Compiled templates in the cache
+    template_compilations: int
+
+class SchedulerStats(BaseModel):
+    active: int
+    queued: int
+    queued_keys: int
+    max_concurrency: int
+    concurrency_limit: int # Lowered on 429s, see LLMScheduler
+    backoffs: int
+
+class LLMCallStats(BaseModel):
+    successes: int = 0
+    retries: int = 0
+    failed_calls: int = 0 # Calls that gave up after their retries
+    # Failed attempts by error class, see LLMErrorClass
+    rate_limit: int = 0
+    transient: int = 0
+    schema_error: int = 0
+    permanent: int = 0
+    circuit_state: str
+    circuit_opened: int
+    hedges: int = 0 # Attempts duplicated for being slower than the usual latency
+    hedges_won: int = 0 # Hedges that answered first
+    fallbacks: int = 0 # Calls handed to the next fallback tier after giving up
+    latency_p50_seconds: Optional[float] = None
+    latency_p95_seconds: Optional[float] = None
+
+class DBPoolStats(BaseModel):
+    pool_class: str
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+    wait_seconds_avg: float = 0.0
+    # Not reported for NullPool (PgBouncer mode).
+    size: Optional[int] = None
+    checked_in: Optional[int] = None
+    checked_out: Optional[int] = None
+    overflow: Optional[int] = None
+
+class SystemStats(BaseModel):
+    llm_cache: LLMCacheStats
+    llm_context_cache: LLMContextCacheStats
+    prompt_registry: PromptRegistryStats
+    llm_scheduler: SchedulerStats
+    llm_calls: Dict[str, LLMCallStats] # Per model
+    db_pools: Dict[str, DBPoolStats]
@@ -0,0 +1,276 @@
+from typing import List, Optional, Dict, Any, Tuple
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+import asyncio
+import json
+import os
+
+from src.utils import logger
+from src.models import BatchJob, BatchJobStatusEnum, CorrectionStep, CorrectionStatusEnum
+from src.services.correction import CorrectionService
+from src.services.job_queue import JobQueue
+from src.services.llm_interaction import LLMInteraction, LLMCallTrace
+from src.services.llm_backends import BATCH_SUCCEEDED, BATCH_FAILED, LLMBackendError, LLMResponseError
+from src.services.llm_context_cache import llm_context_caches
+from src.services.step_writer import StepResultWriter
+from src.services.telemetry import estimate_llm_cost
+from src.schemas.schemas_llm import SnippetIssuesRevisionList
+from config import (
+    LLM_BATCH_DIR, LLM_BATCH_MAX_STEPS, LLM_BATCH_POLL_SECONDS, LLM_BATCH_LEASE_SECONDS, LLM_BATCH_COST_FACTOR,
+    JOB_MAX_ATTEMPTS
+)
+
+# Owner of the job queue leases of steps handed to batch jobs.
+BATCH_LEASE_OWNER = "batch"
+_OPEN_STATUSES = (BatchJobStatusEnum.CREATED, BatchJobStatusEnum.SUBMITTED, BatchJobStatusEnum.SUCCEEDED)
+
+
+def estimate_batch_cost(model_name: str, prompt_tokens: int, output_tokens: int, cost_factor: float = LLM_BATCH_COST_FACTOR) -> Optional[float]:
+    """Cost in USD of the tokens of a batch job, or None if the model has no listed price."""
+    return estimate_llm_cost(model_name, prompt_tokens, output_tokens, cost_factor=cost_factor)
+
+
+class BatchRunner:
+    """
+    Batch execution mode of CorrectionService, for large offline runs. Pending steps are leased from the
+    job queue (so that workers leave them alone), written per model to a JSONL input file and submitted
+    to the provider's batch API. Finished batches are ingested in bulk through StepResultWriter, and
+    steps that failed go back to the queue.
+
+    Batch jobs are tracked in batch_jobs, so an interrupted run resumes where it stopped: jobs that were
+    not submitted yet are submitted, submitted ones are polled and ingested.
+    """
+
+    def __init__(self, db: Session, llm_model_name: str, batch_dir: str = LLM_BATCH_DIR,
+                 max_steps: int = LLM_BATCH_MAX_STEPS, poll_interval: float = LLM_BATCH_POLL_SECONDS):
+        self.db = db
+        # Batch requests are not fused: every step gets its own answer, at batch prices.
+        self.service = CorrectionService(db=db, llm_model_name=llm_model_name, fuse_prompts=False)
+        self.queue = JobQueue(worker_id=BATCH_LEASE_OWNER, lease_seconds=LLM_BATCH_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
+        self.batch_dir = batch_dir
+        self.max_steps = max_steps
+        self.poll_interval = poll_interval
+
+    async def run(self, correction_ids: List[int]) -> List[BatchJob]:
+        """
+        Resumes the open batch jobs of earlier runs, submits the pending steps of correction_ids and waits
+        until every batch job is ingested or failed. Returns these jobs. The corrections must be given
+        explicitly: other pending steps are the workers' and are never taken over by a batch run.
+        """
+        job_ids = list(self.db.scalars(
+            select(BatchJob.batch_job_id).where(BatchJob.status.in_(_OPEN_STATUSES)).order_by(BatchJob.batch_job_id)
+        ).all())
+        if job_ids:
+            logger.info(f"Resuming batch jobs {job_ids}")
+        for job in self._get_jobs(job_ids, statuses=(BatchJobStatusEnum.CREATED,)):
+            await self._resubmit(job)
+        await self._wait(job_ids)
+
+        # Steps that failed in a batch are back in the job queue and go into the next round of batches,
+        # until they run out of attempts.
+        while new_job_ids := await self.submit(correction_ids=correction_ids):
+            job_ids += new_job_ids
+            await self._wait(new_job_ids)
+        await self._finalize_corrections()
+        return self._get_jobs(job_ids)
+
+    async def submit(self, correction_ids: List[int]) -> List[int]:
+        """
+        Leases the claimable pending steps of correction_ids and submits them in batch jobs of at most
+        max_steps steps per model. Returns the ids of the new jobs.
+        """
+        # Steps leased by an interrupted run before it recorded their job.
+        step_ids = self.db.scalars(
+            select(CorrectionStep.correction_step_id)
+            .where(CorrectionStep.lease_owner == BATCH_LEASE_OWNER, CorrectionStep.batch_job_id.is_(None),
+                   CorrectionStep.status == CorrectionStatusEnum.PENDING)
+        ).all()
+        job_ids: List[int] = []
+        unsupported_step_ids: List[int] = []
+        while True:
+            step_ids = list(step_ids) + self.queue.claim_steps(self.db, limit=self.max_steps, correction_ids=correction_ids)
+            if not step_ids:
+                break
+            async with StepResultWriter(lease_owner=BATCH_LEASE_OWNER) as writer:
+                steps_by_model = self.service.prepare_batch_steps(correction_step_ids=step_ids, writer=writer)
+            for model_name, steps in steps_by_model.items():
+                llm = LLMInteraction(model_name=model_name)
+                if not llm.supports_batch:
+                    # Kept leased until all steps are claimed, then handed back to the workers.
+                    logger.warning(f"{model_name} does not support batch mode, leaving {len(steps)} steps to the workers")
+                    unsupported_step_ids.extend(step.correction_step_id for step, _, _ in steps)
+                    continue
+                job = self._create_job(model_name, [step.correction_step_id for step, _, _ in steps])
+                job_ids.append(job.batch_job_id)
+                await self._submit(llm, job, steps)
+            step_ids = []
+
+        self.queue.release_steps(self.db, step_ids=unsupported_step_ids)
+        return job_ids
+
+    async def poll(self, job: BatchJob):
+        """Checks a submitted batch job, and ingests its results once it has succeeded."""
+        llm = LLMInteraction(model_name=job.model_name)
+        if job.status == BatchJobStatusEnum.SUBMITTED:
+            state, error = await llm.get_batch_state(job.provider_batch_name)
+            if state == BATCH_FAILED:
+                self._fail(job, error_message=f"Batch job failed: {error}")
+                return
+            if state != BATCH_SUCCEEDED:
+                return
+            job.status = BatchJobStatusEnum.SUCCEEDED
+            self.db.commit()
+        await self._ingest(llm, job)
+
+    async def _wait(self, job_ids: List[int]):
+        """Polls the jobs until none of them is open."""
+        while True:
+            for job in self._get_jobs(job_ids, statuses=_OPEN_STATUSES):
+                try:
+                    await self.poll(job)
+                except Exception as e:
+                    # E.g. the provider is not reachable; the job is polled again.
+                    self.db.rollback()
+                    logger.error(f"Polling batch job {job.batch_job_id} failed: {e}")
+            if not self._get_jobs(job_ids, statuses=_OPEN_STATUSES):
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def get_jobs(self, limit: int = 20) -> List[BatchJob]:
+        return self.db.scalars(select(BatchJob).order_by(BatchJob.batch_job_id.desc()).limit(limit)).all()
+
+    @staticmethod
+    def report(job: BatchJob) -> Dict[str, Any]:
+        """Cost and throughput of a batch job."""
+        duration = (job.finished_at - job.submitted_at).total_seconds() if job.finished_at and job.submitted_at else None
+        return {
+            "batch_job_id": job.batch_job_id,
+            "model_name": job.model_name,
+            "status": job.status.value,
+            "steps": job.step_count,
+            "completed_steps": job.completed_steps,
+            "failed_steps": job.failed_steps,
+            "prompt_tokens": job.prompt_tokens,
+            "output_tokens": job.output_tokens,
+            "cost_usd": job.cost_usd,
+            "interactive_cost_usd": job.cost_usd / LLM_BATCH_COST_FACTOR if job.cost_usd is not None else None,
+            "duration_seconds": duration,
+            "steps_per_hour": job.completed_steps / duration * 3600 if duration else None,
+        }
+
+    def _get_jobs(self, job_ids: List[int], statuses: Optional[Tuple[BatchJobStatusEnum, ...]] = None) -> List[BatchJob]:
+        statement = select(BatchJob).where(BatchJob.batch_job_id.in_(job_ids)).order_by(BatchJob.batch_job_id)
+        if statuses is not None:
+            statement = statement.where(BatchJob.status.in_(statuses))
+        return self.db.scalars(statement).all()
+
+    def _get_job_step_ids(self, job: BatchJob) -> List[int]:
+        """Steps of the job that are still pending and leased to the batch."""
+        return self.db.scalars(
+            select(CorrectionStep.correction_step_id)
+            .where(CorrectionStep.batch_job_id == job.batch_job_id, CorrectionStep.lease_owner == BATCH_LEASE_OWNER,
+                   CorrectionStep.status == CorrectionStatusEnum.PENDING)
+            .order_by(CorrectionStep.correction_step_id)
+        ).all()
+
+    def _create_job(self, model_name: str, step_ids: List[int]) -> BatchJob:
+        job = BatchJob(model_name=model_name, step_count=len(step_ids))
+        self.db.add(job)
+        self.db.flush()
+        self.db.execute(
+            update(CorrectionStep)
+            .where(CorrectionStep.correction_step_id.in_(step_ids))
+            .values(batch_job_id=job.batch_job_id)
+        )
+        self.db.commit()
+        return job
+
+    async def _resubmit(self, job: BatchJob):
+        """Submits a job recorded by an interrupted run that did not get to submit it."""
+        async with StepResultWriter(lease_owner=BATCH_LEASE_OWNER) as writer:
+            steps_by_model = self.service.prepare_batch_steps(correction_step_ids=self._get_job_step_ids(job), writer=writer)
+        steps = [entry for entries in steps_by_model.values() for entry in entries]
+        if not steps:
+            # Answered by the LLM response cache in the meantime.
+            job.status = BatchJobStatusEnum.INGESTED
+            job.finished_at = func.now()
+            self.db.commit()
+            return
+        job.step_count = len(steps)
+        await self._submit(LLMInteraction(model_name=job.model_name), job, steps)
+
+    async def _submit(self, llm: LLMInteraction, job: BatchJob, steps: List[Tuple[CorrectionStep, str, str]]):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        input_path = os.path.join(self.batch_dir, f"batch-{job.batch_job_id}.jsonl")
+        with open(input_path, "w") as input_file:
+            for step, prompt, _ in steps:
+                request = llm.batch_request(key=str(step.correction_step_id), prompt=prompt, response_model=SnippetIssuesRevisionList)
+                input_file.write(json.dumps(request) + "\n")
+        try:
+            provider_batch_name = await llm.submit_batch(input_path, display_name=f"correction-batch-{job.batch_job_id}")
+        except Exception as e:
+            logger.error(f"Could not submit batch job {job.batch_job_id}: {e}")
+            self._fail(job, error_message=f"Submission failed: {e}")
+            return
+
+        job.provider_batch_name = provider_batch_name
+        job.input_path = input_path
+        job.status = BatchJobStatusEnum.SUBMITTED
+        job.submitted_at = func.now()
+        self.db.commit()
+        logger.info(f"Submitted batch job {job.batch_job_id} ({len(steps)} steps, {job.model_name}) as {provider_batch_name}")
+
+    async def _ingest(self, llm: LLMInteraction, job: BatchJob):
+        outputs = {output.key: output for output in await llm.get_batch_results(job.provider_batch_name)}
+        completed_steps = 0
+        failed_step_ids: List[int] = []
+        async with StepResultWriter(lease_owner=BATCH_LEASE_OWNER) as writer:
+            steps_by_model = self.service.prepare_batch_steps(correction_step_ids=self._get_job_step_ids(job), writer=writer)
+            for step, _, cache_key in [entry for entries in steps_by_model.values() for entry in entries]:
+                output = outputs.get(str(step.correction_step_id))
+                try:
+                    if output is None:
+                        raise LLMResponseError("No answer in the batch results")
+                    if output.error is not None:
+                        raise LLMBackendError(output.error)
+                    response = SnippetIssuesRevisionList.model_validate_json(output.text)
+                except Exception as e:
+                    logger.warning(f"Step {step.correction_step_id} of batch job {job.batch_job_id} failed: {e}")
+                    failed_step_ids.append(step.correction_step_id)
+                    continue
+                # Batch jobs are timed as a whole (BatchJob.submitted_at, finished_at); steps only get their tokens.
+                trace = LLMCallTrace(prompt_tokens=output.prompt_tokens, output_tokens=output.output_tokens)
+                await writer.add(self.service.get_batch_step_result(step=step, llm_response=response.model_dump(),
+                                                                    cache_key=cache_key, model_name=job.model_name, trace=trace))
+                completed_steps += 1
+
+        self.queue.requeue_failed_steps(self.db, step_ids=failed_step_ids, error_message=f"Failed in batch job {job.batch_job_id}")
+        # Failed requests are billed too.
+        job.prompt_tokens = sum(output.prompt_tokens for output in outputs.values())
+        job.output_tokens = sum(output.output_tokens for output in outputs.values())
+        job.cost_usd = estimate_batch_cost(job.model_name, job.prompt_tokens, job.output_tokens)
+        job.completed_steps = completed_steps
+        job.failed_steps = len(failed_step_ids)
+        job.status = BatchJobStatusEnum.INGESTED
+        job.finished_at = func.now()
+        self.db.commit()
+        logger.info(f"Ingested batch job {job.batch_job_id}: {completed_steps} steps completed, {len(failed_step_ids)} returned to the job queue")
+
+    def _fail(self, job: BatchJob, error_message: str):
+        """Returns the steps of a failed job to the job queue."""
+        failed_step_ids = self._get_job_step_ids(job)
+        self.queue.requeue_failed_steps(self.db, step_ids=failed_step_ids, error_message=error_message)
+        job.status = BatchJobStatusEnum.FAILED
+        job.failed_steps = len(failed_step_ids)
+        job.error_message = error_message
+        job.finished_at = func.now()
+        self.db.commit()
+
+    async def _finalize_corrections(self):
+        while True:
+            correction_ids = self.queue.claim_finished_corrections(self.db, limit=100)
+            if not correction_ids:
+                return
+            self.service.finalize_corrections(correction_ids=correction_ids)
+            await llm_context_caches.release(correction_ids=correction_ids)
+            logger.info(f"Completed corrections {correction_ids}")
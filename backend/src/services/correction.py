@@ -1,166 +1,604 @@
-from typing import List, Callable
+from typing import List, Callable, Coroutine, Dict, Tuple, Optional, Set
+from collections import defaultdict
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-import jinja2
+from sqlalchemy.ext.asyncio import AsyncSession
 import asyncio
+import time
 
-from src.services.llm_interaction import LLMInteraction
-from src.utils import logger, get_db_context
+from src.services.llm_interaction import LLMInteraction, LLMResult, LLMCallTrace
+from src.services.llm_cache import llm_response_cache
+from src.services.step_writer import StepResultWriter, StepResult
+from src.services.correction_events import publish_correction_event
+from src.repositories.correction_repository import CorrectionRepository
+from src.utils import logger
 from src.models import Correction, CorrectionStep, AnalysisResult, CorrectionStatusEnum, Prompt, InputGranularityEnum
-from src.schemas.schemas_api import RichSegment, RichSegmentIssue, CorrectionStatusResponse, CorrectionResultResponse, CorrectionCreateResponse
+from src.schemas.schemas_api import RichSegment, RichSegmentIssue, CorrectionStatusResponse, CorrectionResultResponse, CorrectionCreateResponse, CorrectionRevisionResponse, RichSegmentIssueDelta
 from src.schemas.schemas_llm import SnippetIssuesRevisionList
-from src.services.text_utils import split_text_into_paragraphs, locate_snippet_in_segment
-from config import RATE_LIMIT_RPM, CONCURRENT_LLM_CALLS
+from src.services.text_utils import (
+    split_text_into_paragraphs, split_text_into_sentences, split_text_into_chunks, SegmentSnippetLocator, match_unchanged_paragraphs, estimate_token_count, build_rich_segments
+)
+from src.services.prompt_fusion import can_fuse, render_fused_prompt, get_fused_response_model, split_fused_response
+from src.services.llm_context_cache import llm_context_caches, split_prompt_context, PromptContext
+from src.services.prompt_registry import prompt_registry
+from src.services.llm_resilience import llm_call_metrics, LLMErrorClass
+from src.services.telemetry import record_step, span
+from src.services.results_snapshot import ResultsSnapshot, build_results_snapshot
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, LLM_FUSED_PROMPTS_ENABLED, LLM_FUSED_MAX_PROMPTS, LLM_FALLBACK_MODELS
 
 
 class CorrectionService:
-    def __init__(self, db: Session, llm_model_name: str):
+    def __init__(self, db: Session, llm_model_name: str, fuse_prompts: bool = LLM_FUSED_PROMPTS_ENABLED):
         self.db = db
+        self.repository = CorrectionRepository(db)
+        # Default model; prompts with a model_name of their own use theirs (see _get_llm).
         self.llm = LLMInteraction(model_name=llm_model_name)
+        self.llms: Dict[str, LLMInteraction] = {llm_model_name: self.llm}
+        # If set, the pending steps of different prompts over the same segment share one LLM call (see prompt_fusion.py).
+        self.fuse_prompts = fuse_prompts
 
     def create_new_correction(self, original_text: str, prompt_id_refs: List[str]) -> CorrectionCreateResponse:
         logger.debug(f"Initiating correction for {original_text} with prompts {prompt_id_refs}")
         new_correction = Correction(original_text=original_text, status=CorrectionStatusEnum.PENDING)
         self.db.add(new_correction)
-        self.db.commit()
+        # Flushed for its id and committed together with its steps: workers finalize pending corrections that
+        # have no pending steps (see JobQueue.claim_finished_corrections), so it must never be visible without them.
+        self.db.flush()
         self._add_correction_steps(correction_id=new_correction.correction_id, prompt_id_refs=prompt_id_refs, original_text=original_text)
         self.db.commit()
         return CorrectionCreateResponse(correction_id=new_correction.correction_id)
 
+
+    def create_revision(self, parent_correction_id: int, original_text: str, prompt_id_refs: Optional[List[str]] = None) -> Optional[CorrectionRevisionResponse]:
+        """
+        Creates a correction for an edited version of the parent's text. Paragraph steps whose
+        paragraph is unchanged are copied from the parent (with its analysis results shifted to
+        the new offsets), so only the changed paragraphs and whole-text prompts go to the LLM.
+        """
+        parent = self.repository.get_correction_with_results(correction_id=parent_correction_id)
+        if not parent:
+            logger.warning(f"Parent correction with id {parent_correction_id} not found")
+            return None
+
+        if prompt_id_refs is None:
+            prompt_id_refs = list(dict.fromkeys(step.prompt.prompt_id_ref for step in parent.steps))
+
+        paragraphs_with_offsets = split_text_into_paragraphs(original_text)
+
+        # Results of the parent are only final once it has completed.
+        reusable_steps: Dict[Tuple[int, int], CorrectionStep] = {}
+        if parent.status == CorrectionStatusEnum.COMPLETED:
+            unchanged_paragraphs = match_unchanged_paragraphs(
+                old_paragraphs=split_text_into_paragraphs(parent.original_text),
+                new_paragraphs=paragraphs_with_offsets
+            )
+            parent_steps_by_paragraph: Dict[int, List[CorrectionStep]] = {}
+            for step in parent.steps:
+                if step.paragraph_index is not None and step.status == CorrectionStatusEnum.COMPLETED:
+                    parent_steps_by_paragraph.setdefault(step.paragraph_index, []).append(step)
+            for new_idx, old_idx in unchanged_paragraphs.items():
+                for step in parent_steps_by_paragraph.get(old_idx, []):
+                    reusable_steps[(step.prompt_id, new_idx)] = step
+
+        new_correction = Correction(original_text=original_text, status=CorrectionStatusEnum.PENDING, parent_correction_id=parent.correction_id)
+        self.db.add(new_correction)
+        # Flush rather than commit: a commit would expire the loaded parent graph and lazy-load it again step by step.
+        self.db.flush()
+        reused_steps, pending_steps = self._add_correction_steps(
+            correction_id=new_correction.correction_id,
+            prompt_id_refs=prompt_id_refs,
+            original_text=original_text,
+            reusable_steps=reusable_steps,
+            paragraphs_with_offsets=paragraphs_with_offsets
+        )
+        # Read before the commit expires both corrections, which would reload them (and the parent's steps) to get their ids.
+        correction_id, parent_correction_id = new_correction.correction_id, parent.correction_id
+        self.db.commit()
+        logger.debug(f"Revision {correction_id} of correction {parent_correction_id}: reused {reused_steps} steps, {pending_steps} pending")
+        return CorrectionRevisionResponse(
+            correction_id=correction_id,
+            parent_correction_id=parent_correction_id,
+            reused_steps=reused_steps,
+            pending_steps=pending_steps
+        )
             
-    def _add_correction_steps(self, correction_id: int, prompt_id_refs: List[str], original_text: str):
+    def _add_correction_steps(self, correction_id: int, prompt_id_refs: List[str], original_text: str,
+                              reusable_steps: Optional[Dict[Tuple[int, int], CorrectionStep]] = None,
+                              paragraphs_with_offsets: Optional[List[Tuple[str, int]]] = None) -> Tuple[int, int]:
+        """
+        Adds the steps of a correction. reusable_steps maps (prompt_id, paragraph_index) to a
+        completed step of a parent correction holding the same paragraph text; those are copied
+        instead of being sent to the LLM again. paragraphs_with_offsets is the split of original_text
+        if the caller already has it. Returns the number of (reused, pending) steps.
+        """
+        reusable_steps = reusable_steps or {}
+        reused_steps, pending_steps = 0, 0
+        # Splits are computed on first use and shared by all prompts of the same granularity.
+        sentences_with_offsets: Optional[List[Tuple[str, int]]] = None
+        chunks_with_offsets: Optional[List[Tuple[str, int, int]]] = None
+        prompts = prompt_registry.get_prompts_by_refs(self.db, prompt_id_refs)
         for prompt_id_ref in prompt_id_refs:
-            base_prompt = self.db.query(Prompt).filter(Prompt.prompt_id_ref == prompt_id_ref, Prompt.is_enabled == True).first()
+            base_prompt = prompts.get(prompt_id_ref)
+            if base_prompt is None:
+                logger.warning(f"Skipping unknown or disabled prompt {prompt_id_ref}")
+                continue
+
             if base_prompt.input_granularity == InputGranularityEnum.WHOLE_TEXT:
                 correction_step = CorrectionStep(correction_id=correction_id, 
                                                  prompt_id=base_prompt.prompt_id, 
-                                                 input_text_sent_to_llm=original_text, 
                                                  original_text_start_char=0,
+                                                 original_text_end_char=len(original_text),
                                                  paragraph_index=None, 
                                                  status=CorrectionStatusEnum.PENDING)
                 self.db.add(correction_step)
+                pending_steps += 1
     
             elif base_prompt.input_granularity == InputGranularityEnum.PARAGRAPH:
-                paragraphs_with_offsets = split_text_into_paragraphs(original_text)
+                if paragraphs_with_offsets is None:
+                    paragraphs_with_offsets = split_text_into_paragraphs(original_text)
                 for idx, (paragraph, start_offset) in enumerate(paragraphs_with_offsets):
                     if not paragraph.strip():
                         continue
 
+                    parent_step = reusable_steps.get((base_prompt.prompt_id, idx))
+                    if parent_step is not None:
+                        self._copy_correction_step(parent_step=parent_step, correction_id=correction_id, paragraph_index=idx, start_offset=start_offset)
+                        reused_steps += 1
+                        continue
+
                     correction_step = CorrectionStep(correction_id=correction_id, 
                                                     prompt_id=base_prompt.prompt_id, 
-                                                    input_text_sent_to_llm=paragraph, 
                                                     original_text_start_char=start_offset,
+                                                    original_text_end_char=start_offset + len(paragraph),
                                                     paragraph_index=idx, 
                                                     status=CorrectionStatusEnum.PENDING)
                     self.db.add(correction_step)
+                    pending_steps += 1
+
+            elif base_prompt.input_granularity == InputGranularityEnum.SENTENCE:
+                if paragraphs_with_offsets is None:
+                    paragraphs_with_offsets = split_text_into_paragraphs(original_text)
+                if sentences_with_offsets is None:
+                    sentences_with_offsets = split_text_into_sentences(original_text, paragraphs_with_offsets=paragraphs_with_offsets)
+                # Unchanged sentences of a revision are answered by the LLM response cache.
+                for sentence, start_offset in sentences_with_offsets:
+                    correction_step = CorrectionStep(correction_id=correction_id,
+                                                    prompt_id=base_prompt.prompt_id,
+                                                    original_text_start_char=start_offset,
+                                                    original_text_end_char=start_offset + len(sentence),
+                                                    paragraph_index=None,
+                                                    status=CorrectionStatusEnum.PENDING)
+                    self.db.add(correction_step)
+                    pending_steps += 1
+
+            elif base_prompt.input_granularity == InputGranularityEnum.CHUNK:
+                if paragraphs_with_offsets is None:
+                    paragraphs_with_offsets = split_text_into_paragraphs(original_text)
+                if chunks_with_offsets is None:
+                    chunks_with_offsets = split_text_into_chunks(original_text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                                                                 paragraphs_with_offsets=paragraphs_with_offsets)
+                for chunk, start_offset, overlap_char_count in chunks_with_offsets:
+                    correction_step = CorrectionStep(correction_id=correction_id,
+                                                    prompt_id=base_prompt.prompt_id,
+                                                    original_text_start_char=start_offset,
+                                                    original_text_end_char=start_offset + len(chunk),
+                                                    overlap_char_count=overlap_char_count,
+                                                    paragraph_index=None,
+                                                    status=CorrectionStatusEnum.PENDING)
+                    self.db.add(correction_step)
+                    pending_steps += 1
+
+        return reused_steps, pending_steps
+
+    def _copy_correction_step(self, parent_step: CorrectionStep, correction_id: int, paragraph_index: int, start_offset: int):
+        shift = start_offset - parent_step.original_text_start_char
+        correction_step = CorrectionStep(correction_id=correction_id,
+                                         prompt_id=parent_step.prompt_id,
+                                         original_text_start_char=start_offset,
+                                         original_text_end_char=parent_step.original_text_end_char + shift,
+                                         paragraph_index=paragraph_index,
+                                         status=CorrectionStatusEnum.COMPLETED,
+                                         llm_response=parent_step.llm_response,
+                                         llm_model_name=parent_step.llm_model_name)
+        for item in parent_step.analysis_results:
+            # Snippets that could not be located keep their (-1, -1) marker.
+            located = item.original_text_start_char >= 0
+            correction_step.analysis_results.append(AnalysisResult(
+                snippet=item.snippet,
+                issue=item.issue,
+                revision=item.revision,
+                original_text_start_char=item.original_text_start_char + shift if located else item.original_text_start_char,
+                original_text_end_char=item.original_text_end_char + shift if located else item.original_text_end_char
+            ))
+        self.db.add(correction_step)
 
     async def run_correction(self, correction_id: int):
-        correction = self.db.query(Correction).filter(Correction.correction_id == correction_id).first()
-        llm_step_coroutines = self._get_llm_coroutines(correction=correction)
-
-        # Limit the requests per minute to RATE_LIMIT_RPM.
-        rate_lock = asyncio.Lock()
-        min_interval = 60.0 / RATE_LIMIT_RPM 
-        next_allowed = 0.0
-
-        async def pace():
-            nonlocal next_allowed
-            async with rate_lock:
-                now = asyncio.get_running_loop().time()
-                # If we are ahead of schedule, wait
-                if now < next_allowed:
-                    await asyncio.sleep(next_allowed - now)
-                
-                next_allowed = max(now, next_allowed) + min_interval
-
-        # Limit the number of concurrent LLM calls to CONCURRENT_LLM_CALLS.
-        semaphore = asyncio.Semaphore(CONCURRENT_LLM_CALLS)
-
-        async def run_llm_step_coroutine_with_semaphore(coro):
-            async with semaphore:
-                await pace()
-                return await coro
-
-        tasks = [run_llm_step_coroutine_with_semaphore(coro) for coro in llm_step_coroutines]
-
-        # It runs the LLM calls in parallel. Return exceptions just makes sures that it continues running even if one of the LLM calls fails.
-        await asyncio.gather(*tasks, return_exceptions=True)
-        self._construct_analysis_results(correction_id=correction_id)
-        correction.status = CorrectionStatusEnum.COMPLETED
-        self.db.commit()
+        """
+        Runs all pending steps of a correction in this process and marks it completed. The API
+        leaves this to the worker (see src/services/worker.py); this is kept for scripts.
+        """
+        # Steps copied from a parent correction are already completed and have their analysis results.
+        pending_step_ids = self.repository.get_pending_step_ids(correction_id=correction_id)
+        await self.run_correction_steps(correction_step_ids=pending_step_ids)
+        self.finalize_corrections(correction_ids=[correction_id])
+        await llm_context_caches.release(correction_ids=[correction_id])
 
+    async def run_correction_steps(self, correction_step_ids: List[int], lease_owner: Optional[str] = None):
+        """
+        Runs the steps, which must be leased to lease_owner (None if they are run without the job queue). Without
+        a lease_owner, raises if their results could not be stored, as the job queue will not run them again.
+        """
+        # Finished steps are persisted in batches rather than with one transaction each.
+        with span("correction.run_steps", **{"steps.count": len(correction_step_ids)}):
+            async with StepResultWriter(lease_owner=lease_owner) as writer:
+                llm_step_coroutines = self.prepare_correction_steps(correction_step_ids=correction_step_ids, writer=writer)
 
-    def _get_llm_coroutines(self, correction: Correction):
-        llm_calls = []
-        for step in correction.steps:
-            input_text = step.input_text_sent_to_llm
-            prompt = jinja2.Template(step.prompt.text).render(
-                input_text=input_text
+                # It runs the LLM calls in parallel. Return exceptions just makes sures that it continues running even if one of the LLM calls fails.
+                await asyncio.gather(*llm_step_coroutines, return_exceptions=True)
+
+    def prepare_correction_steps(self, correction_step_ids: List[int], writer: StepResultWriter) -> List[Coroutine]:
+        """
+        Loads the pending steps, completes those answered by the LLM response cache and returns
+        one coroutine per remaining step that calls the LLM and hands its result to `writer`.
+        """
+        steps = self.repository.get_pending_steps(correction_step_ids=correction_step_ids)
+        return self._get_llm_coroutines(steps=steps, writer=writer)
+
+    def finalize_corrections(self, correction_ids: List[int]):
+        """
+        Marks the corrections completed and stores their results snapshots. The status is committed first,
+        which releases the row locks taken by JobQueue.claim_finished_corrections; each snapshot is then
+        built in a short transaction of its own. A correction read before its snapshot is stored (or whose
+        snapshot was never stored, e.g. as the worker stopped) gets it built by get_results_snapshot.
+        """
+        if not correction_ids:
+            return
+        self.db.execute(
+            update(Correction)
+            .where(Correction.correction_id.in_(correction_ids))
+            .values(status=CorrectionStatusEnum.COMPLETED)
+        )
+        for correction_id in correction_ids:
+            publish_correction_event(self.db, correction_id=correction_id, status=CorrectionStatusEnum.COMPLETED.value)
+        self.db.commit()
+        for correction_id in correction_ids:
+            self._store_results_snapshots(correction_ids=[correction_id])
+            self.db.commit()
+
+    def _store_results_snapshots(self, correction_ids: List[int]) -> Dict[int, ResultsSnapshot]:
+        snapshots = {}
+        for correction_id in correction_ids:
+            snapshot = build_results_snapshot(self.get_correction_results(correction_id=correction_id))
+            self.db.execute(
+                update(Correction)
+                .where(Correction.correction_id == correction_id)
+                .values(results_snapshot=snapshot.body, results_etag=snapshot.etag)
             )
-            llm_coro = self.llm.get_validated_response(
-                prompt=prompt,
-                response_model=SnippetIssuesRevisionList
+            snapshots[correction_id] = snapshot
+        return snapshots
+
+    def prepare_batch_steps(self, correction_step_ids: List[int], writer: StepResultWriter) -> Dict[str, List[Tuple[CorrectionStep, str, str]]]:
+        """
+        Batch mode counterpart of prepare_correction_steps (see src/services/batch_runner.py): completes the
+        steps answered by the LLM response cache and returns (step, rendered prompt, cache key) of the
+        others, by model name.
+        """
+        steps = self.repository.get_pending_steps(correction_step_ids=correction_step_ids)
+        prompts, cache_keys, uncached_steps = self._complete_cached_steps(steps=steps, writer=writer)
+        steps_by_model: Dict[str, List[Tuple[CorrectionStep, str, str]]] = {}
+        for step in uncached_steps:
+            steps_by_model.setdefault(self._get_llm(step).model_name, []).append(
+                (step, prompts[step.correction_step_id], cache_keys[step.correction_step_id])
             )
+        for step in steps:
+            self.db.expunge(step)
+        self.db.commit()
+        return steps_by_model
+
+    def get_batch_step_result(self, step: CorrectionStep, llm_response: Dict, cache_key: str, model_name: str,
+                              trace: Optional[LLMCallTrace] = None) -> StepResult:
+        """The result of a step answered in a batch, with its analysis results. `trace` only carries tokens and is not recorded in the metrics."""
+        result = self._completed_step_result(step=step, llm_response=llm_response, cache_key=cache_key, model_name=model_name)
+        result.trace = trace
+        return result
+
+    def _get_llm_coroutines(self, steps: List[CorrectionStep], writer: StepResultWriter):
+        prompts, cache_keys, uncached_steps = self._complete_cached_steps(steps=steps, writer=writer)
+
+        llm_calls = []
+        step_groups = self._group_fusable_steps(uncached_steps) if self.fuse_prompts else [[step] for step in uncached_steps]
+        prompt_contexts = self._get_prompt_contexts([step_group[0] for step_group in step_groups if len(step_group) == 1])
+        for step_group in step_groups:
+            context = None
+            trace = LLMCallTrace()
+            if len(step_group) == 1:
+                step = step_group[0]
+                prompt = prompts[step.correction_step_id]
+                response_model = SnippetIssuesRevisionList
+                context = prompt_contexts.get(step.correction_step_id)
+            else:
+                step = step_group[0]
+                prompt = render_fused_prompt({step.prompt.prompt_id_ref: step.prompt.text for step in step_group}, step.input_text_sent_to_llm)
+                response_model = get_fused_response_model(tuple(step.prompt.prompt_id_ref for step in step_group))
+
+            llm_coro = self._get_validated_response(llm=self._get_llm(step), correction_id=step.correction_id, prompt=prompt,
+                                                    response_model=response_model, context=context, trace=trace)
 
-            llm_calls.append(self._run_llm_step(correction_step_id=step.correction_step_id, llm_coroutine=llm_coro))
+            if len(step_group) == 1:
+                llm_calls.append(self._run_llm_step(step=step, llm_coroutine=llm_coro, cache_key=cache_keys[step.correction_step_id], writer=writer,
+                                                    trace=trace))
+            else:
+                llm_calls.append(self._run_fused_llm_steps(steps=step_group, llm_coroutine=llm_coro, writer=writer, trace=trace))
 
+        # Persists the hit counts of the LLM response cache and ends the read transaction before the LLM calls.
+        # The steps are detached first so the commit does not expire them; the coroutines only read their loaded attributes.
+        for step in steps:
+            self.db.expunge(step)
+        self.db.commit()
         return llm_calls
 
-    async def _run_llm_step(self, correction_step_id: int, llm_coroutine: Callable):
-        try: 
-            result = await llm_coroutine
-        except Exception as e:
-            with get_db_context() as db:
+    def _complete_cached_steps(self, steps: List[CorrectionStep], writer: StepResultWriter) -> Tuple[Dict[int, str], Dict[int, str], List[CorrectionStep]]:
+        """Renders the prompts of the steps and completes those answered by the LLM response cache. Returns (prompts, cache keys, uncached steps)."""
+        prompts = {
+            step.correction_step_id: prompt_registry.render(step.prompt.text, input_text=step.input_text_sent_to_llm)
+            for step in steps
+        }
+        cache_keys = {
+            step.correction_step_id: llm_response_cache.make_key(self._get_llm(step).model_name, prompts[step.correction_step_id], SnippetIssuesRevisionList)
+            for step in steps
+        }
+        cached_responses = llm_response_cache.get_many(self.db, list(cache_keys.values()))
+
+        uncached_steps = []
+        for step in steps:
+            # Steps whose exact prompt was already answered complete right away, without an LLM call or rate-limit budget.
+            cached_response = cached_responses.get(cache_keys[step.correction_step_id])
+            if cached_response is not None:
+                record_step(self._get_llm(step).model_name, step.prompt.prompt_id_ref, outcome="cached", seconds=0.0)
+                writer.add_nowait(StepResult(
+                    correction_id=step.correction_id,
+                    correction_step_id=step.correction_step_id,
+                    status=CorrectionStatusEnum.COMPLETED,
+                    llm_response=cached_response,
+                    analysis_results=self._construct_analysis_results(step=step, llm_response=cached_response),
+                    model_name=self._get_llm(step).model_name
+                ))
+            else:
+                uncached_steps.append(step)
+        return prompts, cache_keys, uncached_steps
+
+    def _get_prompt_contexts(self, steps: List[CorrectionStep]) -> Dict[int, PromptContext]:
+        """
+        Picks the steps whose prompt shares a long prefix with other pending steps of the same correction:
+        the segment (several prompts over the whole text or the same chunk) or the rendered instructions
+        (one prompt over many paragraphs). Returns, per step id, the split of its prompt for context caching.
+        """
+        if not llm_context_caches.enabled:
+            return {}
+        steps = [step for step in steps if self._get_llm(step).supports_context_caching]
+        min_tokens = llm_context_caches.min_tokens
+        # Only prefixes long enough to be cached are worth counting the steps that share them.
+        long_segment_steps = [step for step in steps if estimate_token_count(step.input_text_sent_to_llm) >= min_tokens]
+        long_prompt_steps = [step for step in steps if estimate_token_count(step.prompt.text) >= min_tokens]
+        if not long_segment_steps and not long_prompt_steps:
+            return {}
+
+        segment_uses = self.repository.count_pending_steps_per_segment({step.correction_id for step in long_segment_steps}) if long_segment_steps else {}
+        prompt_uses = self.repository.count_pending_steps_per_prompt({step.correction_id for step in long_prompt_steps}) if long_prompt_steps else {}
+        prompt_contexts = {}
+        for step in steps:
+            segment_key = (step.correction_id, step.original_text_start_char, step.original_text_end_char - step.original_text_start_char)
+            context = split_prompt_context(
+                prompt_text=step.prompt.text,
+                input_text=step.input_text_sent_to_llm,
+                shared_document=segment_uses.get(segment_key, 0) >= llm_context_caches.min_uses,
+                shared_instructions=prompt_uses.get((step.correction_id, step.prompt_id), 0) >= llm_context_caches.min_uses,
+                min_tokens=min_tokens
+            )
+            if context is not None:
+                prompt_contexts[step.correction_step_id] = context
+        return prompt_contexts
+
+    async def _get_validated_response(self, llm: LLMInteraction, correction_id: int, prompt: str, response_model,
+                                      context: Optional[PromptContext] = None, trace: Optional[LLMCallTrace] = None) -> Optional[LLMResult]:
+        """
+        Sends the prompt, or only the part after its context if the context is cached by the provider.
+        If the model gives up, the whole prompt goes to its fallback tiers in turn (LLM_FALLBACK_MODELS).
+        The attempts of every tier are added to `trace`.
+        """
+        # Pacing, concurrency and fairness between corrections are handled by the process-wide scheduler, per attempt.
+        tokens = estimate_token_count(prompt)
+        # A call with cached content and the whole-prompt call replacing it go to the same model, so they share its retry budget.
+        attempts: Dict[LLMErrorClass, int] = defaultdict(int)
+        if context is not None:
+            cached_content = await llm_context_caches.get_or_create(llm, correction_id=correction_id, content=context.content)
+            if cached_content is not None:
+                result = await llm.get_validated_response(prompt=context.prompt, response_model=response_model, cached_content=cached_content,
+                                                          scheduler_key=correction_id, tokens=tokens, trace=trace, attempts=attempts)
+                if result is not None:
+                    return LLMResult(response=result, model_name=llm.model_name)
+                logger.warning(f"LLM call with cached content {cached_content} failed, sending the whole prompt")
+
+        tiers = [llm] + [self._get_model_llm(model_name) for model_name in LLM_FALLBACK_MODELS.get(llm.model_name, [])]
+        for tier, next_tier in zip(tiers, tiers[1:] + [None]):
+            result = await tier.get_validated_response(prompt=prompt, response_model=response_model, scheduler_key=correction_id, tokens=tokens,
+                                                       wait_for_circuit=next_tier is None, trace=trace,
+                                                       attempts=attempts if tier is llm else None)
+            if result is not None:
+                return LLMResult(response=result, model_name=tier.model_name)
+            if next_tier is not None:
+                logger.warning(f"LLM call to {tier.model_name} gave up, falling back to {next_tier.model_name}")
+                llm_call_metrics.record_fallback(tier.model_name)
+        return None
+
+    def _get_llm(self, step: CorrectionStep) -> LLMInteraction:
+        """The LLM of the step's prompt, or the default one."""
+        return self._get_model_llm(step.prompt.model_name or self.llm.model_name)
+
+    def _get_model_llm(self, model_name: str) -> LLMInteraction:
+        llm = self.llms.get(model_name)
+        if llm is None:
+            llm = self.llms[model_name] = LLMInteraction(model_name=model_name)
+        return llm
+
+    def _group_fusable_steps(self, steps: List[CorrectionStep]) -> List[List[CorrectionStep]]:
+        """
+        Groups steps of different prompts over the same segment of the same correction and for the same
+        model, at most LLM_FUSED_MAX_PROMPTS per group, so that each group can be answered by one fused LLM call.
+        """
+        groups: Dict[Tuple[int, int, int, str], List[List[CorrectionStep]]] = {}
+        unfusable: List[List[CorrectionStep]] = []
+        for step in steps:
+            if not can_fuse(step.prompt.prompt_id_ref):
+                unfusable.append([step])
+                continue
+            segment_key = (step.correction_id, step.original_text_start_char, step.original_text_end_char, self._get_llm(step).model_name)
+            segment_groups = groups.setdefault(segment_key, [[]])
+            group = segment_groups[-1]
+            if len(group) >= LLM_FUSED_MAX_PROMPTS or any(other.prompt_id == step.prompt_id for other in group):
+                group = []
+                segment_groups.append(group)
+            group.append(step)
+        return [group for segment_groups in groups.values() for group in segment_groups] + unfusable
+
+    async def _run_llm_step(self, step: CorrectionStep, llm_coroutine: Callable, cache_key: str, writer: StepResultWriter, trace: LLMCallTrace):
+        correction_step_id = step.correction_step_id
+        with span("correction.step", **{"correction.id": step.correction_id, "correction.step_id": correction_step_id,
+                                        "prompt.id_ref": step.prompt.prompt_id_ref}):
+            try:
+                result = await llm_coroutine
+                if result is None:
+                    raise ValueError("No validated response from LLM")
+            except Exception as e:
                 logger.error(f"Error running LLM step {correction_step_id}: {e}")
-                correction_step = db.query(CorrectionStep).filter(CorrectionStep.correction_step_id == correction_step_id).first()
-                correction_step.status = CorrectionStatusEnum.FAILED
-                db.commit()
+                await writer.add(self._failed_step_result(step=step, error_message=str(e), trace=trace))
                 return
-        
-        with get_db_context() as db:
-            correction_step = db.query(CorrectionStep).filter(CorrectionStep.correction_step_id == correction_step_id).first()
-            correction_step.llm_response = result.model_dump()
-            correction_step.status = CorrectionStatusEnum.COMPLETED
-            db.commit()
-
-
-    def _construct_analysis_results(self, correction_id: int):
-        with get_db_context() as db:
-            correction = db.query(Correction).filter(Correction.correction_id == correction_id).first()
-            for step in correction.steps:
-                if step.status == CorrectionStatusEnum.COMPLETED:
-                    issues = step.llm_response['issues']
-                    for issue_item in issues:
-                        start_char, end_char = locate_snippet_in_segment(
-                            segment_text=step.input_text_sent_to_llm,
-                            segment_global_start_offset=step.original_text_start_char,
-                            snippet=issue_item["snippet"],
-                            sentence_context=issue_item["sentence_context"]
-                        )
-
-                        analysis_result = AnalysisResult(
-                            correction_step_id=step.correction_step_id,
-                            snippet=issue_item["snippet"],
-                            issue=issue_item["issue"],
-                            revision=issue_item["revision"],
-                            original_text_start_char=start_char,
-                            original_text_end_char=end_char
-                        )
-
-                        db.add(analysis_result)
-
-    def get_correction_status(self, correction_id: int) -> CorrectionStatusResponse:
-        correction = self.db.query(Correction).filter(Correction.correction_id == correction_id).first()
-        total_steps = len(correction.steps)
-        completed_steps = len([step for step in correction.steps if step.status in [CorrectionStatusEnum.COMPLETED, CorrectionStatusEnum.FAILED]])
+
+            await writer.add(self._completed_step_result(step=step, llm_response=result.response.model_dump(), cache_key=cache_key,
+                                                         model_name=result.model_name, trace=trace))
+
+    async def _run_fused_llm_steps(self, steps: List[CorrectionStep], llm_coroutine: Callable, writer: StepResultWriter, trace: LLMCallTrace):
+        """Splits the answer of a fused LLM call into the results of its steps, which succeed or fail together."""
+        prompt_id_refs = [step.prompt.prompt_id_ref for step in steps]
+        with span("correction.fused_steps", **{"correction.id": steps[0].correction_id, "prompt.id_refs": prompt_id_refs}):
+            try:
+                result = await llm_coroutine
+                if result is None:
+                    raise ValueError("No validated response from LLM")
+                responses = split_fused_response(result.response, prompt_id_refs)
+            except Exception as e:
+                logger.error(f"Error running fused LLM steps {[step.correction_step_id for step in steps]}: {e}")
+                for step, step_trace in zip(steps, trace.split(len(steps))):
+                    await writer.add(self._failed_step_result(step=step, error_message=str(e), trace=step_trace))
+                return
+
+            for step, prompt_id_ref, step_trace in zip(steps, prompt_id_refs, trace.split(len(steps))):
+                # Not cached: a slice of the fused answer was not produced by the unfused prompt its cache key stands for.
+                await writer.add(self._completed_step_result(step=step, llm_response=responses[prompt_id_ref].model_dump(),
+                                                             cache_key=None, model_name=result.model_name, trace=step_trace))
+
+    def _completed_step_result(self, step: CorrectionStep, llm_response: Dict, cache_key: Optional[str], model_name: str,
+                               trace: Optional[LLMCallTrace] = None) -> StepResult:
+        # Cache keys are made for the step's own model, so answers of a fallback tier are not cached under them.
+        if model_name != self._get_llm(step).model_name:
+            cache_key = None
+        if trace is not None:
+            self._record_step(step, model_name=model_name, outcome=CorrectionStatusEnum.COMPLETED, trace=trace)
+        return StepResult(
+            correction_id=step.correction_id,
+            correction_step_id=step.correction_step_id,
+            status=CorrectionStatusEnum.COMPLETED,
+            llm_response=llm_response,
+            analysis_results=self._construct_analysis_results(step=step, llm_response=llm_response),
+            cache_key=cache_key,
+            model_name=model_name,
+            trace=trace
+        )
+
+    def _failed_step_result(self, step: CorrectionStep, error_message: str, trace: LLMCallTrace) -> StepResult:
+        self._record_step(step, model_name=self._get_llm(step).model_name, outcome=CorrectionStatusEnum.FAILED, trace=trace)
+        return StepResult(correction_id=step.correction_id, correction_step_id=step.correction_step_id, status=CorrectionStatusEnum.FAILED,
+                          error_message=error_message, trace=trace)
+
+    @staticmethod
+    def _record_step(step: CorrectionStep, model_name: str, outcome: CorrectionStatusEnum, trace: LLMCallTrace):
+        record_step(model_name, step.prompt.prompt_id_ref, outcome=outcome.value, seconds=time.monotonic() - trace.started_at,
+                    retries=trace.retries, prompt_tokens=trace.prompt_tokens, output_tokens=trace.output_tokens)
+
+    def _construct_analysis_results(self, step: CorrectionStep, llm_response: Dict) -> List[Dict]:
+        analysis_results = []
+        # One locator per step: its index is built once, and repeated snippets get distinct occurrences.
+        locator = SegmentSnippetLocator(segment_text=step.input_text_sent_to_llm, segment_global_start_offset=step.original_text_start_char,
+                                        owned_start_char=step.overlap_char_count)
+        # Issues in the overlap with the previous chunk are reported by the step of that chunk; the locator only
+        # places a snippet there if it does not occur in the rest of the chunk.
+        owned_start_char = step.original_text_start_char + step.overlap_char_count
+        for issue_item in llm_response['issues']:
+            start_char, end_char = locator.locate(snippet=issue_item["snippet"], sentence_context=issue_item["sentence_context"])
+            if 0 <= start_char < owned_start_char:
+                continue
+
+            analysis_results.append(dict(
+                correction_step_id=step.correction_step_id,
+                snippet=issue_item["snippet"],
+                issue=issue_item["issue"],
+                revision=issue_item["revision"],
+                original_text_start_char=start_char,
+                original_text_end_char=end_char
+            ))
+
+        return analysis_results
+
+    def get_correction_status(self, correction_id: int) -> Optional[CorrectionStatusResponse]:
+        status_with_step_counts = self.repository.get_status_with_step_counts(correction_id=correction_id)
+        if not status_with_step_counts:
+            return None
+        status, step_counts = status_with_step_counts
+        total_steps = sum(step_counts.values())
+        completed_steps = step_counts.get(CorrectionStatusEnum.COMPLETED, 0) + step_counts.get(CorrectionStatusEnum.FAILED, 0)
         progress = completed_steps / total_steps if total_steps > 0 else 0
-        return CorrectionStatusResponse(correction_id=correction.correction_id, status=correction.status.value, progress=progress)
+        return CorrectionStatusResponse(correction_id=correction_id, status=status.value, progress=progress)
+
+    def get_new_issues(self, correction_id: int, exclude_step_ids: Set[int]) -> Tuple[List[RichSegmentIssueDelta], List[int]]:
+        """
+        Returns the located issues of the completed steps of a correction that are not in
+        exclude_step_ids, together with the ids of those steps. Used to stream results as steps finish.
+        """
+        completed_step_ids = self.repository.get_completed_step_ids(correction_id=correction_id)
+        new_step_ids = [step_id for step_id in completed_step_ids if step_id not in exclude_step_ids]
+        if not new_step_ids:
+            return [], []
+
+        rows = self.repository.get_analysis_results_with_prompt_refs(correction_id=correction_id, correction_step_ids=new_step_ids, located_only=True)
+        issues = [
+            RichSegmentIssueDelta(start_char=item.original_text_start_char, end_char=item.original_text_end_char,
+                                  snippet=item.snippet, prompt_id_ref=prompt_id_ref, issue=item.issue, revision=item.revision)
+            for item, prompt_id_ref in rows
+        ]
+        return issues, new_step_ids
+
+    def get_results_snapshot(self, correction_id: int) -> Optional[ResultsSnapshot]:
+        """
+        The stored results of a completed correction, read with a single statement. A completed correction
+        without a snapshot (stored just after completion, see finalize_corrections) gets it on first read.
+        None if the correction does not exist or is not completed yet; get_correction_results covers those.
+        """
+        row = self.repository.get_results_snapshot(correction_id=correction_id)
+        if not row or row[0] != CorrectionStatusEnum.COMPLETED:
+            return None
+        status, body, etag = row
+        if body is None:
+            snapshot = self._store_results_snapshots(correction_ids=[correction_id])[correction_id]
+            self.db.commit()
+            return snapshot
+        return ResultsSnapshot(body=body, etag=etag)
 
-    def get_correction_results(self, correction_id: int) -> CorrectionResultResponse:
-        correction = self.db.query(Correction).filter(Correction.correction_id == correction_id).first()
+    def get_correction_results(self, correction_id: int) -> Optional[CorrectionResultResponse]:
+        correction = self.repository.get_correction(correction_id=correction_id)
         
         if not correction:
             logger.error(f"Correction with id {correction_id} not found")
-            raise ValueError(f"Correction with id {correction_id} not found")
+            return None
         
         if correction.status != CorrectionStatusEnum.COMPLETED:
             return CorrectionResultResponse(correction_id=correction.correction_id, 
@@ -168,9 +606,8 @@ class CorrectionService:
                                             status=correction.status.value, 
                                             rich_segments=None)
         
-        analysis_items = []
-        for step in correction.steps:
-            analysis_items.extend(step.analysis_results)
+        # Prompt refs are resolved in the same query instead of lazy-loading step.prompt for every issue.
+        analysis_items = self.repository.get_analysis_results_with_prompt_refs(correction_id=correction.correction_id)
         
         if not analysis_items:
             return CorrectionResultResponse(
@@ -180,34 +617,137 @@ class CorrectionService:
                 rich_segments=[RichSegment(text=correction.original_text, start_char=0, end_char=len(correction.original_text), issues=[])]
             )
         
-        original_text = correction.original_text
-        points = {0, len(original_text)}
-        for item in analysis_items:
-            if item.original_text_start_char is not None and item.original_text_end_char >= 0 and item.original_text_start_char < item.original_text_end_char:
-                points.add(item.original_text_start_char)
-                points.add(item.original_text_end_char)
-
-        # Sort and ensure points are unique and create valid segments
-        unique_sorted_points = sorted(list(points))
-
-        rich_segments = [] 
-        for i in range(len(unique_sorted_points) - 1):
-            start_char = unique_sorted_points[i]
-            end_char = unique_sorted_points[i + 1]
-            
-            segment_text = original_text[start_char:end_char]
-            issues_for_segment = []
-            for item in analysis_items:
-                if item.original_text_start_char <= start_char and item.original_text_end_char >= end_char:
-                    issues_for_segment.append(RichSegmentIssue(prompt_id_ref=item.correction_step.prompt.prompt_id_ref, 
-                                                               issue=item.issue, 
-                                                               revision=item.revision))
-
-
-            rich_segments.append(RichSegment(text=segment_text, start_char=start_char, end_char=end_char, issues=issues_for_segment))
-
-        rich_segments.sort()
+        located_issues = [
+            (item.original_text_start_char, item.original_text_end_char,
+             RichSegmentIssue(prompt_id_ref=prompt_id_ref, issue=item.issue, revision=item.revision))
+            for item, prompt_id_ref in analysis_items
+        ]
+        rich_segments = build_rich_segments(original_text=correction.original_text, located_issues=located_issues)
         return CorrectionResultResponse(correction_id=correction.correction_id, 
                                         original_text=correction.original_text, 
                                         status=correction.status.value, 
-                                        rich_segments=rich_segments)
\ No newline at end of file
+                                        rich_segments=rich_segments)
+
+
+    def get_correction_results_window(self, correction_id: int, start_char: int = 0, end_char: Optional[int] = None,
+                                      paragraph_start: Optional[int] = None, paragraph_end: Optional[int] = None,
+                                      cursor: Optional[int] = None, limit: Optional[int] = None,
+                                      include_text: bool = True, issues_only: bool = False) -> Optional[CorrectionResultResponse]:
+        """
+        The results within a window of the text, for clients that only show part of a long document:
+        the characters [start_char, end_char), or the paragraphs [paragraph_start, paragraph_end) as
+        numbered by split_text_into_paragraphs. Segments are cut at the window edges, so an issue
+        crossing one is clipped to it. issues_only leaves out the segments without issues.
+
+        At most `limit` segments are returned; next_cursor, passed back as `cursor` with the same window,
+        gets the following ones. Only the window's text and issues are loaded, unless include_text
+        (which returns the whole original_text) or a paragraph window needs the whole text.
+        """
+        original_text = None
+        if include_text or paragraph_start is not None or paragraph_end is not None:
+            correction = self.repository.get_correction(correction_id=correction_id)
+            if not correction:
+                return None
+            status, original_text = correction.status, correction.original_text
+            if paragraph_start is not None or paragraph_end is not None:
+                start_char, end_char = self._get_paragraph_window(original_text, paragraph_start or 0, paragraph_end)
+            start_char = max(start_char, cursor or 0)
+            end_char = len(original_text) if end_char is None else min(end_char, len(original_text))
+            start_char = min(start_char, end_char)
+            window_text = original_text[start_char:end_char]
+        else:
+            start_char = max(start_char, cursor or 0)
+            text_window = self.repository.get_text_window(correction_id=correction_id, start_char=start_char, end_char=end_char)
+            if not text_window:
+                return None
+            status, text_length, window_text = text_window
+            start_char = min(start_char, text_length)
+            end_char = start_char + len(window_text)
+
+        results = CorrectionResultResponse(correction_id=correction_id, original_text=original_text if include_text else None,
+                                           status=status.value, start_char=start_char, end_char=end_char)
+        if status != CorrectionStatusEnum.COMPLETED:
+            return results
+
+        analysis_items = self.repository.get_analysis_results_with_prompt_refs(correction_id=correction_id, window=(start_char, end_char))
+        located_issues = [
+            (max(item.original_text_start_char, start_char), min(item.original_text_end_char, end_char),
+             RichSegmentIssue(prompt_id_ref=prompt_id_ref, issue=item.issue, revision=item.revision))
+            for item, prompt_id_ref in analysis_items
+        ]
+        rich_segments = build_rich_segments(original_text=window_text, located_issues=located_issues, text_offset=start_char)
+        if issues_only:
+            rich_segments = [segment for segment in rich_segments if segment.issues]
+        if limit is not None and len(rich_segments) > limit:
+            rich_segments = rich_segments[:limit]
+            results.next_cursor = rich_segments[-1].end_char if rich_segments else None
+        results.rich_segments = rich_segments
+        return results
+
+    @staticmethod
+    def _get_paragraph_window(original_text: str, paragraph_start: int, paragraph_end: Optional[int]) -> Tuple[int, int]:
+        """Characters spanned by the paragraphs [paragraph_start, paragraph_end) of the text."""
+        paragraphs = split_text_into_paragraphs(original_text)[paragraph_start:paragraph_end]
+        if not paragraphs:
+            return len(original_text), len(original_text)
+        last_paragraph, last_start = paragraphs[-1]
+        return paragraphs[0][1], last_start + len(last_paragraph)
+
+
+class AsyncCorrectionService:
+    """
+    Async facade of CorrectionService over an AsyncSession (asyncpg). The ORM code of CorrectionService
+    runs through AsyncSession.run_sync, so its queries are awaited instead of blocking the event loop
+    that serves other requests and drives the in-flight LLM calls.
+    """
+
+    def __init__(self, db: AsyncSession, llm_model_name: str, fuse_prompts: bool = LLM_FUSED_PROMPTS_ENABLED):
+        self.db = db
+        # Bound to the session run_sync hands to the callables below; only used inside run_sync.
+        self.service = CorrectionService(db=db.sync_session, llm_model_name=llm_model_name, fuse_prompts=fuse_prompts)
+
+    async def create_new_correction(self, original_text: str, prompt_id_refs: List[str]) -> CorrectionCreateResponse:
+        return await self.db.run_sync(lambda _: self.service.create_new_correction(original_text=original_text, prompt_id_refs=prompt_id_refs))
+
+    async def create_revision(self, parent_correction_id: int, original_text: str, prompt_id_refs: Optional[List[str]] = None) -> Optional[CorrectionRevisionResponse]:
+        return await self.db.run_sync(lambda _: self.service.create_revision(
+            parent_correction_id=parent_correction_id, original_text=original_text, prompt_id_refs=prompt_id_refs
+        ))
+
+    async def run_correction(self, correction_id: int):
+        pending_step_ids = await self.db.run_sync(lambda _: self.service.repository.get_pending_step_ids(correction_id=correction_id))
+        await self.run_correction_steps(correction_step_ids=pending_step_ids)
+        await self.finalize_corrections(correction_ids=[correction_id])
+
+    async def run_correction_steps(self, correction_step_ids: List[int], lease_owner: Optional[str] = None):
+        async with StepResultWriter(lease_owner=lease_owner) as writer:
+            llm_step_coroutines = await self.db.run_sync(
+                lambda _: self.service.prepare_correction_steps(correction_step_ids=correction_step_ids, writer=writer)
+            )
+            await asyncio.gather(*llm_step_coroutines, return_exceptions=True)
+
+    async def finalize_corrections(self, correction_ids: List[int]):
+        await self.db.run_sync(lambda _: self.service.finalize_corrections(correction_ids=correction_ids))
+        # After the commit above, so the provider calls do not hold the corrections' row locks.
+        await llm_context_caches.release(correction_ids=correction_ids)
+
+    async def get_correction_status(self, correction_id: int) -> Optional[CorrectionStatusResponse]:
+        return await self.db.run_sync(lambda _: self.service.get_correction_status(correction_id=correction_id))
+
+    async def get_new_issues(self, correction_id: int, exclude_step_ids: Set[int]) -> Tuple[List[RichSegmentIssueDelta], List[int]]:
+        return await self.db.run_sync(lambda _: self.service.get_new_issues(correction_id=correction_id, exclude_step_ids=exclude_step_ids))
+
+    async def get_results_snapshot(self, correction_id: int) -> Optional[ResultsSnapshot]:
+        return await self.db.run_sync(lambda _: self.service.get_results_snapshot(correction_id=correction_id))
+
+    async def get_correction_results(self, correction_id: int) -> Optional[CorrectionResultResponse]:
+        return await self.db.run_sync(lambda _: self.service.get_correction_results(correction_id=correction_id))
+
+    async def get_correction_results_window(self, correction_id: int, start_char: int = 0, end_char: Optional[int] = None,
+                                            paragraph_start: Optional[int] = None, paragraph_end: Optional[int] = None,
+                                            cursor: Optional[int] = None, limit: Optional[int] = None,
+                                            include_text: bool = True, issues_only: bool = False) -> Optional[CorrectionResultResponse]:
+        return await self.db.run_sync(lambda _: self.service.get_correction_results_window(
+            correction_id=correction_id, start_char=start_char, end_char=end_char, paragraph_start=paragraph_start, paragraph_end=paragraph_end,
+            cursor=cursor, limit=limit, include_text=include_text, issues_only=issues_only
+        ))
@@ -0,0 +1,113 @@
+from typing import Dict, Set, Any, Optional
+from contextlib import asynccontextmanager
+from sqlalchemy import select, func, event as sqlalchemy_event
+from sqlalchemy.orm import Session
+import psycopg2
+import psycopg2.extensions
+import asyncio
+import json
+
+from src.utils import logger, engine
+from config import CORRECTION_EVENTS_BACKEND
+
+CORRECTION_EVENTS_CHANNEL = "correction_events"
+
+
+def publish_correction_event(db: Session, correction_id: int, **payload: Any):
+    """
+    Publishes an event about a correction, e.g. that some of its steps finished. With the postgres
+    backend the event is a NOTIFY sent on commit of `db`, so it reaches API processes on any node;
+    with the memory backend it only reaches subscribers of the current process.
+    """
+    event = {"correction_id": correction_id, **payload}
+    if CORRECTION_EVENTS_BACKEND == "postgres":
+        # NOTIFY payloads are limited to 8000 bytes, so events stay small; subscribers read the rest from the database.
+        db.execute(select(func.pg_notify(CORRECTION_EVENTS_CHANNEL, json.dumps(event))))
+    else:
+        sqlalchemy_event.listen(db, "after_commit", lambda session: correction_event_broker.publish(event), once=True)
+
+
+class CorrectionEventBroker:
+    """
+    Fans correction events out to the subscribers (SSE and WebSocket connections) of this process.
+    With the postgres backend it LISTENs on a dedicated connection, started on the first subscription.
+    """
+
+    def __init__(self, listen: bool):
+        self.listen = listen
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connection = None
+        self._connecting: Optional[asyncio.Lock] = None
+
+    @asynccontextmanager
+    async def subscribe(self, correction_id: int):
+        self._loop = asyncio.get_running_loop()
+        if self.listen and self._connection is None:
+            await self._start_listening()
+
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(correction_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(correction_id, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(correction_id, None)
+
+    def publish(self, event: Dict[str, Any]):
+        """Thread-safe, so events can also be published from code running in other threads."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: Dict[str, Any]):
+        for queue in self._subscribers.get(event.get("correction_id"), ()):
+            queue.put_nowait(event)
+
+    async def _start_listening(self):
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        # Concurrent first subscriptions share one connection.
+        async with self._connecting:
+            if self._connection is not None:
+                return
+            try:
+                # Connecting blocks, so it runs in a thread rather than on the event loop serving the requests.
+                self._connection = await asyncio.to_thread(self._connect)
+            except psycopg2.Error as e:
+                # Subscribers fall back to their periodic refresh; the next subscription retries.
+                logger.error(f"Could not listen for correction events: {e}")
+                return
+            self._loop.add_reader(self._connection.fileno(), self._on_notify)
+        logger.info(f"Listening for correction events on channel {CORRECTION_EVENTS_CHANNEL}")
+
+    @staticmethod
+    def _connect():
+        connect_args = engine.url.translate_connect_args(username="user", database="dbname")
+        connection = psycopg2.connect(**connect_args)
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CORRECTION_EVENTS_CHANNEL};")
+        return connection
+
+    def _on_notify(self):
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            # Subscribers fall back to their periodic refresh; the next subscription reconnects.
+            logger.error(f"Lost correction events connection: {e}")
+            self._loop.remove_reader(self._connection.fileno())
+            self._connection = None
+            return
+
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            try:
+                self._dispatch(json.loads(notify.payload))
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring malformed correction event: {notify.payload}")
+
+
+correction_event_broker = CorrectionEventBroker(listen=CORRECTION_EVENTS_BACKEND == "postgres")
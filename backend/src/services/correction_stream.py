@@ -0,0 +1,44 @@
+from typing import AsyncIterator, Tuple, Dict, Any, Set
+import asyncio
+
+from src.utils import get_async_db_context
+from src.models import CorrectionStatusEnum
+from src.services.correction import AsyncCorrectionService
+from src.services.correction_events import correction_event_broker
+from src.schemas.schemas_api import CorrectionIssuesEvent
+from config import LLM_MODEL_NAME, CORRECTION_STREAM_REFRESH_SECONDS
+
+
+async def iter_correction_events(correction_id: int) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields (event, data) pairs for a correction until it is no longer pending:
+    "issues" with the located issues of newly completed steps, "progress" after every change
+    (and at least every CORRECTION_STREAM_REFRESH_SECONDS) and a final "completed".
+    The first round replays everything that finished before the client subscribed.
+    """
+    sent_step_ids: Set[int] = set()
+    async with correction_event_broker.subscribe(correction_id) as queue:
+        while True:
+            async with get_async_db_context() as db:
+                correction_service = AsyncCorrectionService(db=db, llm_model_name=LLM_MODEL_NAME)
+                status = await correction_service.get_correction_status(correction_id=correction_id)
+                issues, step_ids = await correction_service.get_new_issues(correction_id=correction_id, exclude_step_ids=sent_step_ids)
+
+            if status is None:
+                return
+
+            sent_step_ids.update(step_ids)
+            if issues:
+                yield "issues", CorrectionIssuesEvent(correction_id=correction_id, issues=issues).model_dump()
+            yield "progress", status.model_dump()
+            if status.status != CorrectionStatusEnum.PENDING.value:
+                yield "completed", status.model_dump()
+                return
+
+            try:
+                await asyncio.wait_for(queue.get(), timeout=CORRECTION_STREAM_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            # Events that arrived meanwhile are covered by the next read.
+            while not queue.empty():
+                queue.get_nowait()
@@ -0,0 +1,154 @@
+from typing import Dict, List, Any, Optional, Type
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from pydantic import BaseModel
+import asyncio
+import itertools
+import re
+
+from src.schemas.schemas_llm import SnippetIssuesRevisionList, SnippetIssueRevision
+from src.services.text_utils import estimate_token_count
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_LONG_WORD = re.compile(r"[A-Za-z]{8,}")
+
+
+def _contents_to_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(_contents_to_text(item) for item in contents)
+
+
+@dataclass
+class FakeGenAIUsage:
+    """What the fake client was asked to do, to compare runs with and without context caching."""
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_content_tokens: int = 0
+    caches_created: int = 0
+    caches_deleted: int = 0
+    cache_tokens_uploaded: int = 0
+
+
+@dataclass
+class _FakeCachedContent:
+    name: str
+    model: str
+    text: str
+    expire_time: datetime
+    usage_metadata: Optional[SimpleNamespace] = None
+
+
+class _FakeModels:
+    def __init__(self, client: "FakeGenAIClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents: Any, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        prompt = _contents_to_text(contents)
+        cached_text = ""
+        if config.get("cached_content"):
+            cached_text = self._client.get_cached_content(config["cached_content"]).text
+
+        if self._client.scripted_errors:
+            self._client.usage.requests += 1
+            raise self._client.scripted_errors.pop(0)
+        prompt_tokens = estimate_token_count(prompt)
+        cached_tokens = estimate_token_count(cached_text) if cached_text else 0
+        usage = self._client.usage
+        usage.requests += 1
+        usage.prompt_tokens += prompt_tokens
+        usage.cached_content_tokens += cached_tokens
+        if self._client.latency_seconds:
+            await asyncio.sleep(self._client.latency_seconds)
+
+        parsed = fake_llm_response(config["response_schema"], prompt=cached_text + "\n" + prompt, issue_count=self._client.issues_per_request)
+        return SimpleNamespace(
+            parsed=parsed,
+            text=parsed.model_dump_json(),
+            usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens + cached_tokens, cached_content_token_count=cached_tokens or None,
+                                           candidates_token_count=estimate_token_count(parsed.model_dump_json())),
+        )
+
+
+class _FakeCaches:
+    def __init__(self, client: "FakeGenAIClient"):
+        self._client = client
+
+    async def create(self, model: str, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        text = _contents_to_text(config.get("contents", []))
+        ttl_seconds = float(str(config.get("ttl", "3600s")).rstrip("s"))
+        name = f"cachedContents/fake-{next(self._client._ids)}"
+        cached_content = _FakeCachedContent(
+            name=name, model=model, text=text,
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+            usage_metadata=SimpleNamespace(total_token_count=estimate_token_count(text))
+        )
+        self._client.cached_contents[name] = cached_content
+        self._client.usage.caches_created += 1
+        self._client.usage.cache_tokens_uploaded += estimate_token_count(text)
+        return cached_content
+
+    async def get(self, name: str, config: Optional[Dict[str, Any]] = None):
+        return self._client.get_cached_content(name)
+
+    async def delete(self, name: str, config: Optional[Dict[str, Any]] = None):
+        if self._client.cached_contents.pop(name, None) is None:
+            raise ValueError(f"Cached content {name} not found")
+        self._client.usage.caches_deleted += 1
+
+
+class FakeGenAIClient:
+    """
+    In-process stand-in for google.genai.Client, covering the calls GeminiBackend makes
+    (client.aio.models.generate_content and client.aio.caches). Responses are deterministic:
+    the first long words of the TEXT are reported as issues, so they can be located in the input.
+    Used when LLM_FAKE_CLIENT is set, e.g. to run the API and workers without an API key.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, issues_per_request: int = 2):
+        self.latency_seconds = latency_seconds
+        self.issues_per_request = issues_per_request
+        self.usage = FakeGenAIUsage()
+        self.cached_contents: Dict[str, _FakeCachedContent] = {}
+        self.scripted_errors: List[Exception] = []
+        self._ids = itertools.count(1)
+        self.aio = SimpleNamespace(models=_FakeModels(self), caches=_FakeCaches(self))
+
+    def fail_next(self, *errors: Exception):
+        """The next generate_content calls raise these errors, in order, e.g. genai.errors.ClientError(429, {...})."""
+        self.scripted_errors.extend(errors)
+
+    def get_cached_content(self, name: str) -> _FakeCachedContent:
+        cached_content = self.cached_contents.get(name)
+        if cached_content is None or cached_content.expire_time <= datetime.now(timezone.utc):
+            raise ValueError(f"Cached content {name} not found or expired")
+        return cached_content
+
+
+def _fake_issues(text: str, count: int) -> List[SnippetIssueRevision]:
+    issues = []
+    sentences = _SENTENCE_END.split(text)
+    for word in list(dict.fromkeys(_LONG_WORD.findall(text)))[:count]:
+        sentence = next((sentence for sentence in sentences if word in sentence), word)
+        issues.append(SnippetIssueRevision(snippet=word, sentence_context=sentence.strip(), issue=f"'{word}' is a long word", revision=word.lower()))
+    return issues
+
+
+def fake_llm_response(response_model: Type[BaseModel], prompt: str, issue_count: int = 2) -> BaseModel:
+    """
+    Deterministic, schema-valid answer to a rendered prompt: the first long words of its TEXT are
+    reported as issues. response_model is SnippetIssuesRevisionList or a fused composite of it.
+    """
+    # With a cached document, the prompt's own TEXT section only refers to it: take the longest one.
+    text = max(prompt.split("## TEXT:")[1:] or [prompt], key=len)
+    if "issues" in response_model.model_fields:
+        return response_model(issues=_fake_issues(text, issue_count))
+    # Composite schemas (fused prompts) have one SnippetIssuesRevisionList per field.
+    return response_model(**{name: SnippetIssuesRevisionList(issues=_fake_issues(text, issue_count)) for name in response_model.model_fields})
+
+
+# Shared by the process, so that cached contents outlive a single service.
+fake_genai_client = FakeGenAIClient()
@@ -0,0 +1,170 @@
+from typing import List, Optional, Iterable
+from datetime import timedelta
+from sqlalchemy import select, update, exists, func, or_, and_
+from sqlalchemy.orm import Session
+
+from src.utils import logger
+from src.models import Correction, CorrectionStep, CorrectionStatusEnum
+
+
+class JobQueue:
+    """
+    Postgres-backed queue over the corrections/correction_steps tables. Pending steps are leased to
+    one worker at a time with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can poll
+    the same database without handing out a step twice.
+    """
+
+    def __init__(self, worker_id: str, lease_seconds: int, max_attempts: int):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _claimable(self):
+        return and_(
+            CorrectionStep.status == CorrectionStatusEnum.PENDING,
+            or_(CorrectionStep.lease_expires_at.is_(None), CorrectionStep.lease_expires_at < func.now()),
+            CorrectionStep.attempts < self.max_attempts
+        )
+
+    def claim_steps(self, db: Session, limit: int, correction_ids: Optional[Iterable[int]] = None) -> List[int]:
+        """
+        Leases up to `limit` pending steps to this worker and returns their ids. The limit is split
+        evenly over the oldest corrections with claimable steps so that one large correction does
+        not monopolize a worker. If correction_ids is given, only steps of these corrections are claimed.
+        """
+        statement = select(CorrectionStep.correction_id).where(self._claimable())
+        if correction_ids is not None:
+            statement = statement.where(CorrectionStep.correction_id.in_(list(correction_ids)))
+        correction_ids = db.scalars(
+            statement
+            .group_by(CorrectionStep.correction_id)
+            .order_by(CorrectionStep.correction_id)
+            .limit(limit)
+        ).all()
+        if not correction_ids:
+            return []
+
+        per_correction = max(1, limit // len(correction_ids))
+        claimed_step_ids: List[int] = []
+        for correction_id in correction_ids:
+            claimed_step_ids.extend(db.scalars(
+                select(CorrectionStep.correction_step_id)
+                .where(self._claimable(), CorrectionStep.correction_id == correction_id)
+                .order_by(CorrectionStep.correction_step_id)
+                .limit(min(per_correction, limit - len(claimed_step_ids)))
+                .with_for_update(skip_locked=True)
+            ).all())
+            if len(claimed_step_ids) >= limit:
+                break
+
+        if claimed_step_ids:
+            db.execute(
+                update(CorrectionStep)
+                .where(CorrectionStep.correction_step_id.in_(claimed_step_ids))
+                .values(
+                    lease_owner=self.worker_id,
+                    lease_expires_at=func.now() + timedelta(seconds=self.lease_seconds),
+                    attempts=CorrectionStep.attempts + 1
+                )
+            )
+        db.commit()
+        return claimed_step_ids
+
+    def heartbeat(self, db: Session, step_ids: List[int]) -> int:
+        """Extends the leases of steps this worker is still running. Returns the number of renewed leases."""
+        if not step_ids:
+            return 0
+        renewed = db.execute(
+            update(CorrectionStep)
+            .where(
+                CorrectionStep.correction_step_id.in_(step_ids),
+                CorrectionStep.lease_owner == self.worker_id,
+                CorrectionStep.status == CorrectionStatusEnum.PENDING
+            )
+            .values(lease_expires_at=func.now() + timedelta(seconds=self.lease_seconds))
+        ).rowcount
+        db.commit()
+        return renewed
+
+    def release_steps(self, db: Session, step_ids: List[int]) -> int:
+        """Hands steps this worker claimed but did not finish back to the queue, e.g. when draining."""
+        if not step_ids:
+            return 0
+        released = db.execute(
+            update(CorrectionStep)
+            .where(
+                CorrectionStep.correction_step_id.in_(step_ids),
+                CorrectionStep.lease_owner == self.worker_id,
+                CorrectionStep.status == CorrectionStatusEnum.PENDING
+            )
+            .values(lease_owner=None, lease_expires_at=None, attempts=CorrectionStep.attempts - 1)
+        ).rowcount
+        db.commit()
+        return released
+
+    def requeue_failed_steps(self, db: Session, step_ids: List[int], error_message: str) -> int:
+        """
+        Hands steps this worker failed to run back to the queue, keeping the attempt, and fails those
+        that used up their attempts. Returns the number of requeued steps.
+        """
+        if not step_ids:
+            return 0
+        owned = and_(
+            CorrectionStep.correction_step_id.in_(step_ids),
+            CorrectionStep.lease_owner == self.worker_id,
+            CorrectionStep.status == CorrectionStatusEnum.PENDING
+        )
+        db.execute(
+            update(CorrectionStep)
+            .where(owned, CorrectionStep.attempts >= self.max_attempts)
+            .values(status=CorrectionStatusEnum.FAILED, lease_owner=None, lease_expires_at=None, batch_job_id=None, error_message=error_message)
+        )
+        requeued = db.execute(
+            update(CorrectionStep)
+            .where(owned)
+            .values(lease_owner=None, lease_expires_at=None, batch_job_id=None)
+        ).rowcount
+        db.commit()
+        return requeued
+
+    def requeue_orphaned_steps(self, db: Session) -> int:
+        """
+        Clears expired leases (their worker died or lost its connection) so the steps are picked up
+        again, and fails steps that already used up their attempts. Returns the number of requeued steps.
+        """
+        orphaned = and_(
+            CorrectionStep.status == CorrectionStatusEnum.PENDING,
+            CorrectionStep.lease_expires_at < func.now()
+        )
+        failed = db.execute(
+            update(CorrectionStep)
+            .where(orphaned, CorrectionStep.attempts >= self.max_attempts)
+            .values(status=CorrectionStatusEnum.FAILED, lease_owner=None, lease_expires_at=None,
+                    error_message=f"Lease expired after {self.max_attempts} attempts")
+        ).rowcount
+        requeued = db.execute(
+            update(CorrectionStep)
+            .where(orphaned)
+            .values(lease_owner=None, lease_expires_at=None)
+        ).rowcount
+        db.commit()
+        if failed or requeued:
+            logger.warning(f"Requeued {requeued} orphaned steps, failed {failed} steps out of attempts")
+        return requeued
+
+    def claim_finished_corrections(self, db: Session, limit: int) -> List[int]:
+        """
+        Locks pending corrections that have no pending steps left. The caller finalizes them
+        within the same transaction, so each correction is finalized by exactly one worker.
+        """
+        has_pending_steps = exists().where(
+            CorrectionStep.correction_id == Correction.correction_id,
+            CorrectionStep.status == CorrectionStatusEnum.PENDING
+        )
+        return db.scalars(
+            select(Correction.correction_id)
+            .where(Correction.status == CorrectionStatusEnum.PENDING, ~has_pending_steps)
+            .order_by(Correction.correction_id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
@@ -0,0 +1,394 @@
+from typing import Protocol, Type, TypeVar, Optional, Tuple, Dict, Any, List
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pydantic import BaseModel
+import google.genai as genai
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+import httpx
+
+from src.services.fake_genai import fake_genai_client, fake_llm_response
+from src.services.prompt_fusion import get_response_model_for_schema
+from src.services.text_utils import estimate_token_count
+from config import (
+    GOOGLE_API_KEY, LLM_FAKE_CLIENT, LLM_OPENAI_BASE_URL, LLM_OPENAI_API_KEY, LLM_HTTP_TIMEOUT_SECONDS,
+    LLM_MOCK_LATENCY_MEDIAN_SECONDS, LLM_MOCK_LATENCY_SIGMA, LLM_MOCK_ERROR_RATE, LLM_MOCK_RATE_LIMIT_RATE, LLM_MOCK_SEED, LLM_MOCK_BATCH_SECONDS
+)
+
+T = TypeVar('T', bound=BaseModel)
+
+# Model names are "<provider>:<model>"; names without a known provider prefix are Gemini models.
+GEMINI_PROVIDER = "gemini"
+OPENAI_PROVIDER = "openai"
+MOCK_PROVIDER = "mock"
+
+# States of a provider batch job, see LLMBackend.get_batch_state
+BATCH_RUNNING = "running"
+BATCH_SUCCEEDED = "succeeded"
+BATCH_FAILED = "failed"
+
+
+class LLMBackendError(Exception):
+    """A call to an LLM backend failed. status_code is the HTTP status, if the backend answered with one."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMRateLimitError(LLMBackendError):
+    """The backend rejected the call for exceeding a rate limit (HTTP 429)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+class LLMResponseError(LLMBackendError):
+    """The backend answered, but without a response valid for the requested schema."""
+
+
+@dataclass
+class TokenUsage:
+    """Tokens of one call, as reported by the backend (estimated by the mock)."""
+    prompt_tokens: int = 0 # Cached content included
+    output_tokens: int = 0
+
+
+@dataclass
+class BatchOutput:
+    """The answer to one request of a batch job: its JSON text, or why it failed."""
+    key: str
+    text: Optional[str] = None
+    error: Optional[str] = None
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+class LLMBackend(Protocol):
+    """What LLMInteraction needs from a provider. generate() raises on failure; retries are up to the caller."""
+    supports_context_caching: bool
+    supports_batch: bool
+
+    async def generate(self, model: str, prompt: str, response_model: Type[T], cached_content: Optional[str] = None) -> Tuple[T, TokenUsage]:
+        """The validated response and the token usage of the call."""
+        ...
+
+    async def create_cached_content(self, model: str, content: str, ttl_seconds: int, display_name: Optional[str] = None) -> Tuple[str, datetime]:
+        ...
+
+    async def delete_cached_content(self, name: str) -> None:
+        ...
+
+    def batch_request(self, key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        """One line of a batch input file (JSONL)."""
+        ...
+
+    async def submit_batch(self, model: str, input_path: str, display_name: Optional[str] = None) -> str:
+        """Submits a batch input file and returns the name of the provider's batch job."""
+        ...
+
+    async def get_batch_state(self, name: str) -> Tuple[str, Optional[str]]:
+        """One of BATCH_RUNNING, BATCH_SUCCEEDED or BATCH_FAILED, and the error of a failed batch."""
+        ...
+
+    async def get_batch_results(self, name: str) -> List[BatchOutput]:
+        ...
+
+
+def _gemini_batch_request(key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+    return {
+        "key": key,
+        "request": {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generation_config": {"response_mime_type": "application/json", "response_json_schema": response_model.model_json_schema()}
+        }
+    }
+
+
+class GeminiBackend:
+    supports_context_caching = True
+    supports_batch = True
+
+    def __init__(self, client):
+        self.client = client
+
+    async def generate(self, model: str, prompt: str, response_model: Type[T], cached_content: Optional[str] = None) -> Tuple[T, TokenUsage]:
+        config = {
+            "response_mime_type": "application/json",
+            "response_schema": response_model
+        }
+        if cached_content is not None:
+            config["cached_content"] = cached_content
+        response = await self.client.aio.models.generate_content(model=model, contents=prompt, config=config)
+        if not response.parsed:
+            raise LLMResponseError("No response from LLM")
+        usage = response.usage_metadata
+        return response.parsed, TokenUsage(
+            prompt_tokens=getattr(usage, "prompt_token_count", None) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", None) or 0
+        )
+
+    async def create_cached_content(self, model: str, content: str, ttl_seconds: int, display_name: Optional[str] = None) -> Tuple[str, datetime]:
+        cached_content = await self.client.aio.caches.create(
+            model=model,
+            config={"contents": [content], "ttl": f"{ttl_seconds}s", "display_name": display_name}
+        )
+        return cached_content.name, cached_content.expire_time
+
+    async def delete_cached_content(self, name: str) -> None:
+        await self.client.aio.caches.delete(name=name)
+
+    def batch_request(self, key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        return _gemini_batch_request(key, prompt, response_model)
+
+    async def submit_batch(self, model: str, input_path: str, display_name: Optional[str] = None) -> str:
+        uploaded = await self.client.aio.files.upload(file=input_path, config={"display_name": display_name, "mime_type": "jsonl"})
+        batch_job = await self.client.aio.batches.create(model=model, src=uploaded.name, config={"display_name": display_name})
+        return batch_job.name
+
+    async def get_batch_state(self, name: str) -> Tuple[str, Optional[str]]:
+        batch_job = await self.client.aio.batches.get(name=name)
+        state = batch_job.state.name if batch_job.state else "JOB_STATE_UNSPECIFIED"
+        if state in ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"):
+            return BATCH_SUCCEEDED, None
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return BATCH_FAILED, str(batch_job.error or state)
+        return BATCH_RUNNING, None
+
+    async def get_batch_results(self, name: str) -> List[BatchOutput]:
+        batch_job = await self.client.aio.batches.get(name=name)
+        content = await self.client.aio.files.download(file=batch_job.dest.file_name)
+        return [self._parse_batch_line(json.loads(line)) for line in content.decode("utf-8").splitlines() if line.strip()]
+
+    @staticmethod
+    def _parse_batch_line(line: Dict[str, Any]) -> BatchOutput:
+        """Output lines are {"key", "response": GenerateContentResponse} or {"key", "error": Status}."""
+        response = line.get("response")
+        if response is None:
+            return BatchOutput(key=line["key"], error=json.dumps(line.get("error")))
+        candidates = response.get("candidates") or [{}]
+        text = "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", []))
+        usage = response.get("usageMetadata", {})
+        return BatchOutput(
+            key=line["key"],
+            text=text or None,
+            error=None if text else f"Empty response ({candidates[0].get('finishReason')})",
+            prompt_tokens=usage.get("promptTokenCount", 0),
+            output_tokens=usage.get("candidatesTokenCount", 0)
+        )
+
+
+class OpenAICompatibleBackend:
+    """
+    Any endpoint implementing the OpenAI chat completions API with JSON schema output (OpenAI, vLLM,
+    llama.cpp server, ... or src/services/mock_llm_server.py). Such servers cache shared prompt
+    prefixes on their own, so explicit context caching is not supported. Batch mode is not supported
+    either; steps of these models are left to the workers.
+    """
+    supports_context_caching = False
+    supports_batch = False
+
+    def __init__(self, base_url: str, api_key: Optional[str], timeout_seconds: float):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout_seconds = timeout_seconds
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def generate(self, model: str, prompt: str, response_model: Type[T], cached_content: Optional[str] = None) -> Tuple[T, TokenUsage]:
+        if cached_content is not None:
+            raise LLMBackendError("OpenAI-compatible backends do not support cached contents", status_code=400)
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": response_model.__name__, "schema": response_model.model_json_schema()}
+            }
+        }
+        response = await self._get_client().post("/chat/completions", json=payload)
+        if response.status_code == 429:
+            retry_after = response.headers.get("retry-after")
+            raise LLMRateLimitError(f"Rate limited by {self.base_url}", retry_after=float(retry_after) if retry_after else None)
+        if response.status_code >= 400:
+            raise LLMBackendError(f"{self.base_url} returned {response.status_code}: {response.text[:200]}", status_code=response.status_code)
+        body = response.json()
+        content = body["choices"][0]["message"]["content"]
+        try:
+            parsed = response_model.model_validate_json(content)
+        except ValueError as e:
+            raise LLMResponseError(f"Invalid response from {self.base_url}: {e}") from e
+        usage = body.get("usage") or {}
+        return parsed, TokenUsage(prompt_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("completion_tokens", 0))
+
+    async def create_cached_content(self, model: str, content: str, ttl_seconds: int, display_name: Optional[str] = None) -> Tuple[str, datetime]:
+        raise LLMBackendError("OpenAI-compatible backends do not support cached contents")
+
+    async def delete_cached_content(self, name: str) -> None:
+        raise LLMBackendError("OpenAI-compatible backends do not support cached contents")
+
+    def batch_request(self, key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        raise LLMBackendError("OpenAI-compatible backends do not support batch mode")
+
+    async def submit_batch(self, model: str, input_path: str, display_name: Optional[str] = None) -> str:
+        raise LLMBackendError("OpenAI-compatible backends do not support batch mode")
+
+    async def get_batch_state(self, name: str) -> Tuple[str, Optional[str]]:
+        raise LLMBackendError("OpenAI-compatible backends do not support batch mode")
+
+    async def get_batch_results(self, name: str) -> List[BatchOutput]:
+        raise LLMBackendError("OpenAI-compatible backends do not support batch mode")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created on first use, inside the event loop that runs the calls.
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=headers, timeout=self.timeout_seconds)
+        return self._client
+
+
+class MockBackend:
+    """
+    Deterministic local backend for offline load tests. Answers only depend on the prompt (see
+    fake_llm_response) and are valid for the requested schema. Latency is lognormal around
+    latency_median_seconds, and a share of the calls fail with a 429 or a server error.
+    The latency and failure draws come from a seeded generator, so runs are reproducible.
+
+    Batches take the Gemini input format and finish batch_seconds after their submission. Their state
+    lives in files next to the input file, so that, as with a provider, it outlives the process.
+    """
+    supports_context_caching = True
+    supports_batch = True
+
+    def __init__(self, latency_median_seconds: float, latency_sigma: float, error_rate: float, rate_limit_rate: float,
+                 seed: int = 0, issues_per_request: int = 2, batch_seconds: float = 0.0):
+        self.latency_median_seconds = latency_median_seconds
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.issues_per_request = issues_per_request
+        self.batch_seconds = batch_seconds
+        self._rng = random.Random(seed)
+        self._cached_contents: Dict[str, Tuple[str, datetime]] = {}
+        self._ids = itertools.count(1)
+
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    async def generate(self, model: str, prompt: str, response_model: Type[T], cached_content: Optional[str] = None) -> Tuple[T, TokenUsage]:
+        self.requests += 1
+        latency, outcome = self.draw()
+        await asyncio.sleep(latency)
+        if outcome == 429:
+            self.rate_limited += 1
+            raise LLMRateLimitError("Mock rate limit (429)", retry_after=1.0)
+        if outcome == 500:
+            self.errors += 1
+            raise LLMBackendError("Mock server error (500)", status_code=500)
+
+        if cached_content is not None:
+            content, expires_at = self._cached_contents.get(cached_content, (None, None))
+            if content is None or expires_at <= datetime.now(timezone.utc):
+                raise LLMBackendError(f"Cached content {cached_content} not found or expired", status_code=404)
+            prompt = content + "\n" + prompt
+        response = fake_llm_response(response_model, prompt=prompt, issue_count=self.issues_per_request)
+        return response, TokenUsage(prompt_tokens=estimate_token_count(prompt), output_tokens=estimate_token_count(response.model_dump_json()))
+
+    def draw(self) -> Tuple[float, int]:
+        """Latency in seconds and HTTP status of the next call."""
+        latency = self.latency_median_seconds * self._rng.lognormvariate(0, self.latency_sigma) if self.latency_median_seconds > 0 else 0.0
+        roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return latency, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, 200
+
+    async def create_cached_content(self, model: str, content: str, ttl_seconds: int, display_name: Optional[str] = None) -> Tuple[str, datetime]:
+        name = f"cachedContents/mock-{next(self._ids)}"
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+        self._cached_contents[name] = (content, expires_at)
+        return name, expires_at
+
+    async def delete_cached_content(self, name: str) -> None:
+        if self._cached_contents.pop(name, None) is None:
+            raise LLMBackendError(f"Cached content {name} not found", status_code=404)
+
+    def batch_request(self, key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        return _gemini_batch_request(key, prompt, response_model)
+
+    async def submit_batch(self, model: str, input_path: str, display_name: Optional[str] = None) -> str:
+        # The input path is the batch name; the submission time is the content of a marker file.
+        if os.path.exists(f"{input_path}.output"):
+            os.remove(f"{input_path}.output")
+        with open(f"{input_path}.submitted", "w") as marker:
+            marker.write(str(time.time()))
+        return input_path
+
+    async def get_batch_state(self, name: str) -> Tuple[str, Optional[str]]:
+        try:
+            with open(f"{name}.submitted") as marker:
+                submitted_at = float(marker.read())
+        except FileNotFoundError:
+            return BATCH_FAILED, f"Mock batch {name} not found"
+        return (BATCH_SUCCEEDED if time.time() - submitted_at >= self.batch_seconds else BATCH_RUNNING), None
+
+    async def get_batch_results(self, name: str) -> List[BatchOutput]:
+        output_path = f"{name}.output"
+        if not os.path.exists(output_path):
+            with open(name) as input_file, open(output_path, "w") as output_file:
+                for line in input_file:
+                    output_file.write(json.dumps(self._answer_batch_request(json.loads(line))) + "\n")
+        with open(output_path) as output_file:
+            return [GeminiBackend._parse_batch_line(json.loads(line)) for line in output_file]
+
+    def _answer_batch_request(self, line: Dict[str, Any]) -> Dict[str, Any]:
+        """An output line in the Gemini format. Server errors are drawn as for interactive calls; there are no 429s."""
+        self.requests += 1
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return {"key": line["key"], "error": {"code": 500, "message": "Mock server error"}}
+        request = line["request"]
+        prompt = "\n".join(part["text"] for content in request["contents"] for part in content["parts"])
+        response_model = get_response_model_for_schema(request["generation_config"]["response_json_schema"])
+        text = fake_llm_response(response_model, prompt=prompt, issue_count=self.issues_per_request).model_dump_json()
+        return {
+            "key": line["key"],
+            "response": {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": estimate_token_count(prompt), "candidatesTokenCount": estimate_token_count(text)}
+            }
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+def parse_model_name(model_name: str) -> Tuple[str, str]:
+    """Splits "<provider>:<model>" into (provider, model). "mock" alone selects the mock backend."""
+    provider, separator, model = model_name.partition(":")
+    if separator and provider in (GEMINI_PROVIDER, OPENAI_PROVIDER, MOCK_PROVIDER):
+        return provider, model
+    if model_name == MOCK_PROVIDER:
+        return MOCK_PROVIDER, MOCK_PROVIDER
+    return GEMINI_PROVIDER, model_name
+
+
+@lru_cache(maxsize=None)
+def get_backend(provider: str) -> LLMBackend:
+    """One backend per provider and process, so that clients, connection pools and mock state are shared."""
+    if provider == GEMINI_PROVIDER:
+        return GeminiBackend(client=fake_genai_client if LLM_FAKE_CLIENT else genai.Client(api_key=GOOGLE_API_KEY))
+    if provider == OPENAI_PROVIDER:
+        return OpenAICompatibleBackend(base_url=LLM_OPENAI_BASE_URL, api_key=LLM_OPENAI_API_KEY, timeout_seconds=LLM_HTTP_TIMEOUT_SECONDS)
+    if provider == MOCK_PROVIDER:
+        return MockBackend(latency_median_seconds=LLM_MOCK_LATENCY_MEDIAN_SECONDS, latency_sigma=LLM_MOCK_LATENCY_SIGMA,
+                           error_rate=LLM_MOCK_ERROR_RATE, rate_limit_rate=LLM_MOCK_RATE_LIMIT_RATE, seed=LLM_MOCK_SEED,
+                           batch_seconds=LLM_MOCK_BATCH_SECONDS)
+    raise ValueError(f"Unknown LLM provider {provider}")
@@ -0,0 +1,206 @@
+from typing import Type, Optional, Dict, Any, List, Tuple
+from datetime import datetime, timedelta, timezone
+from pydantic import BaseModel
+from sqlalchemy import select, delete, update, func, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from cachetools import LRUCache
+import threading
+import time
+import hashlib
+import json
+
+from src.utils import logger
+from src.models import LLMResponseCacheEntry
+from config import (
+    LLM_CACHE_ENABLED, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_MEMORY_ENTRIES,
+    LLM_CACHE_MAX_DB_ENTRIES, LLM_CACHE_EVICTION_INTERVAL, LLM_CACHE_TOUCH_INTERVAL_SECONDS
+)
+
+
+class LLMResponseCache:
+    """
+    Two-level cache of validated LLM responses: an in-process LRU in front of the
+    llm_response_cache table. Entries are content-addressed, so the same prompt
+    rendered for the same model and schema is only ever sent to the LLM once.
+
+    Memory entries expire with the row they mirror (ttl_seconds after its created_at). Hits, from
+    memory or the table, are written back to the row's hit_count and last_accessed_at in batches,
+    at most every touch_interval_seconds, so that eviction does not pick keys that are hot in memory
+    and reads do not each cost a write.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, max_memory_entries: int, max_db_entries: int, eviction_interval: int,
+                 touch_interval_seconds: float):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self.eviction_interval = eviction_interval
+        self.touch_interval_seconds = touch_interval_seconds
+        # cache_key -> (llm_response, expiry as a Unix timestamp)
+        self._memory: LRUCache = LRUCache(maxsize=max_memory_entries)
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self._pending_touches: Dict[str, int] = {} # Memory hits per key not yet written to the table
+        self._touched_at = time.monotonic()
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, response_model: Type[BaseModel]) -> str:
+        schema = json.dumps(response_model.model_json_schema(), sort_keys=True)
+        digest = hashlib.sha256()
+        for part in (model_name, prompt, schema):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, db: Session, cache_key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many(db, [cache_key]).get(cache_key)
+
+    def get_many(self, db: Session, cache_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Looks keys up in memory first and resolves the rest with a single query. Returns only the hits."""
+        if not self.enabled or not cache_keys:
+            return {}
+
+        hits: Dict[str, Dict[str, Any]] = {}
+        now = time.time()
+        with self._lock:
+            for cache_key in cache_keys:
+                cached = self._memory.get(cache_key)
+                if cached is None:
+                    continue
+                llm_response, expires_at = cached
+                if expires_at <= now:
+                    del self._memory[cache_key]
+                    continue
+                hits[cache_key] = llm_response
+                self._pending_touches[cache_key] = self._pending_touches.get(cache_key, 0) + 1
+            self.memory_hits += len(hits)
+
+        remaining_keys = list({cache_key for cache_key in cache_keys if cache_key not in hits})
+        db_hits: Dict[str, Dict[str, Any]] = {}
+        entries = []
+        if remaining_keys:
+            entries = db.execute(
+                select(LLMResponseCacheEntry.cache_key, LLMResponseCacheEntry.llm_response, LLMResponseCacheEntry.created_at)
+                .where(LLMResponseCacheEntry.cache_key.in_(remaining_keys), LLMResponseCacheEntry.created_at >= self._expiry_cutoff())
+            ).all()
+            db_hits = {cache_key: llm_response for cache_key, llm_response, _ in entries}
+
+        with self._lock:
+            self.db_hits += len(db_hits)
+            self.misses += len(remaining_keys) - len(db_hits)
+            for cache_key, llm_response, created_at in entries:
+                self._memory[cache_key] = (llm_response, created_at.timestamp() + self.ttl_seconds)
+                self._pending_touches[cache_key] = self._pending_touches.get(cache_key, 0) + 1
+        hits.update(db_hits)
+        if time.monotonic() - self._touched_at >= self.touch_interval_seconds:
+            self.flush_touches(db)
+        return hits
+
+    def flush_touches(self, db: Session):
+        """Adds the hits since the last flush to hit_count and sets last_accessed_at of their rows, in one statement."""
+        with self._lock:
+            touches, self._pending_touches = self._pending_touches, {}
+            self._touched_at = time.monotonic()
+        if touches:
+            db.execute(
+                update(LLMResponseCacheEntry)
+                .where(LLMResponseCacheEntry.cache_key.in_(list(touches)))
+                .values(hit_count=LLMResponseCacheEntry.hit_count + case(touches, value=LLMResponseCacheEntry.cache_key, else_=0),
+                        last_accessed_at=func.now())
+            )
+
+    def set(self, db: Session, cache_key: str, model_name: str, llm_response: Dict[str, Any]):
+        self.set_many(db, [(cache_key, model_name, llm_response)])
+
+    def set_many(self, db: Session, entries: List[Tuple[str, str, Dict[str, Any]]]):
+        """Upserts (cache_key, model_name, llm_response) entries with a single statement."""
+        if not self.enabled or not entries:
+            return
+
+        # ON CONFLICT DO UPDATE may not touch the same row twice within one statement.
+        rows = {cache_key: {"cache_key": cache_key, "model_name": model_name, "llm_response": llm_response}
+                for cache_key, model_name, llm_response in entries}
+        statement = insert(LLMResponseCacheEntry).values(list(rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=[LLMResponseCacheEntry.cache_key],
+            set_={"llm_response": statement.excluded.llm_response, "created_at": func.now(), "last_accessed_at": func.now()}
+        )
+        db.execute(statement)
+
+        # The upsert sets created_at to now, so the memory entry expires with the row.
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            for cache_key, row in rows.items():
+                self._memory[cache_key] = (row["llm_response"], expires_at)
+            self.writes += len(rows)
+            self._writes_since_eviction += len(rows)
+            run_eviction = self._writes_since_eviction >= self.eviction_interval
+            if run_eviction:
+                self._writes_since_eviction = 0
+
+        if run_eviction:
+            self.evict(db)
+
+    def evict(self, db: Session) -> int:
+        """
+        Deletes expired entries and, if the table is still above max_db_entries, the
+        least recently accessed ones. Returns the number of deleted rows.
+        """
+        # Pending memory hits first, so that hot keys are not taken for the least recently accessed.
+        self.flush_touches(db)
+        expired = db.execute(
+            delete(LLMResponseCacheEntry).where(LLMResponseCacheEntry.created_at < self._expiry_cutoff())
+        ).rowcount
+
+        overflow = 0
+        entry_count = db.scalar(select(func.count()).select_from(LLMResponseCacheEntry))
+        if entry_count > self.max_db_entries:
+            oldest_keys = (
+                select(LLMResponseCacheEntry.cache_key)
+                .order_by(LLMResponseCacheEntry.last_accessed_at)
+                .limit(entry_count - self.max_db_entries)
+            )
+            overflow = db.execute(
+                delete(LLMResponseCacheEntry).where(LLMResponseCacheEntry.cache_key.in_(oldest_keys))
+            ).rowcount
+
+        with self._lock:
+            self.evictions += expired + overflow
+        if expired or overflow:
+            logger.info(f"Evicted {expired} expired and {overflow} overflow LLM cache entries")
+        return expired + overflow
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups > 0 else 0.0,
+            }
+
+    def _expiry_cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+
+
+# Shared by every CorrectionService in the process so the in-memory level is actually reused.
+llm_response_cache = LLMResponseCache(
+    enabled=LLM_CACHE_ENABLED,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    max_memory_entries=LLM_CACHE_MAX_MEMORY_ENTRIES,
+    max_db_entries=LLM_CACHE_MAX_DB_ENTRIES,
+    eviction_interval=LLM_CACHE_EVICTION_INTERVAL,
+    touch_interval_seconds=LLM_CACHE_TOUCH_INTERVAL_SECONDS
+)
@@ -0,0 +1,187 @@
+from typing import Dict, List, Optional, Tuple, Any
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import asyncio
+import hashlib
+
+from src.utils import logger, get_async_db_context
+from src.models import LLMContextCache
+from src.services.llm_interaction import LLMInteraction
+from src.services.text_utils import estimate_token_count
+from src.services.prompt_registry import prompt_registry
+from config import LLM_CONTEXT_CACHE_ENABLED, LLM_CONTEXT_CACHE_MIN_TOKENS, LLM_CONTEXT_CACHE_MIN_USES, LLM_CONTEXT_CACHE_TTL_SECONDS
+
+# Stands in for the input text when the text itself is in the cached content, before the instructions.
+CACHED_DOCUMENT_PLACEHOLDER = "(the TEXT given before these instructions)"
+_INPUT_TEXT_SENTINEL = "\x00input_text\x00"
+# Contexts this close to their expiry are uploaded again rather than referenced.
+_EXPIRY_MARGIN = timedelta(seconds=60)
+
+
+@dataclass
+class PromptContext:
+    """A rendered prompt split into a prefix uploaded once as cached content and the part sent with every request."""
+    content: str
+    prompt: str
+
+
+def split_prompt_context(prompt_text: str, input_text: str, shared_document: bool, shared_instructions: bool,
+                         min_tokens: int = LLM_CONTEXT_CACHE_MIN_TOKENS) -> Optional[PromptContext]:
+    """
+    Splits the prompt template prompt_text, rendered for input_text, for context caching:
+    - shared_document: the input text is cached, ahead of the instructions, which refer to it;
+    - shared_instructions: the rendered template up to the input text is cached.
+    Returns the split with the larger cached content, or None if no candidate reaches min_tokens.
+    """
+    candidates = []
+    if shared_document:
+        candidates.append(PromptContext(
+            content=f"## TEXT:\n{input_text}",
+            prompt=prompt_registry.render(prompt_text, input_text=CACHED_DOCUMENT_PLACEHOLDER)
+        ))
+    if shared_instructions:
+        rendered = prompt_registry.render(prompt_text, input_text=_INPUT_TEXT_SENTINEL)
+        if rendered.count(_INPUT_TEXT_SENTINEL) == 1:
+            prefix, suffix = rendered.split(_INPUT_TEXT_SENTINEL)
+            candidates.append(PromptContext(content=prefix, prompt=input_text + suffix))
+
+    candidates = [candidate for candidate in candidates if estimate_token_count(candidate.content) >= min_tokens]
+    return max(candidates, key=lambda candidate: len(candidate.content), default=None)
+
+
+class LLMContextCacheManager:
+    """
+    Provider-side cached contents (Gemini context caching) shared by the steps of a correction.
+    A context is uploaded when the first step needs it and recorded in llm_context_caches, so that
+    other workers reference it too; it is deleted when the correction is finalized. Contexts also
+    expire on the provider side after ttl_seconds, which bounds what a crashed worker leaves behind.
+    """
+
+    def __init__(self, enabled: bool, min_tokens: int, min_uses: int, ttl_seconds: int):
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.min_uses = min_uses
+        self.ttl_seconds = ttl_seconds
+        # (correction_id, content_key) -> (provider cache name, expires_at), and uploads in progress.
+        self._known: Dict[Tuple[int, str], Tuple[str, datetime]] = {}
+        self._pending: Dict[Tuple[int, str], asyncio.Task] = {}
+
+        self.created = 0
+        self.reused = 0
+        self.failures = 0
+        self.deleted = 0
+
+    @staticmethod
+    def make_key(model_name: str, content: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, content):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    async def get_or_create(self, llm: LLMInteraction, correction_id: int, content: str) -> Optional[str]:
+        """
+        Returns the name of the cached content holding `content` for this correction, uploading it
+        if needed. Concurrent calls for the same content share one upload. Returns None on failure,
+        in which case the caller sends the whole prompt.
+        """
+        key = (correction_id, self.make_key(llm.model_name, content))
+        known = self._known.get(key)
+        if known is not None and known[1] > datetime.now(timezone.utc) + _EXPIRY_MARGIN:
+            self.reused += 1
+            return known[0]
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._get_or_create(llm, key, content))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        try:
+            name, expires_at = await asyncio.shield(task)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Could not cache the context of correction {correction_id}, sending it inline: {e}")
+            return None
+        self._known[key] = (name, expires_at)
+        return name
+
+    async def release(self, correction_ids: List[int]):
+        """Deletes the cached contents of finished corrections, on the provider and in llm_context_caches."""
+        if not self.enabled or not correction_ids:
+            return
+        async with get_async_db_context() as db:
+            rows = await db.run_sync(self._delete_rows, correction_ids)
+        released = set(correction_ids)
+        for key in [key for key in self._known if key[0] in released]:
+            del self._known[key]
+
+        for name, model_name in rows:
+            try:
+                await LLMInteraction(model_name=model_name).delete_cached_content(name)
+                self.deleted += 1
+            except Exception as e:
+                # Expired or already deleted; the provider drops it after the TTL anyway.
+                logger.warning(f"Could not delete cached content {name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "active": len(self._known),
+            "created": self.created,
+            "reused": self.reused,
+            "failures": self.failures,
+            "deleted": self.deleted,
+        }
+
+    async def _get_or_create(self, llm: LLMInteraction, key: Tuple[int, str], content: str) -> Tuple[str, datetime]:
+        correction_id, content_key = key
+        async with get_async_db_context() as db:
+            row = await db.run_sync(lambda session: session.execute(
+                select(LLMContextCache.provider_cache_name, LLMContextCache.expires_at)
+                .where(LLMContextCache.correction_id == correction_id, LLMContextCache.content_key == content_key)
+            ).first())
+        if row is not None and row.expires_at > datetime.now(timezone.utc) + _EXPIRY_MARGIN:
+            # Uploaded by another worker.
+            self.reused += 1
+            return row.provider_cache_name, row.expires_at
+
+        name, expires_at = await llm.create_cached_content(content, ttl_seconds=self.ttl_seconds, display_name=f"correction-{correction_id}")
+        self.created += 1
+        expires_at = expires_at or datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        # Two workers may upload the same context concurrently; the last one is recorded and the other expires unused.
+        async with get_async_db_context() as db:
+            await db.run_sync(self._save_row, correction_id, content_key, llm.model_name, name, expires_at)
+        logger.debug(f"Cached a context of {estimate_token_count(content)} tokens for correction {correction_id} as {name}")
+        return name, expires_at
+
+    @staticmethod
+    def _save_row(db: Session, correction_id: int, content_key: str, model_name: str, provider_cache_name: str, expires_at: datetime):
+        statement = insert(LLMContextCache).values(
+            correction_id=correction_id, content_key=content_key, model_name=model_name,
+            provider_cache_name=provider_cache_name, expires_at=expires_at
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[LLMContextCache.correction_id, LLMContextCache.content_key],
+            set_={"provider_cache_name": statement.excluded.provider_cache_name, "expires_at": statement.excluded.expires_at}
+        ))
+
+    @staticmethod
+    def _delete_rows(db: Session, correction_ids: List[int]) -> List[Tuple[str, str]]:
+        """Returns the (provider cache name, model name) of the deleted rows."""
+        return db.execute(
+            delete(LLMContextCache)
+            .where(LLMContextCache.correction_id.in_(correction_ids))
+            .returning(LLMContextCache.provider_cache_name, LLMContextCache.model_name)
+        ).all()
+
+
+# One manager per process, so that concurrent steps of a correction share a single upload.
+llm_context_caches = LLMContextCacheManager(
+    enabled=LLM_CONTEXT_CACHE_ENABLED,
+    min_tokens=LLM_CONTEXT_CACHE_MIN_TOKENS,
+    min_uses=LLM_CONTEXT_CACHE_MIN_USES,
+    ttl_seconds=LLM_CONTEXT_CACHE_TTL_SECONDS
+)
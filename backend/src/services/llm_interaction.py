@@ -1,65 +1,265 @@
-from typing import Type, TypeVar, Optional
+from typing import Type, TypeVar, Optional, Tuple, Dict, Hashable, Generic, Any, List
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from datetime import datetime
 from pydantic import BaseModel
-import google.genai as genai
 import asyncio
 import random
+import time
 
 from src.utils import logger
-from config import GOOGLE_API_KEY
+from src.services.llm_backends import BatchOutput, TokenUsage, get_backend, parse_model_name
+from src.services.llm_scheduler import LLMScheduler, llm_scheduler
+from src.services.llm_resilience import (
+    LLMErrorClass, LLMCircuitOpenError, classify_error, get_circuit_breaker, get_latency_tracker, llm_call_metrics
+)
+from src.services.telemetry import record_llm_attempt, span
+from config import (
+    LLM_MAX_ATTEMPTS, LLM_RATE_LIMIT_MAX_ATTEMPTS, LLM_SCHEMA_MAX_ATTEMPTS, LLM_RETRY_BASE_DELAY_SECONDS, LLM_RETRY_MAX_DELAY_SECONDS, LLM_HEDGING_ENABLED
+)
 
 # Define a generic type for Pydantic models
 T = TypeVar('T', bound=BaseModel)
 
+
+@dataclass
+class LLMCallTrace:
+    """
+    Where the time of one LLM call went, summed over its attempts (retries, hedges and fallback tiers).
+    Filled in by LLMInteraction and stored on the steps the call answers (see StepResultWriter).
+    """
+    started_at: float = field(default_factory=time.monotonic)
+    queue_wait_seconds: float = 0.0 # Waiting for a scheduler slot (concurrency limit, other keys' turns)
+    pacing_delay_seconds: float = 0.0 # Waiting for the rate limiter
+    llm_latency_seconds: float = 0.0 # In backend calls, including failed and hedged ones
+    retries: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+    def split(self, count: int) -> List["LLMCallTrace"]:
+        """Traces for the `count` steps answered by one fused call: same timings, tokens shared out."""
+        return [
+            replace(self, prompt_tokens=self.prompt_tokens // count + (i < self.prompt_tokens % count),
+                    output_tokens=self.output_tokens // count + (i < self.output_tokens % count))
+            for i in range(count)
+        ]
+
+
+@dataclass
+class LLMResult(Generic[T]):
+    """A validated response and the model that produced it (the step's own or a fallback tier)."""
+    response: T
+    model_name: str
+
+
 class LLMInteraction:
-    def __init__(self, model_name: str, max_retries: int = 3, retry_delay: int = 3):
+    def __init__(self, model_name: str, max_retries: int = LLM_MAX_ATTEMPTS, retry_delay: float = LLM_RETRY_BASE_DELAY_SECONDS,
+                 scheduler: LLMScheduler = llm_scheduler, hedging: bool = LLM_HEDGING_ENABLED):
         """
-        Initializes the LLM Interaction Module with a specific Gemini model,
+        Initializes the LLM Interaction Module with a specific model,
         configured for JSON output.
 
         Args:
-            model_name (str): The name of the Gemini model to use (e.g., "gemini-pro", "gemini-1.5-flash").
+            model_name (str): The model to use, optionally prefixed with its provider (e.g., "gemini-2.5-flash",
+                "openai:gpt-4o-mini", "mock"). Unprefixed names are Gemini models, see parse_model_name.
+            max_retries (int): Attempts per call for transient errors (rate limits and schema errors have their own budgets).
+            retry_delay (float): Base of the exponential backoff between attempts, in seconds.
+            scheduler (LLMScheduler): Gate every attempt goes through (pacing, concurrency, fairness).
+            hedging (bool): Whether attempts slower than the usual latency of the model are duplicated (see _generate).
         """
         self.model_name = model_name
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.client = genai.Client(api_key=GOOGLE_API_KEY)
+        self.scheduler = scheduler
+        self.hedging = hedging
+        provider, self.backend_model_name = parse_model_name(model_name)
+        self.backend = get_backend(provider)
+        self.circuit_breaker = get_circuit_breaker(model_name)
+        self.latencies = get_latency_tracker(model_name)
 
-    async def get_validated_response(self, prompt: str, response_model: Type[T]) -> Optional[T]:
-        """
-        Gets a raw string output (expected to be JSON) from the Gemini LLM.
+    @property
+    def supports_context_caching(self) -> bool:
+        return self.backend.supports_context_caching
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.backend.supports_batch
+
+    async def get_validated_response(self, prompt: str, response_model: Type[T], cached_content: Optional[str] = None,
+                                     scheduler_key: Hashable = None, tokens: int = 0, wait_for_circuit: bool = True,
+                                     trace: Optional[LLMCallTrace] = None, attempts: Optional[Dict[LLMErrorClass, int]] = None) -> Optional[T]:
         """
-        current_retries = 0
+        Gets a response validated against response_model from the LLM backend, or None once retries are exhausted.
+        If cached_content is set, the prompt continues the cached content of that name.
 
-        while current_retries < self.max_retries:
+        Each attempt holds a slot of the scheduler (queued under scheduler_key, with `tokens` of budget)
+        only while the call is in flight, so steps waiting to retry do not starve the others. Errors are
+        classified (see classify_error): rate limits are retried after the delay the backend asks for,
+        transient and schema errors with jittered exponential backoff, permanent errors not at all.
+        While the circuit breaker of the model is open, calls wait for it to let a probe through, or give
+        up at once if wait_for_circuit is False (the caller has another model to fall back to).
+        Timings, retries and token usage of the attempts are added to `trace`, if given.
+        `attempts` counts the attempts per error class; passing the same dict to a call that replaces an
+        earlier one (e.g. without the cached content that failed) makes both share one retry budget.
+        """
+        attempts = attempts if attempts is not None else defaultdict(int)
+        while True:
             try:
-                config = {
-                    "response_mime_type": "application/json",
-                    "response_schema": response_model
-                }
-                response = await self.client.aio.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt,
-                    config=config
-                )
-
-                if response.parsed:
-                    return response.parsed
-                else:
-                    raise ValueError("No response from LLM")
-                
+                if not self.circuit_breaker.allow():
+                    if not wait_for_circuit:
+                        llm_call_metrics.record_give_up(self.model_name)
+                        return None
+                    raise LLMCircuitOpenError(self.model_name, retry_after=self.circuit_breaker.retry_after())
+                result = await self._generate(prompt, response_model, cached_content, scheduler_key, tokens, trace)
+                self.circuit_breaker.record_success()
+                self.scheduler.on_success()
+                llm_call_metrics.record_success(self.model_name)
+                return result
+
             except Exception as e:
-                logger.error(f"Error during Gemini API call: {e}")
-                
-                current_retries += 1
-
-                if current_retries < self.max_retries:
-                    logger.warning(f"Retrying LLM call after {self.retry_delay} seconds")
-                    sleep_time = self.retry_delay * (2 ** current_retries)
-                    sleep_time += random.uniform(0, 1)
-                    sleep_time = min(sleep_time, 60) # Cap the sleep time at 60 seconds.
-                    await asyncio.sleep(sleep_time)
-                else:
-                    logger.error(f"Failed to get raw output from LLM after {self.max_retries} retries")
+                error_class, retry_after = classify_error(e)
+                self._record_error(e, error_class)
+                attempts[error_class] += 1
+                max_attempts = self._max_attempts(error_class)
+                if attempts[error_class] >= max_attempts:
+                    logger.error(f"LLM call to {self.model_name} failed ({error_class.value}, attempt {attempts[error_class]}/{max_attempts}): {e}")
+                    llm_call_metrics.record_give_up(self.model_name)
                     return None
 
-        return None
\ No newline at end of file
+                # Full jitter spreads out the retries of calls that failed together.
+                sleep_time = random.uniform(0, min(LLM_RETRY_MAX_DELAY_SECONDS, self.retry_delay * (2 ** attempts[error_class])))
+                if retry_after is not None:
+                    sleep_time = max(sleep_time, min(retry_after, LLM_RETRY_MAX_DELAY_SECONDS))
+                logger.warning(f"LLM call to {self.model_name} failed ({error_class.value}): {e}. Retrying in {sleep_time:.1f} seconds")
+                llm_call_metrics.record_retry(self.model_name)
+                if trace is not None:
+                    trace.retries += 1
+                await asyncio.sleep(sleep_time)
+
+    async def _generate(self, prompt: str, response_model: Type[T], cached_content: Optional[str], scheduler_key: Hashable, tokens: int,
+                        trace: Optional[LLMCallTrace]) -> T:
+        """
+        One attempt. With hedging, an attempt still running after the LLM_HEDGE_PERCENTILE latency of
+        the model gets a duplicate request (within the hedge budget, see LatencyTracker): the first
+        valid answer is returned and the other request is cancelled. Raises if both fail.
+        """
+        self.latencies.calls += 1
+        if not self.hedging:
+            return await self._generate_in_slot(prompt, response_model, cached_content, scheduler_key, tokens, trace)
+
+        sent = asyncio.Event()
+        primary = asyncio.create_task(self._generate_in_slot(prompt, response_model, cached_content, scheduler_key, tokens, trace, sent=sent))
+        pending = {primary}
+        hedge = None
+        try:
+            # The hedge delay counts from when the request is sent, not from when it started waiting for a slot.
+            sent_wait = asyncio.create_task(sent.wait())
+            await asyncio.wait({primary, sent_wait}, return_when=asyncio.FIRST_COMPLETED)
+            sent_wait.cancel()
+            delay = self.latencies.hedge_delay()
+            if not primary.done() and delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self.latencies.hedge_delay() is not None:
+                    self.latencies.hedges += 1
+                    hedge = asyncio.create_task(self._generate_in_slot(prompt, response_model, cached_content, scheduler_key, tokens, trace))
+                    pending.add(hedge)
+
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedge is not None:
+                            llm_call_metrics.record_hedge(self.model_name, won=task is hedge)
+                        return task.result()
+                if not pending:
+                    if hedge is not None:
+                        llm_call_metrics.record_hedge(self.model_name, won=False)
+                    raise next(iter(done)).exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _generate_in_slot(self, prompt: str, response_model: Type[T], cached_content: Optional[str], scheduler_key: Hashable, tokens: int,
+                                trace: Optional[LLMCallTrace], sent: Optional[asyncio.Event] = None) -> T:
+        async with self.scheduler.slot(scheduler_key, tokens=tokens) as slot_timing:
+            if sent is not None:
+                sent.set()
+            started_at = time.monotonic()
+            usage, outcome = TokenUsage(), "success"
+            try:
+                with span("llm.generate", **{"llm.model": self.model_name, "llm.cached_content": cached_content}):
+                    result, usage = await self.backend.generate(
+                        model=self.backend_model_name,
+                        prompt=prompt,
+                        response_model=response_model,
+                        cached_content=cached_content
+                    )
+            except asyncio.CancelledError:
+                # E.g. the losing request of a hedged attempt: neither a success nor an error of the backend.
+                outcome = None
+                raise
+            except Exception as e:
+                outcome = classify_error(e)[0].value
+                raise
+            finally:
+                elapsed = time.monotonic() - started_at
+                if outcome is not None:
+                    record_llm_attempt(self.model_name, outcome=outcome, seconds=elapsed, queue_wait_seconds=slot_timing.queue_wait_seconds,
+                                       pacing_delay_seconds=slot_timing.pacing_delay_seconds, prompt_tokens=usage.prompt_tokens,
+                                       output_tokens=usage.output_tokens)
+                if trace is not None:
+                    trace.queue_wait_seconds += slot_timing.queue_wait_seconds
+                    trace.pacing_delay_seconds += slot_timing.pacing_delay_seconds
+                    trace.llm_latency_seconds += elapsed
+                    trace.prompt_tokens += usage.prompt_tokens
+                    trace.output_tokens += usage.output_tokens
+        self.latencies.record(elapsed)
+        return result
+
+    def _max_attempts(self, error_class: LLMErrorClass) -> int:
+        if error_class == LLMErrorClass.RATE_LIMIT:
+            return LLM_RATE_LIMIT_MAX_ATTEMPTS
+        if error_class == LLMErrorClass.SCHEMA:
+            return LLM_SCHEMA_MAX_ATTEMPTS
+        if error_class == LLMErrorClass.PERMANENT:
+            return 1
+        return self.max_retries
+
+    def _record_error(self, error: Exception, error_class: LLMErrorClass):
+        llm_call_metrics.record_error(self.model_name, error_class)
+        if isinstance(error, LLMCircuitOpenError):
+            return
+        if error_class == LLMErrorClass.RATE_LIMIT:
+            self.scheduler.on_rate_limited()
+        if error_class == LLMErrorClass.TRANSIENT:
+            self.circuit_breaker.record_failure()
+        else:
+            # The backend answered, so it is up.
+            self.circuit_breaker.record_success()
+
+    async def create_cached_content(self, content: str, ttl_seconds: int, display_name: Optional[str] = None) -> Tuple[str, datetime]:
+        """
+        Uploads content as provider-side cached content, which requests can then reference instead of
+        sending it again. Returns the name of the cached content and when it expires.
+        """
+        return await self.backend.create_cached_content(model=self.backend_model_name, content=content, ttl_seconds=ttl_seconds, display_name=display_name)
+
+    async def delete_cached_content(self, name: str):
+        await self.backend.delete_cached_content(name)
+
+    def batch_request(self, key: str, prompt: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        """One line of a batch input file, see submit_batch. `key` identifies the answer in the batch results."""
+        return self.backend.batch_request(key, prompt, response_model)
+
+    async def submit_batch(self, input_path: str, display_name: Optional[str] = None) -> str:
+        """
+        Submits a JSONL file of batch_request lines to the provider's batch API, which answers them
+        asynchronously (within 24 hours for Gemini) at a lower price. Returns the name of the batch job.
+        """
+        return await self.backend.submit_batch(model=self.backend_model_name, input_path=input_path, display_name=display_name)
+
+    async def get_batch_state(self, name: str) -> Tuple[str, Optional[str]]:
+        return await self.backend.get_batch_state(name)
+
+    async def get_batch_results(self, name: str) -> List[BatchOutput]:
+        return await self.backend.get_batch_results(name)
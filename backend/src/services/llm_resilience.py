@@ -0,0 +1,203 @@
+from typing import Dict, Optional, Tuple, Any
+from collections import defaultdict, deque
+from pydantic import ValidationError
+import google.genai.errors as genai_errors
+import asyncio
+import enum
+import httpx
+import re
+import time
+
+from src.services.llm_backends import LLMBackendError, LLMRateLimitError, LLMResponseError
+from config import (
+    LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS, LLM_HEDGE_PERCENTILE, LLM_HEDGE_WINDOW, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_MAX_RATIO
+)
+
+_RETRY_DELAY = re.compile(r"'retryDelay': '(\d+(?:\.\d+)?)s'")
+
+
+class LLMErrorClass(enum.Enum):
+    RATE_LIMIT = "rate_limit" # 429 / quota exhausted: retried after the advertised delay, and the scheduler backs off
+    TRANSIENT = "transient" # Timeouts, connection errors, 5xx: retried with backoff, counted by the circuit breaker
+    SCHEMA = "schema_error" # An answer that does not validate: retried, as sampling may well produce a valid one
+    PERMANENT = "permanent" # Other 4xx (bad request, auth, missing cached content): not retried
+
+
+class LLMCircuitOpenError(LLMBackendError):
+    """Raised without calling the backend while the circuit breaker of the model is open."""
+
+    def __init__(self, model_name: str, retry_after: float):
+        super().__init__(f"Circuit breaker of {model_name} is open")
+        self.retry_after = retry_after
+
+
+def classify_error(error: Exception) -> Tuple[LLMErrorClass, Optional[float]]:
+    """Returns the class of an LLM call error and the delay the backend asked for before retrying, if any."""
+    if isinstance(error, (LLMRateLimitError, LLMCircuitOpenError)):
+        error_class = LLMErrorClass.RATE_LIMIT if isinstance(error, LLMRateLimitError) else LLMErrorClass.TRANSIENT
+        return error_class, error.retry_after
+    if isinstance(error, (LLMResponseError, ValidationError)):
+        return LLMErrorClass.SCHEMA, None
+    if isinstance(error, genai_errors.APIError):
+        if error.code == 429:
+            # Gemini puts the delay in a google.rpc.RetryInfo detail, e.g. 'retryDelay': '23s'.
+            match = _RETRY_DELAY.search(str(error.details))
+            return LLMErrorClass.RATE_LIMIT, float(match.group(1)) if match else None
+        return _classify_status_code(error.code), None
+    if isinstance(error, LLMBackendError) and error.status_code is not None:
+        return _classify_status_code(error.status_code), None
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return LLMErrorClass.TRANSIENT, None
+    # Unknown errors are retried rather than failing the step outright.
+    return LLMErrorClass.TRANSIENT, None
+
+
+def _classify_status_code(status_code: int) -> LLMErrorClass:
+    if status_code == 429:
+        return LLMErrorClass.RATE_LIMIT
+    if status_code in (408, 409) or status_code >= 500:
+        return LLMErrorClass.TRANSIENT
+    return LLMErrorClass.PERMANENT
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a model fast after failure_threshold consecutive transient failures, instead of
+    piling more requests onto a backend that is down. After reset_seconds one probe call is let
+    through (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at < self.reset_seconds:
+            return False
+        # A probe that neither succeeded nor failed within reset_seconds (e.g. it was cancelled) is replaced.
+        if self.state == self.HALF_OPEN and now - self.probe_started_at < self.reset_seconds:
+            return False
+        self.state = self.HALF_OPEN
+        self.probe_started_at = now
+        return True
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state == self.CLOSED:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Latencies of the last `window` successful calls to a model, from which the hedging delay is taken.
+    Hedges are budgeted to max_hedge_ratio of the calls, so a slow backend is not sent twice the load.
+    """
+
+    def __init__(self, window: int, min_samples: int, max_hedge_ratio: float):
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+
+    def record(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, round(percentile / 100 * (len(ordered) - 1)))]
+
+    def hedge_delay(self, percentile: float = LLM_HEDGE_PERCENTILE) -> Optional[float]:
+        """How long to wait for a call before hedging it, or None if it should not be hedged."""
+        if self.hedges >= self.max_hedge_ratio * self.calls:
+            return None
+        return self.percentile(percentile)
+
+
+class LLMCallMetrics:
+    """Per-model counters of LLM call attempts and their errors, by class."""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record_success(self, model_name: str):
+        self._counters[model_name]["successes"] += 1
+
+    def record_error(self, model_name: str, error_class: LLMErrorClass):
+        self._counters[model_name][error_class.value] += 1
+
+    def record_retry(self, model_name: str):
+        self._counters[model_name]["retries"] += 1
+
+    def record_give_up(self, model_name: str):
+        self._counters[model_name]["failed_calls"] += 1
+
+    def record_hedge(self, model_name: str, won: bool):
+        self._counters[model_name]["hedges"] += 1
+        if won:
+            self._counters[model_name]["hedges_won"] += 1
+
+    def record_fallback(self, model_name: str):
+        """A call to model_name gave up and was sent to the next fallback tier."""
+        self._counters[model_name]["fallbacks"] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for model_name, counters in self._counters.items():
+            breaker = _circuit_breakers.get(model_name)
+            latencies = _latency_trackers.get(model_name)
+            stats[model_name] = {
+                **counters,
+                "circuit_state": breaker.state if breaker else CircuitBreaker.CLOSED,
+                "circuit_opened": breaker.times_opened if breaker else 0,
+                "latency_p50_seconds": latencies.percentile(50) if latencies else None,
+                "latency_p95_seconds": latencies.percentile(95) if latencies else None,
+            }
+        return stats
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_latency_trackers: Dict[str, LatencyTracker] = {}
+
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    """One circuit breaker per model and process."""
+    breaker = _circuit_breakers.get(model_name)
+    if breaker is None:
+        breaker = _circuit_breakers[model_name] = CircuitBreaker(failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD, reset_seconds=LLM_CIRCUIT_RESET_SECONDS)
+    return breaker
+
+
+def get_latency_tracker(model_name: str) -> LatencyTracker:
+    """One latency tracker per model and process."""
+    tracker = _latency_trackers.get(model_name)
+    if tracker is None:
+        tracker = _latency_trackers[model_name] = LatencyTracker(window=LLM_HEDGE_WINDOW, min_samples=LLM_HEDGE_MIN_SAMPLES, max_hedge_ratio=LLM_HEDGE_MAX_RATIO)
+    return tracker
+
+
+llm_call_metrics = LLMCallMetrics()
@@ -0,0 +1,277 @@
+from typing import Protocol, Dict, Deque, Hashable, Awaitable, TypeVar, Optional, Any
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import threading
+import asyncio
+import zlib
+import time
+
+from src.utils import logger, get_async_db_context
+from src.models import RateLimitBucket
+from config import (
+    RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_BURST, CONCURRENT_LLM_CALLS, LLM_RATE_LIMITER_BACKEND, LLM_SHARED_PROCESSES,
+    LLM_MIN_CONCURRENCY, LLM_AIMD_DECREASE_FACTOR, LLM_AIMD_DECREASE_COOLDOWN_SECONDS
+)
+
+T = TypeVar('T')
+
+
+class RateLimiter(Protocol):
+    async def acquire(self, tokens: int) -> None:
+        """Waits until one request consuming `tokens` LLM tokens may be sent."""
+        ...
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are available now)."""
+        # A single request larger than the bucket could never pass, so it only waits for a full bucket.
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate_per_second)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class LocalRateLimiter:
+    """Token buckets for requests and LLM tokens per minute, shared by every correction of this process."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, burst: int):
+        self._requests = TokenBucket(rate_per_minute=requests_per_minute, capacity=burst)
+        self._tokens = TokenBucket(rate_per_minute=tokens_per_minute, capacity=tokens_per_minute)
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                if wait <= 0:
+                    self._requests.take(1)
+                    self._tokens.take(tokens)
+                    return
+            await asyncio.sleep(wait)
+
+
+class PostgresRateLimiter:
+    """
+    The same token buckets as LocalRateLimiter, but stored in the rate_limit_buckets table and
+    updated under a transaction-scoped advisory lock, so that every uvicorn worker (or node)
+    pointing at the same database shares one RPM/TPM budget.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, burst: int, name: str = "llm"):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self._lock_key = zlib.crc32(f"rate_limit_buckets:{name}".encode("utf-8"))
+
+    async def acquire(self, tokens: int) -> None:
+        while True:
+            async with get_async_db_context() as db:
+                wait = await db.run_sync(self._try_acquire, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _try_acquire(self, db: Session, tokens: int) -> float:
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": self._lock_key})
+        now = db.scalar(text("SELECT extract(epoch FROM clock_timestamp())"))
+        now = float(now)
+
+        bucket = db.get(RateLimitBucket, self.name)
+        if bucket is None:
+            bucket = RateLimitBucket(name=self.name, request_tokens=self.burst, llm_tokens=self.tokens_per_minute, updated_at_epoch=now)
+            db.add(bucket)
+
+        requests = TokenBucket(rate_per_minute=self.requests_per_minute, capacity=self.burst)
+        requests.tokens, requests.updated_at = bucket.request_tokens, bucket.updated_at_epoch
+        llm_tokens = TokenBucket(rate_per_minute=self.tokens_per_minute, capacity=self.tokens_per_minute)
+        llm_tokens.tokens, llm_tokens.updated_at = bucket.llm_tokens, bucket.updated_at_epoch
+        requests.refill(now)
+        llm_tokens.refill(now)
+
+        wait = max(requests.wait_time(1), llm_tokens.wait_time(tokens))
+        if wait <= 0:
+            requests.take(1)
+            llm_tokens.take(tokens)
+
+        bucket.request_tokens = requests.tokens
+        bucket.llm_tokens = llm_tokens.tokens
+        bucket.updated_at_epoch = now
+        return wait
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    tokens: int
+    queued_at: float = 0.0
+    pacing_delay_seconds: float = 0.0
+
+
+@dataclass
+class SlotTiming:
+    """How long a request waited for its slot: for the rate limiter (pacing), and otherwise in the queue."""
+    queue_wait_seconds: float
+    pacing_delay_seconds: float
+
+
+class LLMScheduler:
+    """
+    Process-wide gate in front of every LLM call. Requests are queued per key (the correction id)
+    and granted round-robin across keys, so a correction with 200 steps cannot starve one with 3.
+    A request is granted once the rate limiter admits it and fewer than concurrency_limit calls are
+    in flight. The limit adapts AIMD-style: it is cut by decrease_factor when the backend answers
+    with a 429 (at most once per decrease_cooldown seconds, as the calls in flight at that moment
+    tend to fail together), and grows back by one call per concurrency_limit successes, up to max_concurrency.
+
+    The limits hold for this process only, even when the rate limiter is shared; see per_process_concurrency.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, max_concurrency: int, min_concurrency: int = 1,
+                 decrease_factor: float = 0.5, decrease_cooldown: float = 5.0):
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.concurrency_limit = float(max_concurrency)
+        self.backoffs = 0
+        self._last_decrease = float("-inf")
+        self._queues: "OrderedDict[Hashable, Deque[_Waiter]]" = OrderedDict()
+        self._active = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable, tokens: int = 0):
+        """Holds one slot for the duration of the block, which receives a SlotTiming."""
+        waiter = _Waiter(future=asyncio.get_running_loop().create_future(), tokens=tokens, queued_at=time.monotonic())
+        self._queues.setdefault(key, deque()).append(waiter)
+        self._ensure_dispatcher()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            else:
+                self._discard(key, waiter)
+            raise
+
+        waited = time.monotonic() - waiter.queued_at
+        try:
+            yield SlotTiming(queue_wait_seconds=max(0.0, waited - waiter.pacing_delay_seconds), pacing_delay_seconds=waiter.pacing_delay_seconds)
+        finally:
+            self._release()
+
+    async def run(self, key: Hashable, coroutine: Awaitable[T], tokens: int = 0) -> T:
+        async with self.slot(key, tokens=tokens):
+            return await coroutine
+
+    def on_success(self):
+        """Additive increase: one more concurrent call per concurrency_limit successful ones."""
+        if self.concurrency_limit < self.max_concurrency:
+            self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+            if self._queues:
+                self._ensure_dispatcher()
+
+    def on_rate_limited(self):
+        """Multiplicative decrease on a 429 from the backend."""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit * self.decrease_factor)
+        self.backoffs += 1
+        logger.warning(f"LLM backend is rate limiting, concurrency lowered to {int(self.concurrency_limit)}")
+
+    def set_max_concurrency(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = min(self.concurrency_limit, float(max_concurrency))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "queued_keys": len(self._queues),
+            "max_concurrency": self.max_concurrency,
+            "concurrency_limit": int(self.concurrency_limit),
+            "backoffs": self.backoffs,
+        }
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while self._queues and self._active < int(self.concurrency_limit):
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            if waiter.future.done():
+                continue
+
+            acquire_started_at = time.monotonic()
+            await self.rate_limiter.acquire(waiter.tokens)
+            waiter.pacing_delay_seconds = time.monotonic() - acquire_started_at
+            if waiter.future.done():
+                # Cancelled while waiting for rate-limit budget; the budget is simply lost.
+                continue
+
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def _release(self):
+        self._active -= 1
+        if self._queues:
+            self._ensure_dispatcher()
+
+    def _discard(self, key: Hashable, waiter: _Waiter):
+        queue = self._queues.get(key)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[key]
+
+
+def _create_rate_limiter() -> RateLimiter:
+    if LLM_RATE_LIMITER_BACKEND == "postgres":
+        logger.info("Using Postgres-backed LLM rate limiter shared across workers")
+        return PostgresRateLimiter(requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM, burst=RATE_LIMIT_BURST)
+    return LocalRateLimiter(requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM, burst=RATE_LIMIT_BURST)
+
+
+def per_process_concurrency(processes: int) -> int:
+    """
+    Concurrency cap of one of `processes` processes. They share the budget of the postgres rate limiter, so they
+    split CONCURRENT_LLM_CALLS between them; with the local limiter each process has a budget, and the cap, of its own.
+    """
+    if LLM_RATE_LIMITER_BACKEND != "postgres":
+        return CONCURRENT_LLM_CALLS
+    return max(LLM_MIN_CONCURRENCY, CONCURRENT_LLM_CALLS // max(processes, 1))
+
+
+# One scheduler per process: every correction's LLM calls go through it.
+llm_scheduler = LLMScheduler(rate_limiter=_create_rate_limiter(), max_concurrency=per_process_concurrency(LLM_SHARED_PROCESSES),
+                             min_concurrency=LLM_MIN_CONCURRENCY,
+                             decrease_factor=LLM_AIMD_DECREASE_FACTOR, decrease_cooldown=LLM_AIMD_DECREASE_COOLDOWN_SECONDS)
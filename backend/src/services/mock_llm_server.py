@@ -0,0 +1,73 @@
+"""
+Local mock of an OpenAI-compatible chat completions server, for load tests that should include the
+HTTP path. Answers come from MockBackend: deterministic, schema-valid, with the latency and failures
+configured by the LLM_MOCK_* settings.
+
+Usage (from backend/):
+    python -m src.services.mock_llm_server --port 8001
+    LLM_MODEL_NAME=openai:mock LLM_OPENAI_BASE_URL=http://localhost:8001/v1 python worker.py
+"""
+from typing import Dict, Any, List
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import argparse
+import asyncio
+import time
+import uvicorn
+
+from src.services.llm_backends import get_backend, MOCK_PROVIDER
+from src.services.fake_genai import fake_llm_response
+from src.services.prompt_fusion import get_response_model_for_schema
+from src.services.text_utils import estimate_token_count
+
+app = FastAPI(title="Mock LLM server")
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str
+    messages: List[Dict[str, Any]]
+    response_format: Dict[str, Any] = {}
+
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: ChatCompletionRequest):
+    backend = get_backend(MOCK_PROVIDER)
+    backend.requests += 1
+    latency, status = backend.draw()
+    await asyncio.sleep(latency)
+    if status == 429:
+        backend.rate_limited += 1
+        return JSONResponse(status_code=429, headers={"retry-after": "1"}, content={"error": {"message": "Mock rate limit"}})
+    if status == 500:
+        backend.errors += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Mock server error"}})
+
+    response_model = get_response_model_for_schema(request.response_format.get("json_schema", {}).get("schema", {}))
+    prompt = "\n".join(str(message.get("content", "")) for message in request.messages)
+    content = fake_llm_response(response_model, prompt=prompt, issue_count=backend.issues_per_request).model_dump_json()
+    return {
+        "id": f"mock-{backend.requests}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": estimate_token_count(prompt), "completion_tokens": estimate_token_count(content)},
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return get_backend(MOCK_PROVIDER).stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
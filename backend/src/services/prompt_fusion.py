@@ -0,0 +1,64 @@
+from typing import Dict, List, Type, Any
+from functools import lru_cache
+from pydantic import BaseModel, Field, create_model
+import jinja2
+
+from src.schemas.schemas_llm import SnippetIssuesRevisionList
+from src.services.prompt_registry import prompt_registry
+
+# Stands in for the input text inside each fused prompt; the text itself is sent once, at the end.
+FUSED_INPUT_TEXT_PLACEHOLDER = "(the TEXT at the end of this request)"
+
+FUSED_PROMPT_TEMPLATE = jinja2.Template("""\
+## FUSED REQUEST:
+You are given {{ tasks | length }} independent TASKS over the same TEXT. Perform every TASK on its own, following only its own instructions,
+and return a single JSON object with one key per TASK id ({{ tasks.keys() | join(", ") }}). The value of each key is the JSON object
+with the list named "issues" that the TASK asks for. Report an issue only under the TASK that asks for it.
+{% for prompt_id_ref, task in tasks.items() %}
+### TASK {{ prompt_id_ref }}:
+{{ task }}
+{% endfor %}
+## TEXT:
+{{ input_text }}
+""")
+
+
+def can_fuse(prompt_id_ref: str) -> bool:
+    """Prompt refs become field names of the composite response schema."""
+    return prompt_id_ref.isidentifier() and not prompt_id_ref.startswith("_")
+
+
+def render_fused_prompt(prompt_texts: Dict[str, str], input_text: str) -> str:
+    """
+    Renders several prompt templates (prompt_id_ref -> template) for the same input text into one
+    prompt. Each template is rendered with a reference to the text, which is included only once.
+    """
+    tasks = {
+        prompt_id_ref: prompt_registry.render(prompt_text, input_text=FUSED_INPUT_TEXT_PLACEHOLDER)
+        for prompt_id_ref, prompt_text in prompt_texts.items()
+    }
+    return FUSED_PROMPT_TEMPLATE.render(tasks=tasks, input_text=input_text)
+
+
+@lru_cache(maxsize=256)
+def get_fused_response_model(prompt_id_refs: tuple) -> Type[BaseModel]:
+    """Composite response schema with one SnippetIssuesRevisionList per prompt, keyed by prompt_id_ref."""
+    fields = {
+        prompt_id_ref: (SnippetIssuesRevisionList, Field(description=f"The issues found by TASK {prompt_id_ref}"))
+        for prompt_id_ref in prompt_id_refs
+    }
+    return create_model("FusedSnippetIssuesRevisionLists", **fields)
+
+
+def split_fused_response(fused_response: BaseModel, prompt_id_refs: List[str]) -> Dict[str, SnippetIssuesRevisionList]:
+    """Splits a validated fused response back into one response per prompt."""
+    return {prompt_id_ref: getattr(fused_response, prompt_id_ref) for prompt_id_ref in prompt_id_refs}
+
+
+def get_response_model_for_schema(schema: Dict[str, Any]) -> Type[BaseModel]:
+    """
+    The response model a JSON schema was generated from: SnippetIssuesRevisionList or a fused composite
+    of it. Used by the mock backends, which only see the schema of a request.
+    """
+    fields = tuple(schema.get("properties", {"issues": None}))
+    return SnippetIssuesRevisionList if fields == ("issues",) else get_fused_response_model(fields)
@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional, Tuple, Iterable
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy.orm import Session
+from cachetools import LRUCache
+import threading
+import hashlib
+import time
+import jinja2
+
+from src.utils import logger
+from src.models import InputGranularityEnum
+from src.repositories.correction_repository import CorrectionRepository
+from config import PROMPT_REGISTRY_REFRESH_SECONDS, PROMPT_TEMPLATE_CACHE_SIZE
+
+
+@dataclass(frozen=True)
+class RegisteredPrompt:
+    """Detached copy of an enabled Prompt row."""
+    prompt_id: int
+    prompt_id_ref: str
+    description: Optional[str]
+    text: str
+    input_granularity: InputGranularityEnum
+    model_name: Optional[str]
+    updated_at: datetime
+
+
+class PromptRegistry:
+    """
+    In-memory copy of the enabled prompts, and compiled Jinja templates shared by the whole process.
+
+    The prompts are loaded with one query and reloaded when the prompts table changes, which is
+    detected from max(updated_at) and the row count, checked at most every refresh_seconds (and
+    right away for a prompt ref that is not known yet). Updates must go through the ORM, or set
+    updated_at themselves, to be picked up.
+
+    Templates are compiled once per distinct text, so rendering a prompt for hundreds of steps does
+    not parse it hundreds of times. Keying on the text also means an edited prompt never renders
+    with a stale template.
+    """
+
+    def __init__(self, refresh_seconds: float, template_cache_size: int):
+        self.refresh_seconds = refresh_seconds
+        # Same settings as jinja2.Template(text), so prompts render exactly as before (and hit the same LLM cache keys).
+        self.environment = jinja2.Environment()
+        self._templates: LRUCache = LRUCache(maxsize=template_cache_size)
+        self._prompts: Dict[str, RegisteredPrompt] = {}
+        self._version: Optional[Tuple[Optional[datetime], int]] = None
+        self._etag: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        self.reloads = 0
+        self.template_compilations = 0
+
+    def get_template(self, text: str) -> jinja2.Template:
+        with self._lock:
+            template = self._templates.get(text)
+        if template is None:
+            # Compiled outside the lock; two threads compiling the same text at once is harmless.
+            template = self.environment.from_string(text)
+            with self._lock:
+                self._templates[text] = template
+                self.template_compilations += 1
+        return template
+
+    def render(self, text: str, input_text: str) -> str:
+        return self.get_template(text).render(input_text=input_text)
+
+    def get_enabled_prompts(self, db: Session) -> List[RegisteredPrompt]:
+        self._refresh(db)
+        return list(self._prompts.values())
+
+    def get_enabled_prompts_with_etag(self, db: Session) -> Tuple[List[RegisteredPrompt], str]:
+        """The enabled prompts and a validator that changes whenever they do."""
+        self._refresh(db)
+        with self._lock:
+            return list(self._prompts.values()), self._etag
+
+    def get_prompts_by_refs(self, db: Session, prompt_id_refs: Iterable[str]) -> Dict[str, RegisteredPrompt]:
+        """Resolves prompt refs to enabled prompts; unknown or disabled refs are left out."""
+        prompt_id_refs = list(prompt_id_refs)
+        self._refresh(db, force=any(prompt_id_ref not in self._prompts for prompt_id_ref in prompt_id_refs))
+        prompts = self._prompts
+        return {prompt_id_ref: prompts[prompt_id_ref] for prompt_id_ref in prompt_id_refs if prompt_id_ref in prompts}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "prompts": len(self._prompts),
+                "reloads": self.reloads,
+                "templates": len(self._templates),
+                "template_compilations": self.template_compilations,
+            }
+
+    def _refresh(self, db: Session, force: bool = False):
+        now = time.monotonic()
+        if not force and self._version is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        version = CorrectionRepository(db).get_prompts_version()
+        self._checked_at = now
+        if version == self._version:
+            return
+
+        rows = CorrectionRepository(db).get_enabled_prompts()
+        prompts = {
+            row.prompt_id_ref: RegisteredPrompt(
+                prompt_id=row.prompt_id, prompt_id_ref=row.prompt_id_ref, description=row.description, text=row.text,
+                input_granularity=row.input_granularity, model_name=row.model_name, updated_at=row.updated_at
+            )
+            for row in rows
+        }
+        digest = hashlib.sha256()
+        for prompt in prompts.values():
+            digest.update(f"{prompt.prompt_id}\x00{prompt.prompt_id_ref}\x00{prompt.updated_at.isoformat()}\x00".encode("utf-8"))
+        with self._lock:
+            # Replaced, never mutated, so readers can keep iterating the previous dict.
+            self._prompts = prompts
+            self._version = version
+            self._etag = f'"{digest.hexdigest()[:32]}"'
+            self.reloads += 1
+        logger.debug(f"Loaded {len(prompts)} enabled prompts (version {version})")
+
+
+# One registry per process; every worker and API process checks the table for changes on its own.
+prompt_registry = PromptRegistry(refresh_seconds=PROMPT_REGISTRY_REFRESH_SECONDS, template_cache_size=PROMPT_TEMPLATE_CACHE_SIZE)
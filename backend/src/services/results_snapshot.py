@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+import hashlib
+import gzip
+
+from src.schemas.schemas_api import CorrectionResultResponse
+from config import RESULTS_SNAPSHOT_GZIP_LEVEL
+
+
+@dataclass(frozen=True)
+class ResultsSnapshot:
+    """
+    The results of a completed correction, serialized once when it completes and stored on its row.
+    A completed correction does not change (edits create a revision, i.e. a new correction), so the
+    snapshot is served as is, with an ETag derived from its content.
+    """
+    body: bytes # Gzip-compressed JSON of the CorrectionResultResponse
+    etag: str # Of the uncompressed JSON
+
+    def get_etag(self, gzipped: bool) -> str:
+        """Strong ETags are per representation, so the gzip-encoded one gets its own."""
+        return f'{self.etag[:-1]}-gzip"' if gzipped else self.etag
+
+    def decompress(self) -> bytes:
+        return gzip.decompress(self.body)
+
+
+def build_results_snapshot(results: CorrectionResultResponse) -> ResultsSnapshot:
+    # Serialized by pydantic-core straight to JSON, without the intermediate dicts of model_dump().
+    content = results.model_dump_json().encode("utf-8")
+    # mtime=0 keeps the compressed bytes a function of the content alone.
+    return ResultsSnapshot(body=gzip.compress(content, compresslevel=RESULTS_SNAPSHOT_GZIP_LEVEL, mtime=0),
+                           etag=f'"{hashlib.sha256(content).hexdigest()[:32]}"')
@@ -0,0 +1,176 @@
+from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field
+from sqlalchemy import select, update, insert
+from sqlalchemy.orm import Session
+import asyncio
+import time
+
+from src.utils import logger, get_async_db_context
+from src.models import CorrectionStep, AnalysisResult, CorrectionStatusEnum
+from src.services.llm_cache import llm_response_cache
+from src.services.correction_events import publish_correction_event
+from src.services.llm_interaction import LLMCallTrace
+from src.services.telemetry import record_step_persisted, span
+from config import STEP_WRITER_BATCH_SIZE, STEP_WRITER_FLUSH_SECONDS
+
+# Keeps a multi-row INSERT well below the 65535 bind parameters Postgres accepts per statement.
+ANALYSIS_RESULTS_PER_INSERT = 5000
+
+
+@dataclass
+class StepResult:
+    correction_id: int
+    correction_step_id: int
+    status: CorrectionStatusEnum
+    llm_response: Optional[Dict[str, Any]] = None
+    error_message: Optional[str] = None
+    analysis_results: List[Dict[str, Any]] = field(default_factory=list) # Rows for the analysis_results table
+    cache_key: Optional[str] = None # Set if llm_response should be written to the LLM response cache
+    model_name: Optional[str] = None # Model that produced llm_response
+    trace: Optional[LLMCallTrace] = None # Timings and tokens of the LLM call, unless answered by the cache
+    finished_at: float = field(default_factory=time.monotonic)
+
+
+class StepResultWriter:
+    """
+    Write-behind buffer for finished correction steps. Results are collected in memory and
+    flushed by size or time in a single transaction: one bulk UPDATE of correction_steps, one
+    multi-row INSERT into analysis_results and one upsert into the LLM response cache.
+
+    A step and its analysis results become visible in the same commit, so the progress reported
+    by the status endpoint never counts a step whose results are not stored yet; it lags by at
+    most one flush interval.
+
+    The step rows also get the timings and token usage of their LLM call. Their persist_seconds is
+    the time the result waited for its flush; the flush itself is in the step_persist_seconds metric.
+
+    A result is only stored if its step is still pending and leased to lease_owner (None for steps
+    run without the job queue). A step whose lease expired, or that was requeued, while its result
+    sat in the buffer may be run again elsewhere; its stale result is dropped, together with its
+    analysis results and cache entry, so that the issues are not stored twice.
+
+    If a flush fails, leased steps stay pending and the job queue runs them again. Steps run without
+    the job queue have no such retry, so the writer then raises the error on exit, before the caller
+    can finalize their corrections with results missing.
+
+    Usage:
+        async with StepResultWriter(lease_owner=worker_id) as writer:
+            await writer.add(step_result)
+    """
+
+    def __init__(self, lease_owner: Optional[str] = None, max_batch_size: int = STEP_WRITER_BATCH_SIZE,
+                 flush_interval: float = STEP_WRITER_FLUSH_SECONDS):
+        self.lease_owner = lease_owner
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[StepResult] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._periodic_flush: Optional[asyncio.Task] = None
+        self._flush_error: Optional[Exception] = None
+
+    async def __aenter__(self) -> "StepResultWriter":
+        self._flush_lock = asyncio.Lock()
+        self._periodic_flush = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._periodic_flush.cancel()
+        await self.flush()
+        if self._flush_error is not None and exc is None:
+            raise self._flush_error
+
+    def add_nowait(self, step_result: StepResult):
+        """Buffers a result without flushing; it is written by the next flush."""
+        self._buffer.append(step_result)
+
+    async def add(self, step_result: StepResult):
+        self._buffer.append(step_result)
+        if len(self._buffer) >= self.max_batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                # The DB round trips are awaited (asyncpg) so in-flight LLM calls are not stalled.
+                with span("db.persist_steps", **{"steps.count": len(batch)}):
+                    async with get_async_db_context() as db:
+                        await db.run_sync(self._write, batch)
+            except Exception as e:
+                # Leased steps stay pending in the database and are retried by the job queue.
+                logger.error(f"Failed to persist {len(batch)} step results: {e}")
+                if self.lease_owner is None and self._flush_error is None:
+                    self._flush_error = e
+                return
+            persisted_at = time.monotonic()
+            for result in batch:
+                record_step_persisted(persisted_at - result.finished_at)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write(self, db: Session, batch: List[StepResult]):
+        # Locked until the commit, so the steps cannot be requeued or claimed between this check and the updates below.
+        writable_step_ids = set(db.scalars(
+            select(CorrectionStep.correction_step_id)
+            .where(CorrectionStep.correction_step_id.in_([result.correction_step_id for result in batch]),
+                   CorrectionStep.status == CorrectionStatusEnum.PENDING,
+                   CorrectionStep.lease_owner.is_not_distinct_from(self.lease_owner))
+            .with_for_update()
+        ).all())
+        if len(writable_step_ids) < len(batch):
+            stale_step_ids = [result.correction_step_id for result in batch if result.correction_step_id not in writable_step_ids]
+            logger.warning(f"Dropped the results of steps {stale_step_ids}, which are no longer pending and leased to {self.lease_owner}")
+            batch = [result for result in batch if result.correction_step_id in writable_step_ids]
+
+        completed = [result for result in batch if result.status == CorrectionStatusEnum.COMPLETED]
+        failed = [result for result in batch if result.status == CorrectionStatusEnum.FAILED]
+        analysis_rows = [row for result in completed for row in result.analysis_results]
+        now = time.monotonic()
+
+        if completed:
+            db.execute(update(CorrectionStep), [
+                {"correction_step_id": result.correction_step_id, "status": result.status, "llm_response": result.llm_response,
+                 "llm_model_name": result.model_name, **StepResultWriter._instrumentation(result, now)}
+                for result in completed
+            ])
+        if failed:
+            db.execute(update(CorrectionStep), [
+                {"correction_step_id": result.correction_step_id, "status": result.status, "error_message": result.error_message,
+                 **StepResultWriter._instrumentation(result, now)}
+                for result in failed
+            ])
+        for start in range(0, len(analysis_rows), ANALYSIS_RESULTS_PER_INSERT):
+            db.execute(insert(AnalysisResult).values(analysis_rows[start:start + ANALYSIS_RESULTS_PER_INSERT]))
+
+        llm_response_cache.set_many(db, [
+            (result.cache_key, result.model_name, result.llm_response)
+            for result in completed if result.cache_key is not None
+        ])
+
+        # Lets streaming clients pick up the new results once this transaction commits.
+        finished_steps_by_correction: Dict[int, int] = {}
+        for result in batch:
+            finished_steps_by_correction[result.correction_id] = finished_steps_by_correction.get(result.correction_id, 0) + 1
+        for correction_id, finished_steps in finished_steps_by_correction.items():
+            publish_correction_event(db, correction_id=correction_id, finished_steps=finished_steps)
+
+        logger.debug(f"Persisted {len(completed)} completed and {len(failed)} failed steps with {len(analysis_rows)} analysis results")
+
+    @staticmethod
+    def _instrumentation(result: StepResult, now: float) -> Dict[str, Any]:
+        """The instrumentation columns of a step; only persist_seconds for steps answered by the cache."""
+        trace = result.trace
+        return {
+            "queue_wait_seconds": trace.queue_wait_seconds if trace else None,
+            "pacing_delay_seconds": trace.pacing_delay_seconds if trace else None,
+            "llm_latency_seconds": trace.llm_latency_seconds if trace else None,
+            "llm_retries": trace.retries if trace else None,
+            "prompt_tokens": trace.prompt_tokens if trace else None,
+            "output_tokens": trace.output_tokens if trace else None,
+            "persist_seconds": now - result.finished_at,
+        }
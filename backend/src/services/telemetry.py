@@ -0,0 +1,279 @@
+from typing import Dict, List, Tuple, Optional, Callable, Iterable, Sequence, Any
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import os
+
+from src.utils import logger, get_pool_stats
+from src.services.llm_backends import parse_model_name
+from src.services.llm_cache import llm_response_cache
+from src.services.llm_scheduler import llm_scheduler
+from src.services.llm_resilience import llm_call_metrics
+from config import OTEL_ENABLED, OTEL_SERVICE_NAME, METRICS_LATENCY_BUCKETS, LLM_PRICES_PER_MILLION_TOKENS
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (labels, value) samples of one metric, as reported by a collector
+Samples = List[Tuple[Dict[str, str], float]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count per bucket (not cumulative), then the sum and count of the observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, (total, count)) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process in the Prometheus text format. Counters and histograms are updated as
+    things happen; collectors turn the counters the services already keep (see /stats) into samples
+    when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Tuple[str, str, str, Callable[[], Samples]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def add_collector(self, name: str, metric_type: str, documentation: str, collect: Callable[[], Samples]):
+        self._collectors.append((name, metric_type, documentation, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, metric_type, documentation, collect in self._collectors:
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"])
+            try:
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+_http_request_seconds = metrics_registry.histogram(
+    "llm_editor_http_request_seconds", "Latency of API requests.", ["method", "route", "status"])
+_llm_request_seconds = metrics_registry.histogram(
+    "llm_editor_llm_request_seconds", "Latency of LLM call attempts, by outcome (success or error class).", ["model", "outcome"])
+_llm_queue_wait_seconds = metrics_registry.histogram(
+    "llm_editor_llm_queue_wait_seconds", "Time LLM call attempts waited for a scheduler slot, pacing excluded.", ["model"])
+_llm_pacing_delay_seconds = metrics_registry.histogram(
+    "llm_editor_llm_pacing_delay_seconds", "Time LLM call attempts waited for the rate limiter (RATE_LIMIT_RPM/TPM).", ["model"])
+_llm_tokens = metrics_registry.counter(
+    "llm_editor_llm_tokens_total", "Tokens of LLM calls, by kind (prompt or output).", ["model", "kind"])
+_llm_cost_usd = metrics_registry.counter(
+    "llm_editor_llm_cost_usd_total", "Estimated cost of LLM calls at interactive prices (LLM_PRICES_PER_MILLION_TOKENS).", ["model"])
+_step_seconds = metrics_registry.histogram(
+    "llm_editor_step_seconds", "Time from the start of a correction step to its result, by outcome (completed, failed, cached).",
+    ["model", "prompt", "outcome"])
+_step_tokens = metrics_registry.counter(
+    "llm_editor_step_tokens_total", "Tokens of correction steps, by kind (prompt or output); a fused call's tokens are split between its steps.",
+    ["model", "prompt", "kind"])
+_step_retries = metrics_registry.counter(
+    "llm_editor_step_retries_total", "Retried LLM call attempts of correction steps.", ["model", "prompt"])
+_step_persist_seconds = metrics_registry.histogram(
+    "llm_editor_step_persist_seconds", "Time from the result of a step to the commit of its row (write-behind buffering included).")
+
+
+def estimate_llm_cost(model_name: str, prompt_tokens: int, output_tokens: int, cost_factor: float = 1.0) -> Optional[float]:
+    """Cost in USD of LLM tokens, or None if the model has no listed price."""
+    prices = LLM_PRICES_PER_MILLION_TOKENS.get(parse_model_name(model_name)[1])
+    if prices is None:
+        return None
+    input_price, output_price = prices
+    return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000 * cost_factor
+
+
+def record_http_request(method: str, route: str, status: int, seconds: float):
+    _http_request_seconds.observe(seconds, method=method, route=route, status=status)
+
+
+def record_llm_attempt(model_name: str, outcome: str, seconds: float, queue_wait_seconds: float, pacing_delay_seconds: float,
+                       prompt_tokens: int = 0, output_tokens: int = 0):
+    _llm_request_seconds.observe(seconds, model=model_name, outcome=outcome)
+    _llm_queue_wait_seconds.observe(queue_wait_seconds, model=model_name)
+    _llm_pacing_delay_seconds.observe(pacing_delay_seconds, model=model_name)
+    if prompt_tokens or output_tokens:
+        _llm_tokens.inc(prompt_tokens, model=model_name, kind="prompt")
+        _llm_tokens.inc(output_tokens, model=model_name, kind="output")
+        cost = estimate_llm_cost(model_name, prompt_tokens, output_tokens)
+        if cost is not None:
+            _llm_cost_usd.inc(cost, model=model_name)
+
+
+def record_step(model_name: str, prompt_id_ref: str, outcome: str, seconds: float, retries: int = 0, prompt_tokens: int = 0, output_tokens: int = 0):
+    _step_seconds.observe(seconds, model=model_name, prompt=prompt_id_ref, outcome=outcome)
+    if retries:
+        _step_retries.inc(retries, model=model_name, prompt=prompt_id_ref)
+    if prompt_tokens or output_tokens:
+        _step_tokens.inc(prompt_tokens, model=model_name, prompt=prompt_id_ref, kind="prompt")
+        _step_tokens.inc(output_tokens, model=model_name, prompt=prompt_id_ref, kind="output")
+
+
+def record_step_persisted(seconds: float):
+    _step_persist_seconds.observe(seconds)
+
+
+def _collect_llm_call_events() -> Samples:
+    samples = []
+    for model_name, stats in llm_call_metrics.stats().items():
+        for event, value in stats.items():
+            if isinstance(value, int) and not event.startswith("circuit_"):
+                samples.append(({"model": model_name, "event": event}, value))
+    return samples
+
+
+metrics_registry.add_collector(
+    "llm_editor_llm_call_events_total", "counter", "LLM call outcomes, retries, hedges and fallbacks, see LLMCallMetrics.", _collect_llm_call_events)
+metrics_registry.add_collector(
+    "llm_editor_llm_circuit_open", "gauge", "Whether the circuit breaker of the model is open.",
+    lambda: [({"model": model_name}, float(stats["circuit_state"] != "closed")) for model_name, stats in llm_call_metrics.stats().items()])
+metrics_registry.add_collector(
+    "llm_editor_llm_scheduler", "gauge", "LLM scheduler state: calls in flight, queued calls and the current AIMD concurrency limit.",
+    lambda: [({"state": state}, llm_scheduler.stats()[state]) for state in ("active", "queued", "concurrency_limit", "max_concurrency")])
+metrics_registry.add_collector(
+    "llm_editor_llm_cache_events_total", "counter", "LLM response cache lookups and writes.",
+    lambda: [({"event": event}, llm_response_cache.stats()[event]) for event in ("memory_hits", "db_hits", "misses", "writes", "evictions")])
+metrics_registry.add_collector(
+    "llm_editor_db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection of the pool.",
+    lambda: [({"pool": pool}, stats["wait_seconds_total"]) for pool, stats in get_pool_stats().items()])
+metrics_registry.add_collector(
+    "llm_editor_db_pool_checkouts_total", "counter", "Connections checked out of the pool.",
+    lambda: [({"pool": pool}, stats["checkouts"]) for pool, stats in get_pool_stats().items()])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serves /metrics from a daemon thread, for processes without an API (the workers)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# Created on first use in each process: the span processor's export thread does not survive a fork.
+_tracer = None
+_tracer_pid: Optional[int] = None
+
+
+def _get_tracer():
+    global _tracer, _tracer_pid
+    if _tracer_pid == os.getpid():
+        return _tracer
+    _tracer_pid = os.getpid()
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("OTEL_ENABLED is set, but the OpenTelemetry SDK or OTLP exporter is not installed; spans are not recorded")
+        _tracer = None
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("llm_editor")
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """
+    An OpenTelemetry span around the block, child of the current one, or nothing unless OTEL_ENABLED.
+    Attributes that are None are left out.
+    """
+    tracer = _get_tracer() if OTEL_ENABLED else None
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes={key: value for key, value in attributes.items() if value is not None}) as current_span:
+        yield current_span
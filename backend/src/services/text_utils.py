@@ -1,6 +1,26 @@
 import re
-from typing import List, Tuple
+import mmap
+import codecs
+import difflib
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple, Dict, Iterator, Union, TextIO, BinaryIO, Optional
 from src.utils import logger
+from src.schemas.schemas_api import RichSegment, RichSegmentIssue
+from config import CHARS_PER_TOKEN
+
+
+def estimate_token_count(text: str) -> int:
+    """Cheap estimate of the number of LLM tokens in a text, used for rate limiting."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# A paragraph ends before a blank line: two newlines with only whitespace in between.
+PARAGRAPH_SEPARATOR = re.compile(r'\n\s*\n')
+PARAGRAPH_STREAM_CHUNK_SIZE = 1 << 20
+# A sentence ends with . ! or ? (plus closing quotes/brackets) followed by whitespace and what looks
+# like the start of a new sentence: a capital letter, a digit, an opening quote/bracket or a LaTeX command.
+SENTENCE_SEPARATOR = re.compile(r'(?<=[.!?])["\'\)\]\u201d\u2019]*\s+(?=[A-Z0-9"\'\(\[\\\u201c\u2018])')
+
 
 def split_text_into_paragraphs(text: str) -> List[Tuple[str, int]]:
     """
@@ -14,73 +34,437 @@ def split_text_into_paragraphs(text: str) -> List[Tuple[str, int]]:
     Returns:
         A list of tuples, where each tuple is (paragraph_text, start_offset).
     """
-    paragraphs_with_offsets: List[Tuple[str, int]] = []
-    if not text.strip():
-        return []
-    
-    start_offset = 0
-    while start_offset < len(text):
-        # Find the end of the current paragraph
-        # A paragraph ends before two or more newlines, or at the end of the text.
-        end_of_paragraph_marker = re.search(r'\n\s*\n', text[start_offset:])
-        
-        if end_of_paragraph_marker:
-            # The paragraph text ends where the marker begins.
-            # The marker itself indicates the separation.
-            para_end_offset_in_slice = end_of_paragraph_marker.start()
-            paragraph_text = text[start_offset : start_offset + para_end_offset_in_slice]
-            
-            # The next paragraph will start after the marker.
-            # The marker is text[start_offset + para_end_offset_in_slice : start_offset + end_of_paragraph_marker.end()]
-            next_para_start_offset = start_offset + end_of_paragraph_marker.end()
-        else:
-            # No more double newlines, so the rest of the text is the last paragraph
-            paragraph_text = text[start_offset:]
-            next_para_start_offset = len(text) # End of text
+    return list(iter_paragraphs(text))
 
-        # Add paragraph if it's not just whitespace
-        # However, for your use case, you might want to preserve paragraphs that are
-        # just whitespace if the LLM could comment on them or if it affects numbering.
-        # For now, let's strip and check if non-empty.
-        trimmed_paragraph = paragraph_text.strip()
-        if trimmed_paragraph: # Only add non-empty paragraphs
-            paragraphs_with_offsets.append((paragraph_text, start_offset)) # Store original paragraph text
-        elif paragraph_text:
-            pass
 
+def iter_paragraphs(source: Union[str, TextIO, BinaryIO, mmap.mmap], chunk_size: int = PARAGRAPH_STREAM_CHUNK_SIZE) -> Iterator[Tuple[str, int]]:
+    """
+    Lazily yields the (paragraph_text, start_offset) pairs of split_text_into_paragraphs in a
+    single pass. Whitespace-only paragraphs are skipped.
 
-        start_offset = next_para_start_offset
+    Args:
+        source: The text, or a file-like object (text or binary, e.g. an mmap) that is read
+            chunk_size characters/bytes at a time. Binary input is decoded as UTF-8; offsets
+            are always character offsets.
+        chunk_size: Read size for file-like sources.
+    """
+    if isinstance(source, str):
+        start_offset = 0
+        for separator in PARAGRAPH_SEPARATOR.finditer(source):
+            if source[start_offset:separator.start()].strip():
+                yield source[start_offset:separator.start()], start_offset
+            start_offset = separator.end()
+        if source[start_offset:].strip():
+            yield source[start_offset:], start_offset
+        return
 
-    return paragraphs_with_offsets
-    
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    # The text read since the last separator is kept in pieces and joined once per paragraph, so a long
+    # paragraph is not copied on every read. Only the trailing whitespace run (tail) is searched again.
+    pending: List[str] = []
+    pending_offset = 0
+    tail, tail_offset = "", 0
+    at_end = False
+    while not at_end:
+        chunk = source.read(chunk_size)
+        at_end = not chunk
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk, final=at_end)
+        content = chunk.rstrip()
+        if not content and not at_end:
+            # A separator in the trailing whitespace may continue in the next chunk.
+            tail += chunk
+            continue
 
-def locate_snippet_in_segment(segment_text: str, segment_global_start_offset: int, snippet: str, sentence_context: str) -> Tuple[int, int]:
-    try: 
-        # TODO: If there the same sentence has twice an error with the same original snippet, this will not work.
-        # We will attribute both errors to the first occurence of the original snippet. This is a minor issue for now. But we should fix it.
-        full_sentence_context_start_pos = segment_text.find(sentence_context)
-        full_sentence_context_end_pos = full_sentence_context_start_pos + len(sentence_context)
-
-        if full_sentence_context_start_pos == -1:
-            snippet_start_pos = segment_text.find(snippet)
-            snippet_end_pos = snippet_start_pos + len(snippet)
+        # Separators are whitespace only, so they all lie in tail + content and none of them can grow any more.
+        window = tail + content
+        start_offset = 0
+        for separator in PARAGRAPH_SEPARATOR.finditer(window):
+            pending.append(window[start_offset:separator.start()])
+            paragraph = "".join(pending)
+            if paragraph.strip():
+                yield paragraph, pending_offset
+            pending, pending_offset = [], tail_offset + separator.end()
+            start_offset = separator.end()
+        pending.append(window[start_offset:])
+        tail, tail_offset = chunk[len(content):], tail_offset + len(window)
+
+    paragraph = "".join(pending)
+    if paragraph.strip():
+        yield paragraph, pending_offset
+
+
+def split_text_into_sentences(text: str, paragraphs_with_offsets: Optional[List[Tuple[str, int]]] = None) -> List[Tuple[str, int]]:
+    """
+    Splits a text into sentences, which never span paragraphs, and returns each sentence with
+    its starting character offset in the text.
+
+    Args:
+        text: The input string.
+        paragraphs_with_offsets: The output of split_text_into_paragraphs for text, if already computed.
+
+    Returns:
+        A list of tuples, where each tuple is (sentence_text, start_offset).
+    """
+    if paragraphs_with_offsets is None:
+        paragraphs_with_offsets = split_text_into_paragraphs(text)
+
+    sentences_with_offsets: List[Tuple[str, int]] = []
+    for paragraph, paragraph_offset in paragraphs_with_offsets:
+        start = 0
+        for separator in SENTENCE_SEPARATOR.finditer(paragraph):
+            # The closing quotes/brackets matched by the separator still belong to the sentence.
+            end = separator.start() + len(separator.group().rstrip())
+            if paragraph[start:end].strip():
+                sentences_with_offsets.append((paragraph[start:end], paragraph_offset + start))
+            start = separator.end()
+        if paragraph[start:].strip():
+            sentences_with_offsets.append((paragraph[start:], paragraph_offset + start))
+    return sentences_with_offsets
+
+
+def split_text_into_chunks(text: str, max_tokens: int, overlap_tokens: int = 0,
+                           paragraphs_with_offsets: Optional[List[Tuple[str, int]]] = None) -> List[Tuple[str, int, int]]:
+    """
+    Packs adjacent paragraphs into chunks of at most max_tokens (estimated, see estimate_token_count).
+    Paragraphs above the budget are split into sentences; a single sentence above the budget becomes
+    a chunk of its own. Each chunk after the first starts with up to overlap_tokens of the end of the
+    previous chunk, so the LLM sees the context across chunk boundaries.
+
+    Args:
+        text: The input string.
+        max_tokens: Token budget of a chunk, including its overlap.
+        overlap_tokens: Token budget of the text repeated from the previous chunk.
+        paragraphs_with_offsets: The output of split_text_into_paragraphs for text, if already computed.
+
+    Returns:
+        A list of tuples (chunk_text, start_offset, overlap_char_count), where chunk_text is
+        text[start_offset:start_offset + len(chunk_text)] and its first overlap_char_count
+        characters repeat the previous chunk.
+    """
+    if paragraphs_with_offsets is None:
+        paragraphs_with_offsets = split_text_into_paragraphs(text)
+
+    # Packing units as (start, end) spans of text.
+    units: List[Tuple[int, int]] = []
+    for paragraph, paragraph_offset in paragraphs_with_offsets:
+        if estimate_token_count(paragraph) <= max_tokens:
+            units.append((paragraph_offset, paragraph_offset + len(paragraph)))
         else:
-            full_sentence_context = segment_text[full_sentence_context_start_pos:full_sentence_context_end_pos]
-            snippet_start_pos = full_sentence_context_start_pos + full_sentence_context.find(snippet)
-            snippet_end_pos = snippet_start_pos + len(snippet)
-        
-        if snippet_start_pos == -1:
-            logger.warning(f"Original snippet not found in user submission: {sentence_context}")
+            units.extend((offset, offset + len(sentence)) for sentence, offset in split_text_into_sentences(text, [(paragraph, paragraph_offset)]))
+
+    chunks: List[Tuple[str, int, int]] = []
+    first_unit = 0
+    while first_unit < len(units):
+        # Trailing units of the previous chunk that fit into the overlap budget, but at most half the chunk.
+        overlap_start = units[first_unit][0]
+        if chunks and overlap_tokens > 0:
+            overlap_unit = first_unit
+            while overlap_unit > 0 and estimate_token_count(text[units[overlap_unit - 1][0]:units[first_unit][0]]) <= min(overlap_tokens, max_tokens // 2):
+                overlap_unit -= 1
+            # The overlap gives way to the first new unit if both do not fit.
+            while overlap_unit < first_unit and estimate_token_count(text[units[overlap_unit][0]:units[first_unit][1]]) > max_tokens:
+                overlap_unit += 1
+            overlap_start = max(units[overlap_unit][0], chunks[-1][1])
+
+        last_unit = first_unit
+        while last_unit + 1 < len(units) and estimate_token_count(text[overlap_start:units[last_unit + 1][1]]) <= max_tokens:
+            last_unit += 1
+
+        chunk_end = units[last_unit][1]
+        chunks.append((text[overlap_start:chunk_end], overlap_start, units[first_unit][0] - overlap_start))
+        first_unit = last_unit + 1
+    return chunks
+
+
+def match_unchanged_paragraphs(old_paragraphs: List[Tuple[str, int]], new_paragraphs: List[Tuple[str, int]]) -> Dict[int, int]:
+    """
+    Diffs two outputs of split_text_into_paragraphs and maps every paragraph of the
+    new text that is unchanged to its index in the old text. Inserted, deleted and
+    reordered paragraphs are handled by the underlying longest-matching-block diff.
+
+    Args:
+        old_paragraphs: The (paragraph_text, start_offset) list of the previous text.
+        new_paragraphs: The (paragraph_text, start_offset) list of the new text.
+
+    Returns:
+        A dict mapping new paragraph index -> old paragraph index for unchanged paragraphs.
+    """
+    matcher = difflib.SequenceMatcher(
+        a=[paragraph for paragraph, _ in old_paragraphs],
+        b=[paragraph for paragraph, _ in new_paragraphs],
+        autojunk=False
+    )
+    unchanged: Dict[int, int] = {}
+    for tag, old_start, old_end, new_start, _ in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(old_end - old_start):
+                unchanged[new_start + offset] = old_start + offset
+    return unchanged
+
+
+def build_rich_segments(original_text: str, located_issues: List[Tuple[int, int, RichSegmentIssue]], text_offset: int = 0) -> List[RichSegment]:
+    """
+    Cuts the text at every issue boundary and attaches to each segment the issues covering it.
+    Sweep line over the sorted boundaries: each issue is added to the active set at its start
+    boundary and removed at its end boundary, so the cost is O((n + k) log n) for n issues and
+    k (segment, issue) pairs, instead of checking every issue for every segment.
+
+    Args:
+        original_text: The full text of the correction, or the window of it starting at text_offset.
+        located_issues: (start_char, end_char, issue) tuples; issues that could not be located
+            (e.g. (-1, -1)) are ignored. Issues of a segment keep the order of this list.
+        text_offset: Offset of original_text in the full text. Issue and segment offsets are
+            always in the full text; issues must lie within the window.
+
+    Returns:
+        The list of RichSegment covering the text, sorted by start_char.
+    """
+    located = [(start, end, issue) for start, end, issue in located_issues
+               if start is not None and end >= 0 and start < end]
+    points = {text_offset, text_offset + len(original_text)}
+    for start, end, _ in located:
+        points.add(start)
+        points.add(end)
+    sorted_points = sorted(points)
+
+    starting_at: List[List[int]] = [[] for _ in sorted_points]
+    ending_at: List[List[int]] = [[] for _ in sorted_points]
+    for order, (start, end, _) in enumerate(located):
+        starting_at[bisect_left(sorted_points, start)].append(order)
+        ending_at[bisect_left(sorted_points, end)].append(order)
+
+    rich_segments: List[RichSegment] = []
+    active = set()
+    for i in range(len(sorted_points) - 1):
+        active.difference_update(ending_at[i])
+        active.update(starting_at[i])
+        start_char, end_char = sorted_points[i], sorted_points[i + 1]
+        rich_segments.append(RichSegment(
+            text=original_text[start_char - text_offset:end_char - text_offset],
+            start_char=start_char,
+            end_char=end_char,
+            issues=[located[order][2] for order in sorted(active)]
+        ))
+
+    return rich_segments
+
+
+# LLMs echo snippets with typographic quotes and dashes swapped for plain ones (or vice versa).
+_CHARACTER_NORMALIZATION = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"', "\u2033": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+})
+# Whitespace that does not map 1:1 to a single space in the normalized text.
+_COLLAPSED_WHITESPACE = re.compile(r'\s{2,}|[^\S ]')
+_WORD = re.compile(r'\w+')
+
+FUZZY_MAX_QUERY_CHARS = 1000 # Longer snippets/contexts are only matched exactly.
+FUZZY_MIN_SIMILARITY = 0.85 # Share of the query's characters that must align with the text.
+FUZZY_MAX_CANDIDATES = 3 # Candidate regions aligned per query, picked by word votes.
+FUZZY_MAX_WORD_OCCURRENCES = 50 # Words more frequent than this (e.g. "the") do not vote.
+# Scanning the text with str.find beats checking index hits in Python once a word occurs more often than every ~N chars.
+INDEX_MIN_CHARS_PER_OCCURRENCE = 64
+
+
+def normalize_for_matching(text: str) -> str:
+    """Normalizes quotes and dashes and collapses whitespace runs to a single space."""
+    return _COLLAPSED_WHITESPACE.sub(" ", text.translate(_CHARACTER_NORMALIZATION)).strip()
+
+
+class SegmentSnippetLocator:
+    """
+    Locates the snippets the LLM reports for one segment (the text of a correction step).
+
+    The segment is normalized once (see normalize_for_matching) together with a piecewise map back
+    to the original offsets, and its words are indexed, so a lookup costs a few dictionary probes
+    instead of a scan of the segment. Lookups are stateful: a snippet that occurs several times is
+    assigned to a different occurrence on every call, in text order, instead of always the first.
+    If there is no exact match, a bounded fuzzy alignment around the best word-vote candidates is tried.
+    If the segment starts with an overlap owned by the previous segment, snippets are looked up from
+    owned_start_char (relative to the segment) first, and in the overlap only if nothing matches there.
+
+    Usage:
+        locator = SegmentSnippetLocator(segment_text, segment_global_start_offset)
+        for issue in issues:
+            start_char, end_char = locator.locate(issue.snippet, issue.sentence_context)
+    """
+
+    def __init__(self, segment_text: str, segment_global_start_offset: int, owned_start_char: int = 0):
+        self.segment_text = segment_text
+        self.segment_global_start_offset = segment_global_start_offset
+        self._claimed: set = set()
+        self._postings: Optional[Dict[str, List[int]]] = None
+
+        # Pieces of the normalized text: (normalized start, original start, original end of a collapsed
+        # whitespace run or None if the piece maps 1:1).
+        translated = segment_text.translate(_CHARACTER_NORMALIZATION)
+        normalized_parts: List[str] = []
+        self._piece_starts: List[int] = [0]
+        self._pieces: List[Tuple[int, Optional[int]]] = [(0, None)]
+        normalized_length, original_offset = 0, 0
+        for run in _COLLAPSED_WHITESPACE.finditer(translated):
+            normalized_parts.append(translated[original_offset:run.start()])
+            normalized_length += run.start() - original_offset
+            self._piece_starts.append(normalized_length)
+            self._pieces.append((run.start(), run.end()))
+            normalized_parts.append(" ")
+            normalized_length += 1
+            original_offset = run.end()
+            self._piece_starts.append(normalized_length)
+            self._pieces.append((original_offset, None))
+        normalized_parts.append(translated[original_offset:])
+        self.normalized_text = "".join(normalized_parts)
+        self._owned_start = self._to_normalized(owned_start_char)
+
+    def locate(self, snippet: str, sentence_context: str) -> Tuple[int, int]:
+        """
+        Returns the global (start_char, end_char) of the snippet, looked up inside its sentence
+        context first and in the whole segment otherwise, or (-1, -1) if it cannot be found.
+        """
+        normalized_snippet = normalize_for_matching(snippet)
+        if not normalized_snippet:
+            return -1, -1
+        normalized_context = normalize_for_matching(sentence_context or "")
+
+        span = self._locate_from(normalized_snippet, normalized_context, self._owned_start)
+        if span is None and self._owned_start > 0:
+            span = self._locate_from(normalized_snippet, normalized_context, 0)
+        if span is None:
+            logger.warning(f"Original snippet not found in user submission: {snippet} ({sentence_context})")
             return -1, -1
-        
-        global_snippet_start_pos = segment_global_start_offset + snippet_start_pos
-        global_snippet_end_pos = segment_global_start_offset + snippet_end_pos
 
-        return global_snippet_start_pos, global_snippet_end_pos
+        start_char, end_char = self._to_original(*span)
+        return self.segment_global_start_offset + start_char, self.segment_global_start_offset + end_char
+
+    def _locate_from(self, normalized_snippet: str, normalized_context: str, lo: int) -> Optional[Tuple[int, int]]:
+        """The span of the snippet within normalized_text[lo:], found in its context if possible."""
+        text_end = len(self.normalized_text)
+        context_spans = list(self._iter_occurrences(normalized_context, lo, text_end)) if normalized_context else []
+        if normalized_context and not context_spans:
+            fuzzy_context = self._find_fuzzy(normalized_context, lo, text_end)
+            context_spans = [fuzzy_context] if fuzzy_context else []
+
+        span = self._claim((occurrence for start, end in context_spans for occurrence in self._iter_occurrences(normalized_snippet, start, end)))
+        if span is None:
+            span = self._claim(self._iter_occurrences(normalized_snippet, lo, text_end))
+        if span is None:
+            fuzzy_snippets = (self._find_fuzzy(normalized_snippet, start, end) for start, end in context_spans or [(lo, text_end)])
+            span = self._claim(fuzzy_snippet for fuzzy_snippet in fuzzy_snippets if fuzzy_snippet is not None)
+        return span
+
+    def _claim(self, spans: Iterator[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+        """
+        Assigns the first span not assigned yet, so repeated snippets (e.g. the same typo twice) go to
+        distinct occurrences; falls back to the first span if all are taken. Consumes spans lazily.
+        """
+        first = None
+        for span in spans:
+            if span not in self._claimed:
+                self._claimed.add(span)
+                return span
+            first = first or span
+        return first
+
+    def _iter_occurrences(self, query: str, lo: int, hi: int) -> Iterator[Tuple[int, int]]:
+        """Exact occurrences of a normalized query within normalized_text[lo:hi], in text order."""
+        words = list(_WORD.finditer(query))
+        # Words not touching the ends of the query are whole words in every occurrence, so they can be looked up.
+        inner_words = [word for word in words if word.start() > 0 and word.end() < len(query)]
+        if inner_words:
+            anchor = min(inner_words, key=lambda word: len(self._get_postings(word.group())))
+            postings = self._get_postings(anchor.group())
+            first, last = bisect_left(postings, lo + anchor.start()), bisect_left(postings, hi)
+            if (last - first) * INDEX_MIN_CHARS_PER_OCCURRENCE <= hi - lo:
+                for word_start in postings[first:last]:
+                    start = word_start - anchor.start()
+                    if start + len(query) <= hi and self.normalized_text.startswith(query, start):
+                        yield start, start + len(query)
+                return
+
+        position = self.normalized_text.find(query, lo, hi)
+        while position != -1:
+            yield position, position + len(query)
+            position = self.normalized_text.find(query, position + 1, hi)
+
+    def _find_fuzzy(self, query: str, lo: int, hi: int) -> Optional[Tuple[int, int]]:
+        """An approximate occurrence of a normalized query within normalized_text[lo:hi], if similar enough."""
+        if len(query) > FUZZY_MAX_QUERY_CHARS:
+            return None
+
+        slack = len(query) // 4 + 8
+        if hi - lo <= 2 * len(query) + slack:
+            windows = [(lo, hi)]
+        else:
+            # Every word of the query votes for where the query would start if that word matched.
+            bucket_size = max(16, len(query) // 2)
+            votes: Dict[int, int] = {}
+            for word in _WORD.finditer(query):
+                for word_start in self._postings_between(word.group(), lo, hi, limit=FUZZY_MAX_WORD_OCCURRENCES):
+                    bucket = (word_start - word.start()) // bucket_size
+                    votes[bucket] = votes.get(bucket, 0) + 1
+            best_buckets = sorted(votes, key=votes.get, reverse=True)[:FUZZY_MAX_CANDIDATES]
+            windows = [(max(lo, bucket * bucket_size - slack), min(hi, (bucket + 1) * bucket_size + len(query) + slack))
+                       for bucket in best_buckets]
 
-    except ValueError:
-        logger.warning(f"Snippet {snippet} not found in segment: {segment_text}")
-        return -1, -1
+        # Windows are tried from the most voted; the first one that aligns well enough wins.
+        min_matched = FUZZY_MIN_SIMILARITY * len(query)
+        for window_lo, window_hi in windows:
+            matcher = difflib.SequenceMatcher(None, self.normalized_text[window_lo:window_hi], query, autojunk=False)
+            # quick_ratio() bounds the number of matching characters from above at a fraction of the cost.
+            if matcher.quick_ratio() * (window_hi - window_lo + len(query)) / 2 < min_matched:
+                continue
+            blocks = [block for block in matcher.get_matching_blocks() if block.size > 0]
+            if not blocks or sum(block.size for block in blocks) < min_matched:
+                continue
+            # Unmatched characters at the ends of the query still belong to the span.
+            start = max(window_lo, window_lo + blocks[0].a - blocks[0].b)
+            end = min(window_hi, window_lo + blocks[-1].a + blocks[-1].size + len(query) - blocks[-1].b - blocks[-1].size)
+            return start, end
+        return None
+
+    def _get_postings(self, word: str) -> List[int]:
+        if self._postings is None:
+            self._postings = {}
+            for match in _WORD.finditer(self.normalized_text):
+                self._postings.setdefault(match.group(), []).append(match.start())
+        return self._postings.get(word, [])
+
+    def _postings_between(self, word: str, lo: int, hi: int, limit: Optional[int] = None) -> List[int]:
+        """Start offsets of a word within [lo, hi); none at all if there are more than limit."""
+        postings = self._get_postings(word)
+        first, last = bisect_left(postings, lo), bisect_left(postings, hi)
+        if limit is not None and last - first > limit:
+            return []
+        return postings[first:last]
+
+    def _to_normalized(self, position: int) -> int:
+        """Maps a position in segment_text to normalized_text; inside a collapsed whitespace run, to the character after it."""
+        piece = bisect_right([original_start for original_start, _ in self._pieces], position) - 1
+        original_start, collapsed_end = self._pieces[piece]
+        if collapsed_end is not None:
+            return self._piece_starts[piece] + (1 if position > original_start else 0)
+        return self._piece_starts[piece] + position - original_start
+
+    def _to_original(self, start: int, end: int) -> Tuple[int, int]:
+        """Maps a span of normalized_text back to a span of segment_text."""
+        def original_position(position: int, is_end: bool) -> int:
+            piece = bisect_right(self._piece_starts, position) - 1
+            original_start, collapsed_end = self._pieces[piece]
+            if collapsed_end is not None:
+                return collapsed_end if is_end else original_start
+            return original_start + position - self._piece_starts[piece] + (1 if is_end else 0)
+
+        return original_position(start, is_end=False), original_position(end - 1, is_end=True)
+
+
+def locate_snippet_in_segment(segment_text: str, segment_global_start_offset: int, snippet: str, sentence_context: str) -> Tuple[int, int]:
+    """
+    Locates a single snippet, see SegmentSnippetLocator. Use a locator directly to look up all
+    snippets of a segment, which reuses its index and spreads repeated snippets over their occurrences.
+    """
+    return SegmentSnippetLocator(segment_text, segment_global_start_offset).locate(snippet, sentence_context)
 
 if __name__ == "__main__":
     text = """
@@ -99,4 +483,4 @@ if __name__ == "__main__":
 
     print(split_text_into_paragraphs(text))
 
-    print(locate_snippet_in_segment(text, 0, "Beljfheljrh."))
\ No newline at end of file
+    print(locate_snippet_in_segment(text, 0, "Beljfheljrh", "This is a test. Beljfheljrh"))
\ No newline at end of file
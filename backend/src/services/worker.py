@@ -0,0 +1,138 @@
+from typing import Optional, Set, Dict, List
+import asyncio
+import signal
+import socket
+import uuid
+import os
+
+from src.utils import logger, get_async_db_context, async_engine
+from src.services.correction import AsyncCorrectionService
+from src.services.job_queue import JobQueue
+from config import (
+    JOB_LEASE_SECONDS, JOB_HEARTBEAT_SECONDS, JOB_MAX_ATTEMPTS, WORKER_POLL_SECONDS,
+    WORKER_MAX_IN_FLIGHT_STEPS, WORKER_DRAIN_TIMEOUT_SECONDS
+)
+
+
+class CorrectionWorker:
+    """
+    Polls the job queue for pending correction steps, runs them through CorrectionService and
+    marks corrections completed once all their steps are done. Any number of workers (processes
+    or nodes) can run against the same database.
+    """
+
+    def __init__(self, llm_model_name: str, worker_id: Optional[str] = None,
+                 max_in_flight_steps: int = WORKER_MAX_IN_FLIGHT_STEPS,
+                 poll_interval: float = WORKER_POLL_SECONDS,
+                 heartbeat_interval: float = JOB_HEARTBEAT_SECONDS,
+                 drain_timeout: float = WORKER_DRAIN_TIMEOUT_SECONDS):
+        self.llm_model_name = llm_model_name
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.max_in_flight_steps = max_in_flight_steps
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.drain_timeout = drain_timeout
+        self.queue = JobQueue(worker_id=self.worker_id, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
+
+        self._batches: Dict[asyncio.Task, List[int]] = {}
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def in_flight_step_ids(self) -> Set[int]:
+        return {step_id for step_ids in self._batches.values() for step_id in step_ids}
+
+    def stop(self):
+        """Stops claiming new steps; in-flight steps are drained before run() returns."""
+        if self._stopping is not None and not self._stopping.is_set():
+            logger.info(f"Worker {self.worker_id} draining {len(self.in_flight_step_ids)} in-flight steps")
+            self._stopping.set()
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        logger.info(f"Worker {self.worker_id} started")
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await self._requeue_and_finalize()
+                    await self._claim_and_start()
+                except Exception as e:
+                    # E.g. the database is not reachable yet; keep polling.
+                    logger.error(f"Worker {self.worker_id} poll failed: {e}")
+
+                waiters = [asyncio.create_task(self._stopping.wait()), *self._batches]
+                await asyncio.wait(waiters, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                waiters[0].cancel()
+                self._reap_finished_batches()
+        finally:
+            await self._drain()
+            heartbeat_task.cancel()
+            await async_engine.dispose()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    async def _claim_and_start(self):
+        capacity = self.max_in_flight_steps - len(self.in_flight_step_ids)
+        if capacity <= 0:
+            return
+
+        async with get_async_db_context() as db:
+            step_ids = await db.run_sync(self.queue.claim_steps, limit=capacity)
+        if step_ids:
+            logger.debug(f"Worker {self.worker_id} claimed {len(step_ids)} steps")
+            task = asyncio.create_task(self._run_steps(step_ids))
+            self._batches[task] = step_ids
+
+    async def _run_steps(self, step_ids: List[int]):
+        async with get_async_db_context() as db:
+            correction_service = AsyncCorrectionService(db=db, llm_model_name=self.llm_model_name)
+            await correction_service.run_correction_steps(correction_step_ids=step_ids, lease_owner=self.worker_id)
+
+    def _reap_finished_batches(self):
+        for task in [task for task in self._batches if task.done()]:
+            step_ids = self._batches.pop(task)
+            if not task.cancelled() and task.exception() is not None:
+                # The steps stay leased and are requeued once the lease expires.
+                logger.error(f"Worker {self.worker_id} failed to run steps {step_ids}: {task.exception()}")
+
+    async def _requeue_and_finalize(self):
+        async with get_async_db_context() as db:
+            await db.run_sync(self.queue.requeue_orphaned_steps)
+            correction_ids = await db.run_sync(self.queue.claim_finished_corrections, limit=100)
+            if correction_ids:
+                await AsyncCorrectionService(db=db, llm_model_name=self.llm_model_name).finalize_corrections(correction_ids=correction_ids)
+                logger.info(f"Worker {self.worker_id} completed corrections {correction_ids}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                async with get_async_db_context() as db:
+                    await db.run_sync(self.queue.heartbeat, step_ids=list(self.in_flight_step_ids))
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} heartbeat failed: {e}")
+
+    async def _drain(self):
+        claimed_step_ids = list(self.in_flight_step_ids)
+        if self._batches:
+            _, pending = await asyncio.wait(list(self._batches), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+            self._reap_finished_batches()
+
+        try:
+            # Unfinished steps go straight back to the queue instead of waiting for their lease to expire.
+            async with get_async_db_context() as db:
+                released = await db.run_sync(self.queue.release_steps, step_ids=claimed_step_ids)
+            if released:
+                logger.info(f"Worker {self.worker_id} released {released} unfinished steps")
+            await self._requeue_and_finalize()
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} failed to release its steps: {e}")
@@ -1,10 +1,19 @@
-from contextlib import contextmanager
-from sqlalchemy import create_engine
+from contextlib import contextmanager, asynccontextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool, NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from typing import Generator, AsyncGenerator, List, Optional, Dict, Any
+import threading
 import logging
+import time
 
-from config import SQLALCHEMY_DATABASE_URL
+from config import (
+    SQLALCHEMY_DATABASE_URL, SQLALCHEMY_ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_RECYCLE_SECONDS, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS, DB_PGBOUNCER_MODE
+)
 from src.models import Base
 
 
@@ -19,9 +28,100 @@ logger = logging.getLogger('database')
 logger.setLevel(logging.DEBUG)
 
 
+class PoolMetrics:
+    """Counts checkouts of a pool and how long they waited for a free connection, see TimedQueuePool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, wait_seconds: float, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def stats(self, pool: Pool) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "pool_class": type(pool).__name__,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts > 0 else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0))
+        return stats
+
+
+class _TimedPoolMixin:
+    """Times every checkout from the pool's queue, which is where QueuePool limit timeouts come from."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # Keeps the counters when the pool is recreated, e.g. by engine.dispose().
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started, timed_out=False)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_options(is_async: bool) -> Dict[str, Any]:
+    """Pool and connection settings from config.py for the sync (psycopg2) or async (asyncpg) engine."""
+    if DB_PGBOUNCER_MODE:
+        # PgBouncer pools the server connections; prepared statements do not survive its transaction pooling.
+        connect_args = {"statement_cache_size": 0, "prepared_statement_cache_size": 0} if is_async else {}
+        return {"poolclass": NullPool, "connect_args": connect_args}
+
+    if DB_STATEMENT_TIMEOUT_MS > 0 and is_async:
+        connect_args = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    elif DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    else:
+        connect_args = {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
+
 # Create engine with psycopg2
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    **_engine_options(is_async=False)
 )
 
 def init_db():
@@ -30,6 +130,33 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created successfully!")
 
+# create_all only creates missing tables, so changes to existing tables are applied here; each one is idempotent.
+SCHEMA_UPGRADES = [
+    # Steps store the span of their input in the correction's text instead of a copy of it (input_text_sent_to_llm).
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'correction_steps' AND column_name = 'input_text_sent_to_llm') THEN
+            ALTER TABLE correction_steps ADD COLUMN IF NOT EXISTS original_text_end_char integer;
+            UPDATE correction_steps SET original_text_end_char = original_text_start_char + length(input_text_sent_to_llm)
+            WHERE original_text_end_char IS NULL;
+            ALTER TABLE correction_steps ALTER COLUMN original_text_end_char SET NOT NULL;
+            ALTER TABLE correction_steps DROP COLUMN input_text_sent_to_llm;
+        END IF;
+    END $$;
+    """,
+]
+
+def upgrade_db():
+    """Brings the tables of a database created by an earlier version up to date with src/models.py."""
+    logger.info("Upgrading database tables...")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+    logger.info("Database tables upgraded successfully!")
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -61,3 +188,95 @@ def get_db_context() -> Generator[Session, None, None]:
         raise e
     finally:
         db.close()
+
+
+# Create async engine with asyncpg, used by the API and the workers
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL,
+    **_engine_options(is_async=True)
+)
+
+# Objects stay usable after commit; with an AsyncSession an expired attribute cannot be lazy-loaded.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Get an async database session.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+@asynccontextmanager
+async def get_async_db_context() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Async context manager for database sessions, committed on exit.
+    Usage:
+        async with get_async_db_context() as db:
+            # use db session
+            await db.commit()
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Connection pool statistics of this process, per engine."""
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        metrics = getattr(pool, "metrics", None)
+        stats[name] = metrics.stats(pool) if metrics is not None else {"pool_class": type(pool).__name__}
+    return stats
+
+
+class QueryCounter:
+    """Records the SQL statements executed on an engine while active, see count_queries."""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind: Optional[Engine] = None) -> Generator[QueryCounter, None, None]:
+    """
+    Counts the statements sent to the database inside the block.
+    Usage:
+        with count_queries() as counter:
+            service.get_correction_status(correction_id)
+        print(counter.count)
+    """
+    bind = bind or engine
+    # Statements of an AsyncEngine are executed by its underlying sync engine.
+    bind = getattr(bind, "sync_engine", bind)
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, bind: Optional[Engine] = None) -> Generator[QueryCounter, None, None]:
+    """
+    Fails if the block sends more than max_queries statements, to catch N+1 regressions.
+    Usage:
+        with assert_max_queries(1):
+            service.get_correction_status(correction_id)
+    """
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count > max_queries:
+        executed = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {max_queries} queries, got {counter.count}:\n{executed}")
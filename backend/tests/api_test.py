@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from src.api import _accepts_gzip, _etag_matches
+from src.models import InputGranularityEnum
+from src.services.prompt_registry import prompt_registry
+
+
+@pytest.fixture
+def client(database):
+    # Entered, so that every request runs on the same event loop as the app's lifespan and connection pool.
+    with TestClient(app) as client:
+        yield client
+
+
+def test_prompts_are_not_sent_again_until_they_change(client, make_prompts, monkeypatch):
+    monkeypatch.setattr(prompt_registry, "refresh_seconds", 0)
+    make_prompts(InputGranularityEnum.PARAGRAPH)
+    response = client.get("/api/v1/prompts")
+    etag = response.headers["ETag"]
+    assert [prompt["prompt_id_ref"] for prompt in response.json()["prompts"]] == ["test_paragraph"]
+
+    response = client.get("/api/v1/prompts", headers={"If-None-Match": etag})
+    assert (response.status_code, response.content, response.headers["ETag"]) == (304, b"", etag)
+
+    make_prompts(InputGranularityEnum.WHOLE_TEXT)
+    response = client.get("/api/v1/prompts", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert len(response.json()["prompts"]) == 2
+
+
+def vary_tokens(response):
+    return {token.strip() for token in response.headers["Vary"].split(",")}
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, False), ("", False), ("identity", False), ("gzip", True), ("deflate, gzip;q=0.5", True), ("GZIP", True),
+    ("gzip;q=0", False), ("*", True), ("*;q=0", False), ("gzip;q=0, *", False), ("br, *;q=0.1", True), ("gzip;q=abc", False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert _accepts_gzip(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, False), ("", False), ('"abc"', True), ('W/"abc"', True), ('"other", "abc"', True), ("*", True), ('"other"', False), ('"abc-gzip"', False),
+])
+def test_etag_matches(if_none_match, expected):
+    assert _etag_matches(if_none_match, '"abc"') == expected
+
+
+def test_completed_results_are_served_from_the_snapshot(client, service, create_completed_correction, make_document):
+    correction_id = create_completed_correction(make_document(5))
+    url = f"/api/v1/corrections/{correction_id}/results"
+
+    gzipped = client.get(url, headers={"Accept-Encoding": "gzip"})
+    identity = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert gzipped.status_code == identity.status_code == 200
+    assert gzipped.headers["Content-Encoding"] == "gzip" and "Content-Encoding" not in identity.headers
+    # Both representations hold the same results, under ETags of their own.
+    assert gzipped.json() == identity.json() and identity.json()["rich_segments"]
+    assert gzipped.headers["ETag"] != identity.headers["ETag"]
+    # GZipMiddleware lists Accept-Encoding again on the uncompressed response, which is still the same Vary.
+    assert vary_tokens(gzipped) == vary_tokens(identity) == {"Accept-Encoding"}
+    # The stored bytes are sent as is, not compressed again.
+    with client.stream("GET", url, headers={"Accept-Encoding": "gzip"}) as response:
+        body = b"".join(response.iter_raw())
+    assert body == service.get_results_snapshot(correction_id=correction_id).body
+    assert gzip.decompress(body) == identity.content
+
+    for response in (gzipped, identity):
+        encoding = response.headers.get("Content-Encoding", "identity")
+        not_modified = client.get(url, headers={"Accept-Encoding": encoding, "If-None-Match": response.headers["ETag"]})
+        assert (not_modified.status_code, not_modified.content, not_modified.headers["ETag"]) == (304, b"", response.headers["ETag"])
+    # The ETag of the other representation does not match.
+    response = client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["ETag"]})
+    assert response.status_code == 200
+
+
+def test_pending_results_have_no_etag(client, service, prompt_id_refs, make_document):
+    correction_id = service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs).correction_id
+    response = client.get(f"/api/v1/corrections/{correction_id}/results", headers={"If-None-Match": "*"})
+    assert response.status_code == 200 and "ETag" not in response.headers
+    assert response.json()["status"] == "pending"
+    assert client.get("/api/v1/corrections/0/results").status_code == 404
+
+
+def test_results_windows_over_the_api(client, create_completed_correction, make_document):
+    correction_id = create_completed_correction(make_document(5))
+    url = f"/api/v1/corrections/{correction_id}/results"
+
+    page = client.get(url, params={"limit": 2, "include_text": "false"}).json()
+    assert len(page["rich_segments"]) == 2 and page["original_text"] is None
+    next_page = client.get(url, params={"limit": 2, "include_text": "false", "cursor": page["next_cursor"]}).json()
+    assert next_page["rich_segments"][0]["start_char"] == page["next_cursor"]
+
+    assert client.get(url, params={"start_char": 0, "paragraph_end": 2}).status_code == 400
+    assert client.get(url, params={"limit": 0}).status_code == 422
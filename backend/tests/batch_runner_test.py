@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import select
+
+import src.services.llm_interaction as llm_interaction_module
+from src.models import BatchJob, BatchJobStatusEnum, Correction, CorrectionStatusEnum, CorrectionStep, InputGranularityEnum
+from src.services.batch_runner import BATCH_LEASE_OWNER, BatchRunner
+from src.services.llm_backends import MockBackend
+from src.services.llm_cache import llm_response_cache
+from src.utils import get_db_context
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """The file-based mock batch backend, with batches that finish as soon as they are submitted."""
+    backend = MockBackend(latency_median_seconds=0.0, latency_sigma=0.0, error_rate=0.0, rate_limit_rate=0.0, batch_seconds=0.0)
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    # Every step goes into the batch instead of being answered by earlier runs.
+    monkeypatch.setattr(llm_response_cache, "enabled", False)
+    return backend
+
+
+@pytest.fixture
+def runner(database, backend, tmp_path):
+    with get_db_context() as db:
+        yield BatchRunner(db=db, llm_model_name="mock", batch_dir=str(tmp_path), poll_interval=0.01)
+
+
+@pytest.fixture
+def correction_ids(runner, make_prompts, make_document):
+    prompt_id_refs = make_prompts(InputGranularityEnum.PARAGRAPH)
+    return [runner.service.create_new_correction(original_text=make_document(paragraphs=3, words_per_paragraph=30, seed=seed),
+                                                 prompt_id_refs=prompt_id_refs).correction_id
+            for seed in range(2)]
+
+
+def get_steps(runner: BatchRunner, correction_ids):
+    runner.db.expire_all()
+    return runner.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id.in_(correction_ids))).all()
+
+
+def test_submit_leases_only_the_given_corrections(run, runner, correction_ids):
+    job_ids = run(runner.submit(correction_ids=correction_ids[:1]))
+
+    assert len(job_ids) == 1
+    job = runner.db.get(BatchJob, job_ids[0])
+    assert (job.status, job.step_count) == (BatchJobStatusEnum.SUBMITTED, 3)
+    submitted, other = get_steps(runner, correction_ids[:1]), get_steps(runner, correction_ids[1:])
+    assert {(step.lease_owner, step.batch_job_id) for step in submitted} == {(BATCH_LEASE_OWNER, job.batch_job_id)}
+    assert {(step.lease_owner, step.batch_job_id) for step in other} == {(None, None)}
+
+
+def test_run_ingests_and_completes_the_corrections(run, runner, correction_ids):
+    jobs = run(runner.run(correction_ids=correction_ids))
+
+    assert [(job.status, job.step_count) for job in jobs] == [(BatchJobStatusEnum.INGESTED, 6)]
+    assert {step.status for step in get_steps(runner, correction_ids)} == {CorrectionStatusEnum.COMPLETED}
+    statuses = runner.db.scalars(select(Correction.status).where(Correction.correction_id.in_(correction_ids))).all()
+    assert set(statuses) == {CorrectionStatusEnum.COMPLETED}
+
+
+def test_failed_steps_are_requeued_and_run_in_the_next_batch(run, runner, backend, correction_ids):
+    job_ids = run(runner.submit(correction_ids=correction_ids))
+    backend.error_rate = 1.0
+    for job in runner.db.scalars(select(BatchJob).where(BatchJob.batch_job_id.in_(job_ids))).all():
+        run(runner.poll(job))
+        assert (job.status, job.completed_steps, job.failed_steps) == (BatchJobStatusEnum.INGESTED, 0, job.step_count)
+
+    # Back in the job queue, with the attempt counted.
+    steps = get_steps(runner, correction_ids)
+    assert {(step.status, step.lease_owner, step.batch_job_id, step.attempts) for step in steps} == {(CorrectionStatusEnum.PENDING, None, None, 1)}
+
+    backend.error_rate = 0.0
+    run(runner.run(correction_ids=correction_ids))
+    steps = get_steps(runner, correction_ids)
+    assert {(step.status, step.attempts) for step in steps} == {(CorrectionStatusEnum.COMPLETED, 2)}
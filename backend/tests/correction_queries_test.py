@@ -0,0 +1,41 @@
+import pytest
+
+from src.models import CorrectionStatusEnum
+from src.utils import assert_max_queries
+
+# The read paths load a correction with a fixed number of statements, however many steps and issues it has
+# (see CorrectionRepository); each test runs on a short and a long document to catch per-step lazy loads.
+PARAGRAPH_COUNTS = [3, 30]
+
+
+@pytest.mark.parametrize("paragraphs", PARAGRAPH_COUNTS)
+def test_status_queries(service, prompt_id_refs, make_document, paragraphs):
+    correction_id = service.create_new_correction(original_text=make_document(paragraphs), prompt_id_refs=prompt_id_refs).correction_id
+    with assert_max_queries(1):
+        status = service.get_correction_status(correction_id=correction_id)
+    assert status.status == CorrectionStatusEnum.PENDING.value
+
+
+@pytest.mark.parametrize("paragraphs", PARAGRAPH_COUNTS)
+def test_results_queries(service, create_completed_correction, make_document, paragraphs):
+    correction_id = create_completed_correction(make_document(paragraphs))
+    with assert_max_queries(2):
+        results = service.get_correction_results(correction_id=correction_id)
+    assert sum(len(segment.issues) for segment in results.rich_segments) == (paragraphs + 1)
+    with assert_max_queries(1):
+        assert service.get_results_snapshot(correction_id=correction_id) is not None
+    with assert_max_queries(2):
+        service.get_correction_results_window(correction_id=correction_id, start_char=0, end_char=100, include_text=False)
+
+
+@pytest.mark.parametrize("paragraphs", PARAGRAPH_COUNTS)
+def test_revision_queries(service, create_completed_correction, make_document, paragraphs):
+    parent_text = make_document(paragraphs)
+    correction_id = create_completed_correction(parent_text)
+    edited_text = parent_text.replace("\n\n", "\n\nAn added paragraph.\n\n", 1)
+    # 3 to load the parent graph, 1 for the correction, at most 4 batched inserts of steps (one per set of
+    # non-null columns, as reused and pending steps differ) and 1 of the copied analysis results.
+    with assert_max_queries(9):
+        revision = service.create_revision(parent_correction_id=correction_id, original_text=edited_text)
+    # Every paragraph of the parent is reused; the added paragraph and the whole-text prompt are pending.
+    assert (revision.reused_steps, revision.pending_steps) == (paragraphs, 2)
@@ -0,0 +1,32 @@
+from sqlalchemy import select
+
+from src.models import CorrectionStep, CorrectionStatusEnum
+from src.services.text_utils import split_text_into_paragraphs
+
+
+def test_revision_shifts_the_results_of_reused_steps(service, create_completed_correction, make_document):
+    parent_text = make_document(4)
+    parent_id = create_completed_correction(parent_text)
+    parent_paragraphs = [paragraph for paragraph, _ in split_text_into_paragraphs(parent_text)]
+    # A paragraph inserted before the others shifts all of them; the last one is edited.
+    edited_text = "\n\n".join(["An inserted paragraph."] + parent_paragraphs[:3] + [parent_paragraphs[3] + " Edited."])
+
+    revision = service.create_revision(parent_correction_id=parent_id, original_text=edited_text)
+    assert (revision.reused_steps, revision.pending_steps) == (3, 3)
+
+    steps = service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == revision.correction_id)).all()
+    reused = [step for step in steps if step.status == CorrectionStatusEnum.COMPLETED]
+    assert sorted(step.paragraph_index for step in reused) == [1, 2, 3]
+    for step in reused:
+        assert edited_text[step.original_text_start_char:step.original_text_end_char] == parent_paragraphs[step.paragraph_index - 1]
+        [result] = step.analysis_results
+        assert result.original_text_start_char == step.original_text_start_char
+        assert edited_text[result.original_text_start_char:result.original_text_end_char] == result.snippet
+
+
+def test_revision_of_a_pending_correction_reuses_nothing(service, prompt_id_refs, make_document):
+    parent_text = make_document(3)
+    parent_id = service.create_new_correction(original_text=parent_text, prompt_id_refs=prompt_id_refs).correction_id
+
+    revision = service.create_revision(parent_correction_id=parent_id, original_text=parent_text)
+    assert (revision.reused_steps, revision.pending_steps) == (0, 4)
@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from sqlalchemy import select, update, func
+
+from src.models import CorrectionStep, CorrectionStatusEnum
+from src.services.job_queue import JobQueue
+
+
+def expire_leases(db, step_ids):
+    db.execute(update(CorrectionStep).where(CorrectionStep.correction_step_id.in_(step_ids))
+               .values(lease_expires_at=func.now() - timedelta(seconds=1)))
+    db.commit()
+
+
+def get_steps(db, step_ids):
+    db.expire_all()
+    return db.scalars(select(CorrectionStep).where(CorrectionStep.correction_step_id.in_(step_ids))
+                      .order_by(CorrectionStep.correction_step_id)).all()
+
+
+def test_claimed_steps_are_leased_once(service, prompt_id_refs, make_document):
+    service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs)
+    first, second = JobQueue("first", lease_seconds=60, max_attempts=3), JobQueue("second", lease_seconds=60, max_attempts=3)
+
+    claimed = first.claim_steps(service.db, limit=3)
+    assert len(claimed) == 3
+    rest = second.claim_steps(service.db, limit=10)
+    assert len(rest) == 1 and not set(rest) & set(claimed)
+    assert second.claim_steps(service.db, limit=10) == []
+
+    steps = get_steps(service.db, claimed)
+    assert all(step.lease_owner == "first" and step.attempts == 1 for step in steps)
+
+
+def test_claims_are_split_over_corrections(service, prompt_id_refs, make_document):
+    first_id = service.create_new_correction(original_text=make_document(5), prompt_id_refs=prompt_id_refs).correction_id
+    second_id = service.create_new_correction(original_text=make_document(5), prompt_id_refs=prompt_id_refs).correction_id
+
+    claimed = JobQueue("worker", lease_seconds=60, max_attempts=3).claim_steps(service.db, limit=4)
+    assert sorted(step.correction_id for step in get_steps(service.db, claimed)) == [first_id, first_id, second_id, second_id]
+
+
+def test_heartbeat_renews_only_own_pending_leases(service, prompt_id_refs, make_document):
+    service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs)
+    queue, other = JobQueue("worker", lease_seconds=60, max_attempts=3), JobQueue("other", lease_seconds=60, max_attempts=3)
+    claimed = queue.claim_steps(service.db, limit=2)
+    expire_leases(service.db, claimed)
+
+    assert other.heartbeat(service.db, claimed) == 0
+    assert queue.heartbeat(service.db, claimed) == 2
+    # Renewed leases are not requeued.
+    assert queue.requeue_orphaned_steps(service.db) == 0
+    assert all(step.lease_owner == "worker" for step in get_steps(service.db, claimed))
+
+    service.db.execute(update(CorrectionStep).where(CorrectionStep.correction_step_id == claimed[0])
+                       .values(status=CorrectionStatusEnum.COMPLETED))
+    service.db.commit()
+    assert queue.heartbeat(service.db, claimed) == 1
+
+
+def test_expired_leases_are_requeued_until_out_of_attempts(service, prompt_id_refs, make_document):
+    service.create_new_correction(original_text=make_document(1), prompt_id_refs=prompt_id_refs)
+    crashing, queue = JobQueue("crashing", lease_seconds=60, max_attempts=2), JobQueue("worker", lease_seconds=60, max_attempts=2)
+
+    claimed = crashing.claim_steps(service.db, limit=10)
+    assert queue.claim_steps(service.db, limit=10) == []
+    expire_leases(service.db, claimed)
+    assert queue.requeue_orphaned_steps(service.db) == 2
+    assert all(step.lease_owner is None for step in get_steps(service.db, claimed))
+
+    assert sorted(crashing.claim_steps(service.db, limit=10)) == sorted(claimed)
+    expire_leases(service.db, claimed)
+    assert queue.requeue_orphaned_steps(service.db) == 0
+    steps = get_steps(service.db, claimed)
+    assert all(step.status == CorrectionStatusEnum.FAILED and step.attempts == 2 for step in steps)
+    assert queue.claim_steps(service.db, limit=10) == []
+
+
+def test_released_steps_give_back_their_attempt(service, prompt_id_refs, make_document):
+    service.create_new_correction(original_text=make_document(1), prompt_id_refs=prompt_id_refs)
+    queue = JobQueue("worker", lease_seconds=60, max_attempts=1)
+    claimed = queue.claim_steps(service.db, limit=10)
+
+    assert JobQueue("other", lease_seconds=60, max_attempts=1).release_steps(service.db, claimed) == 0
+    assert queue.release_steps(service.db, claimed) == 2
+    steps = get_steps(service.db, claimed)
+    assert all(step.lease_owner is None and step.attempts == 0 for step in steps)
+    assert sorted(queue.claim_steps(service.db, limit=10)) == sorted(claimed)
+
+
+def test_failed_steps_are_requeued_until_out_of_attempts(service, prompt_id_refs, make_document):
+    service.create_new_correction(original_text=make_document(1), prompt_id_refs=prompt_id_refs)
+    queue = JobQueue("worker", lease_seconds=60, max_attempts=2)
+
+    claimed = queue.claim_steps(service.db, limit=10)
+    assert queue.requeue_failed_steps(service.db, claimed, error_message="backend error") == 2
+    assert sorted(queue.claim_steps(service.db, limit=10)) == sorted(claimed)
+    assert queue.requeue_failed_steps(service.db, claimed, error_message="backend error") == 0
+    steps = get_steps(service.db, claimed)
+    assert all(step.status == CorrectionStatusEnum.FAILED and step.error_message == "backend error" for step in steps)
+
+
+def test_finished_corrections_are_claimed_once_their_steps_are_done(service, prompt_id_refs, make_document):
+    correction_id = service.create_new_correction(original_text=make_document(1), prompt_id_refs=prompt_id_refs).correction_id
+    queue = JobQueue("worker", lease_seconds=60, max_attempts=2)
+    assert queue.claim_finished_corrections(service.db, limit=10) == []
+    service.db.rollback()
+
+    service.db.execute(update(CorrectionStep).where(CorrectionStep.correction_id == correction_id)
+                       .values(status=CorrectionStatusEnum.COMPLETED))
+    service.db.commit()
+    assert queue.claim_finished_corrections(service.db, limit=10) == [correction_id]
+    service.db.rollback()
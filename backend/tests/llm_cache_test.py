@@ -0,0 +1,43 @@
+from sqlalchemy import select
+
+from src.models import LLMResponseCacheEntry
+from src.services.llm_cache import LLMResponseCache
+from src.utils import count_queries, get_db_context
+
+RESPONSE = {"issues": []}
+
+
+def make_cache(touch_interval_seconds: float = 3600) -> LLMResponseCache:
+    return LLMResponseCache(enabled=True, ttl_seconds=3600, max_memory_entries=100, max_db_entries=1000, eviction_interval=1000,
+                            touch_interval_seconds=touch_interval_seconds)
+
+
+def get_hit_count(cache_key: str) -> int:
+    with get_db_context() as db:
+        return db.scalar(select(LLMResponseCacheEntry.hit_count).where(LLMResponseCacheEntry.cache_key == cache_key))
+
+
+def test_hits_are_touched_in_batches(database):
+    with get_db_context() as db:
+        make_cache().set(db, "key", "mock", RESPONSE)
+
+    # Another process: the first lookup reads the table, the next ones are served from memory; none of them writes.
+    cache = make_cache()
+    with get_db_context() as db, count_queries() as counter:
+        assert [cache.get(db, "key") for _ in range(3)] == [RESPONSE] * 3
+    assert counter.count == 1 and counter.statements[0].lstrip().startswith("SELECT")
+    assert (cache.db_hits, cache.memory_hits, get_hit_count("key")) == (1, 2, 0)
+
+    with get_db_context() as db:
+        cache.flush_touches(db)
+    assert get_hit_count("key") == 3
+
+
+def test_touches_are_flushed_by_lookups_after_the_interval(database):
+    with get_db_context() as db:
+        make_cache().set(db, "key", "mock", RESPONSE)
+
+    cache = make_cache(touch_interval_seconds=0)
+    with get_db_context() as db:
+        assert cache.get(db, "key") == RESPONSE
+    assert get_hit_count("key") == 1
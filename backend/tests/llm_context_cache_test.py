@@ -0,0 +1,124 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+import src.services.correction as correction_module
+import src.services.llm_interaction as llm_interaction_module
+from src.models import Correction, CorrectionStatusEnum, LLMContextCache
+from src.schemas.schemas_llm import SnippetIssuesRevisionList
+from src.services.correction import CorrectionService
+from src.services.fake_genai import FakeGenAIClient
+from src.services.llm_backends import GeminiBackend
+from src.services.llm_context_cache import LLMContextCacheManager, PromptContext
+from src.services.llm_interaction import LLMInteraction
+from src.utils import get_db_context
+
+DOCUMENT = "## TEXT:\n" + "Measurements of the participants were significant. " * 200
+INSTRUCTIONS = "Find the spelling errors in (the TEXT given before these instructions)."
+
+
+@pytest.fixture
+def client():
+    return FakeGenAIClient()
+
+
+@pytest.fixture
+def llm(client, monkeypatch):
+    # Every LLMInteraction of the test, including the ones release() makes to delete contents, talks to the fake client.
+    backend = GeminiBackend(client=client)
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    return LLMInteraction(model_name="gemini-context-cache-test")
+
+
+@pytest.fixture
+def correction_id(database):
+    with get_db_context() as db:
+        correction = Correction(original_text=DOCUMENT, status=CorrectionStatusEnum.PENDING)
+        db.add(correction)
+        db.flush()
+        return correction.correction_id
+
+
+def make_manager(ttl_seconds: int = 3600) -> LLMContextCacheManager:
+    return LLMContextCacheManager(enabled=True, min_tokens=1, min_uses=2, ttl_seconds=ttl_seconds)
+
+
+def test_context_is_uploaded_once_and_reused(run, client, llm, correction_id):
+    manager = make_manager()
+
+    async def steps():
+        # Concurrent steps share one upload; a later step references it without uploading again.
+        names = await asyncio.gather(*(manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT) for _ in range(3)))
+        names.append(await manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT))
+        for name in names:
+            await llm.get_validated_response(prompt=INSTRUCTIONS, response_model=SnippetIssuesRevisionList, cached_content=name)
+        return names
+
+    names = run(steps())
+    assert len(set(names)) == 1
+    assert client.usage.caches_created == 1
+    assert (manager.created, manager.reused) == (1, 1)
+    assert client.usage.requests == 4
+    assert client.usage.cached_content_tokens == 4 * client.cached_contents[names[0]].usage_metadata.total_token_count
+
+    # Another worker finds the upload in llm_context_caches.
+    other_manager = make_manager()
+    assert run(other_manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT)) == names[0]
+    assert (client.usage.caches_created, other_manager.reused) == (1, 1)
+
+    run(manager.release([correction_id]))
+    assert client.cached_contents == {}
+    with get_db_context() as db:
+        assert db.scalars(select(LLMContextCache).where(LLMContextCache.correction_id == correction_id)).first() is None
+
+
+def test_context_close_to_expiry_is_uploaded_again(run, client, llm, correction_id):
+    # Contexts expiring within a minute are not referenced any more (see _EXPIRY_MARGIN).
+    manager = make_manager(ttl_seconds=61)
+    first = run(manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT))
+    assert run(manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT)) == first
+
+    time.sleep(1.5)
+    second = run(manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT))
+    assert second != first
+    assert client.usage.caches_created == 2
+    with get_db_context() as db:
+        row = db.scalars(select(LLMContextCache).where(LLMContextCache.correction_id == correction_id)).one()
+        assert row.provider_cache_name == second
+        assert row.expires_at > datetime.now(timezone.utc) + timedelta(seconds=59)
+    run(manager.release([correction_id]))
+
+
+def test_expired_context_is_rejected_by_the_client(run, client, llm, correction_id):
+    manager = make_manager()
+    name = run(manager.get_or_create(llm, correction_id=correction_id, content=DOCUMENT))
+    client.cached_contents[name].expire_time = datetime.now(timezone.utc) - timedelta(seconds=1)
+    with pytest.raises(ValueError):
+        run(client.aio.models.generate_content(model=llm.backend_model_name, contents=INSTRUCTIONS,
+                                               config={"cached_content": name, "response_schema": SnippetIssuesRevisionList}))
+    run(manager.release([correction_id]))
+
+
+def test_failed_upload_falls_back_to_the_whole_prompt(run, client, llm, correction_id, monkeypatch):
+    async def failing_create(model, config=None):
+        raise RuntimeError("caching is not available for this model")
+
+    manager = make_manager()
+    monkeypatch.setattr(client.aio.caches, "create", failing_create)
+    monkeypatch.setattr(correction_module, "llm_context_caches", manager)
+
+    async def call():
+        with get_db_context() as db:
+            service = CorrectionService(db=db, llm_model_name=llm.model_name)
+            return await service._get_validated_response(llm=llm, correction_id=correction_id, prompt=DOCUMENT + "\n" + INSTRUCTIONS,
+                                                         response_model=SnippetIssuesRevisionList,
+                                                         context=PromptContext(content=DOCUMENT, prompt=INSTRUCTIONS))
+
+    result = run(call())
+    assert result is not None and result.response.issues
+    assert manager.failures == 1
+    assert client.usage.requests == 1
+    assert client.usage.cached_content_tokens == 0
@@ -0,0 +1,237 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from google.genai import errors as genai_errors
+from sqlalchemy import select, func
+
+import src.services.correction as correction_module
+import src.services.llm_interaction as llm_interaction_module
+import src.services.llm_scheduler as llm_scheduler_module
+from src.models import Correction, CorrectionStep, CorrectionStatusEnum, InputGranularityEnum, LLMResponseCacheEntry
+from src.schemas.schemas_llm import SnippetIssuesRevisionList
+from src.services.correction import CorrectionService
+from src.services.fake_genai import FakeGenAIClient, fake_llm_response
+from src.services.llm_backends import GeminiBackend, LLMBackendError, LLMRateLimitError, LLMResponseError, TokenUsage
+from src.services.llm_context_cache import LLMContextCacheManager, PromptContext
+from src.services.llm_interaction import LLMInteraction
+from src.services.llm_resilience import CircuitBreaker, LatencyTracker, LLMErrorClass, classify_error
+from src.services.llm_scheduler import LLMScheduler, LocalRateLimiter, per_process_concurrency
+from src.utils import get_db_context
+from config import LLM_MAX_ATTEMPTS, CONCURRENT_LLM_CALLS, LLM_MIN_CONCURRENCY
+
+PROMPT = "## TEXT:\nSomething interesting happened yesterday."
+
+
+class ScriptedBackend:
+    """Answers calls after the latency scripted for each call in turn, and fails those of the models in failing_models."""
+    supports_context_caching = False
+    supports_batch = False
+
+    def __init__(self, latencies=(), failing_models=()):
+        self.latencies = list(latencies)
+        self.failing_models = set(failing_models)
+        self.calls = []
+        self.cancelled = 0
+
+    async def generate(self, model, prompt, response_model, cached_content=None):
+        self.calls.append(model)
+        try:
+            await asyncio.sleep(self.latencies.pop(0) if self.latencies else 0.0)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if model in self.failing_models:
+            raise LLMBackendError(f"{model} is unavailable", status_code=400)
+        return fake_llm_response(response_model, prompt=prompt), TokenUsage(prompt_tokens=10, output_tokens=5)
+
+
+def make_scheduler(max_concurrency: int = 8, decrease_cooldown: float = 0.0) -> LLMScheduler:
+    return LLMScheduler(LocalRateLimiter(requests_per_minute=100_000, tokens_per_minute=10**9, burst=1000), max_concurrency=max_concurrency,
+                        min_concurrency=1, decrease_factor=0.5, decrease_cooldown=decrease_cooldown)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (genai_errors.ClientError(429, {"error": {"code": 429, "details": [{"retryDelay": "23s"}]}}), (LLMErrorClass.RATE_LIMIT, 23.0)),
+    (genai_errors.ClientError(429, {"error": {"code": 429}}), (LLMErrorClass.RATE_LIMIT, None)),
+    (LLMRateLimitError("slow down", retry_after=7.0), (LLMErrorClass.RATE_LIMIT, 7.0)),
+    (LLMBackendError("too many requests", status_code=429), (LLMErrorClass.RATE_LIMIT, None)),
+    (genai_errors.ServerError(503, {"error": {"code": 503}}), (LLMErrorClass.TRANSIENT, None)),
+    (LLMBackendError("bad gateway", status_code=502), (LLMErrorClass.TRANSIENT, None)),
+    (LLMBackendError("request timeout", status_code=408), (LLMErrorClass.TRANSIENT, None)),
+    (httpx.ConnectError("connection refused"), (LLMErrorClass.TRANSIENT, None)),
+    (asyncio.TimeoutError(), (LLMErrorClass.TRANSIENT, None)),
+    (genai_errors.ClientError(400, {"error": {"code": 400}}), (LLMErrorClass.PERMANENT, None)),
+    (genai_errors.ClientError(403, {"error": {"code": 403}}), (LLMErrorClass.PERMANENT, None)),
+    (LLMBackendError("not found", status_code=404), (LLMErrorClass.PERMANENT, None)),
+    (LLMResponseError("No response from LLM"), (LLMErrorClass.SCHEMA, None)),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0.05)
+    for _ in range(2):
+        breaker.record_failure()
+    assert (breaker.state, breaker.allow()) == (CircuitBreaker.CLOSED, True)
+
+    breaker.record_failure()
+    assert (breaker.state, breaker.allow(), breaker.times_opened) == (CircuitBreaker.OPEN, False, 1)
+
+    # After reset_seconds a single probe is let through; its failure opens the circuit again.
+    time.sleep(0.06)
+    assert (breaker.allow(), breaker.state) == (True, CircuitBreaker.HALF_OPEN)
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert (breaker.state, breaker.allow()) == (CircuitBreaker.OPEN, False)
+
+    # A successful probe closes it.
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert (breaker.state, breaker.consecutive_failures, breaker.allow()) == (CircuitBreaker.CLOSED, 0, True)
+    assert breaker.times_opened == 1
+
+
+def test_concurrency_limit_shrinks_on_429_and_recovers(run):
+    scheduler = make_scheduler(max_concurrency=8)
+    client = FakeGenAIClient()
+    llm = LLMInteraction(model_name="gemini-aimd-test", retry_delay=0.001, scheduler=scheduler)
+    llm.backend = GeminiBackend(client=client)
+
+    client.fail_next(genai_errors.ClientError(429, {"error": {"code": 429}}))
+    assert run(llm.get_validated_response(PROMPT, SnippetIssuesRevisionList)) is not None
+    # Halved by the 429, then a quarter of a call back for the successful retry.
+    assert (scheduler.concurrency_limit, scheduler.backoffs) == (4.25, 1)
+
+    scheduler.on_rate_limited()
+    scheduler.on_rate_limited()
+    scheduler.on_rate_limited()
+    assert scheduler.concurrency_limit == 1.0 # min_concurrency
+
+    # Additive increase: one more call per concurrency_limit successes, up to max_concurrency.
+    scheduler.on_success()
+    assert scheduler.concurrency_limit == 2.0
+    scheduler.on_success()
+    scheduler.on_success()
+    assert scheduler.concurrency_limit == pytest.approx(2.0 + 1 / 2 + 1 / 2.5)
+    for _ in range(100):
+        scheduler.on_success()
+    assert scheduler.concurrency_limit == 8.0
+
+
+def test_429s_within_the_cooldown_count_once():
+    scheduler = make_scheduler(max_concurrency=8, decrease_cooldown=60.0)
+    for _ in range(5):
+        scheduler.on_rate_limited()
+    assert (scheduler.concurrency_limit, scheduler.backoffs) == (4.0, 1)
+
+
+def test_processes_sharing_the_rate_limiter_split_the_concurrency_cap(monkeypatch):
+    monkeypatch.setattr(llm_scheduler_module, "LLM_RATE_LIMITER_BACKEND", "postgres")
+    assert [per_process_concurrency(processes) for processes in (1, 3, 100)] == [CONCURRENT_LLM_CALLS, CONCURRENT_LLM_CALLS // 3, LLM_MIN_CONCURRENCY]
+    monkeypatch.setattr(llm_scheduler_module, "LLM_RATE_LIMITER_BACKEND", "local")
+    assert per_process_concurrency(3) == CONCURRENT_LLM_CALLS
+
+    scheduler = make_scheduler(max_concurrency=8)
+    scheduler.set_max_concurrency(3)
+    assert (scheduler.max_concurrency, scheduler.concurrency_limit) == (3, 3.0)
+
+
+def test_uncached_fallback_shares_the_retry_budget(run, database, monkeypatch):
+    client = FakeGenAIClient()
+    backend = GeminiBackend(client=client)
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    llm = LLMInteraction(model_name="gemini-attempts-test", retry_delay=0.001, scheduler=make_scheduler())
+    monkeypatch.setattr(llm.circuit_breaker, "failure_threshold", 100)
+    monkeypatch.setattr(correction_module, "llm_context_caches", LLMContextCacheManager(enabled=True, min_tokens=1, min_uses=2, ttl_seconds=3600))
+    with get_db_context() as db:
+        correction = Correction(original_text=PROMPT, status=CorrectionStatusEnum.PENDING)
+        db.add(correction)
+        db.flush()
+        correction_id = correction.correction_id
+
+    # Every attempt fails: once the call with cached content used up the budget, the whole prompt gets a single attempt
+    # instead of LLM_MAX_ATTEMPTS more.
+    client.fail_next(*[genai_errors.ServerError(503, {"error": {"code": 503}}) for _ in range(2 * LLM_MAX_ATTEMPTS)])
+
+    async def call():
+        with get_db_context() as db:
+            service = CorrectionService(db=db, llm_model_name=llm.model_name)
+            return await service._get_validated_response(llm=llm, correction_id=correction_id, prompt=PROMPT, response_model=SnippetIssuesRevisionList,
+                                                         context=PromptContext(content=PROMPT, prompt="(the TEXT given before these instructions)"))
+
+    assert run(call()) is None
+    assert client.usage.requests == LLM_MAX_ATTEMPTS + 1
+
+
+@pytest.fixture
+def unpaced_scheduler(monkeypatch):
+    monkeypatch.setattr(llm_scheduler_module.llm_scheduler, "rate_limiter", LocalRateLimiter(requests_per_minute=100_000, tokens_per_minute=10**9, burst=1000))
+
+
+def make_hedging_llm(backend, model_name: str, max_hedge_ratio: float = 1.0) -> LLMInteraction:
+    llm = LLMInteraction(model_name=model_name, scheduler=make_scheduler(), hedging=True)
+    llm.backend = backend
+    llm.latencies = LatencyTracker(window=10, min_samples=3, max_hedge_ratio=max_hedge_ratio)
+    for _ in range(3):
+        llm.latencies.record(0.01)
+    return llm
+
+
+def test_slow_calls_are_hedged(run):
+    # The first request hangs; its hedge, sent after the usual 10ms, answers at once.
+    backend = ScriptedBackend(latencies=[30.0, 0.0])
+    llm = make_hedging_llm(backend, model_name="gemini-hedge-test")
+
+    started_at = time.monotonic()
+    response = run(llm.get_validated_response(prompt=PROMPT, response_model=SnippetIssuesRevisionList))
+    assert response.issues and time.monotonic() - started_at < 5
+    assert (len(backend.calls), backend.cancelled, llm.latencies.hedges) == (2, 1, 1)
+
+
+def test_hedges_stay_within_their_budget(run):
+    backend = ScriptedBackend(latencies=[0.2, 0.0, 0.2, 0.0])
+    llm = make_hedging_llm(backend, model_name="gemini-hedge-budget-test", max_hedge_ratio=0.5)
+
+    for _ in range(2):
+        assert run(llm.get_validated_response(prompt=PROMPT, response_model=SnippetIssuesRevisionList)) is not None
+    # The second call is not hedged: one hedge in two calls already uses up half of them.
+    assert (len(backend.calls), llm.latencies.hedges, llm.latencies.calls) == (3, 1, 2)
+
+    # Without enough latencies known, nothing is hedged.
+    assert LatencyTracker(window=10, min_samples=3, max_hedge_ratio=1.0).hedge_delay() is None
+
+
+def test_steps_fall_back_to_the_next_tier(run, service, unpaced_scheduler, make_prompts, make_document, monkeypatch):
+    backend = ScriptedBackend(failing_models={"gemini-primary-test"})
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    monkeypatch.setattr(correction_module, "LLM_FALLBACK_MODELS", {"gemini-primary-test": ["gemini-fallback-test"]})
+    prompt_id_refs = make_prompts(InputGranularityEnum.PARAGRAPH, model_name="gemini-primary-test")
+    correction_id = service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs).correction_id
+
+    run(service.run_correction(correction_id=correction_id))
+    # The permanent error of the primary model is not retried.
+    assert sorted(backend.calls) == ["gemini-fallback-test"] * 3 + ["gemini-primary-test"] * 3
+
+    service.db.expire_all()
+    steps = service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == correction_id)).all()
+    assert all(step.status == CorrectionStatusEnum.COMPLETED and step.llm_model_name == "gemini-fallback-test" for step in steps)
+    # Answers of the fallback tier are not cached under the keys of the primary model.
+    assert service.db.scalar(select(func.count()).select_from(LLMResponseCacheEntry)) == 0
+
+
+def test_steps_fail_once_every_tier_gave_up(run, service, unpaced_scheduler, make_prompts, make_document, monkeypatch):
+    backend = ScriptedBackend(failing_models={"gemini-primary-test", "gemini-fallback-test"})
+    monkeypatch.setattr(llm_interaction_module, "get_backend", lambda provider: backend)
+    monkeypatch.setattr(correction_module, "LLM_FALLBACK_MODELS", {"gemini-primary-test": ["gemini-fallback-test"]})
+    prompt_id_refs = make_prompts(InputGranularityEnum.WHOLE_TEXT, model_name="gemini-primary-test")
+    correction_id = service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs).correction_id
+
+    run(service.run_correction(correction_id=correction_id))
+    assert backend.calls == ["gemini-primary-test", "gemini-fallback-test"]
+    service.db.expire_all()
+    [step] = service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == correction_id)).all()
+    assert step.status == CorrectionStatusEnum.FAILED
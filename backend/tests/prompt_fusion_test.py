@@ -0,0 +1,59 @@
+from sqlalchemy import select
+
+from src.models import Prompt, InputGranularityEnum, Correction, CorrectionStep, CorrectionStatusEnum
+from src.schemas.schemas_llm import SnippetIssuesRevisionList
+from src.services.correction import CorrectionService
+from src.services.prompt_fusion import (can_fuse, render_fused_prompt, get_fused_response_model, split_fused_response,
+                                        get_response_model_for_schema)
+
+PROMPT_TEXT = "## TASK:\nFind the errors in the TEXT below.\n\n## TEXT:\n{{ input_text }}"
+
+
+def make_issues(snippet: str) -> dict:
+    return {"issues": [{"snippet": snippet, "sentence_context": snippet, "issue": "issue", "revision": "revision"}]}
+
+
+def test_fused_response_is_split_per_prompt():
+    response_model = get_fused_response_model(("spelling", "style"))
+    fused = response_model.model_validate({"spelling": make_issues("teh"), "style": make_issues("very unique")})
+
+    responses = split_fused_response(fused, ["spelling", "style"])
+    assert {ref: [issue.snippet for issue in response.issues] for ref, response in responses.items()} == {"spelling": ["teh"], "style": ["very unique"]}
+    assert all(isinstance(response, SnippetIssuesRevisionList) for response in responses.values())
+    # The mock backends recover the model from the schema sent to the provider.
+    assert get_response_model_for_schema(response_model.model_json_schema()) is response_model
+    assert get_response_model_for_schema(SnippetIssuesRevisionList.model_json_schema()) is SnippetIssuesRevisionList
+
+
+def test_fused_prompt_holds_the_text_once():
+    prompt = render_fused_prompt({"spelling": "Spelling of: {{ input_text }}", "style": "Style of: {{ input_text }}"}, "The input text.")
+    assert prompt.count("The input text.") == 1
+    assert "### TASK spelling:" in prompt and "### TASK style:" in prompt
+
+
+def test_prompt_refs_that_are_not_identifiers_are_not_fused():
+    assert can_fuse("test_paragraph")
+    assert not can_fuse("test-paragraph") and not can_fuse("_private") and not can_fuse("2nd")
+
+
+def test_prompts_over_the_same_paragraph_share_one_call(run, service, mock_backend, make_document):
+    refs = ["spelling", "style", "not-fusable"]
+    service.db.add_all(Prompt(prompt_id_ref=ref, text=PROMPT_TEXT, input_granularity=InputGranularityEnum.PARAGRAPH, is_enabled=True)
+                       for ref in refs)
+    service.db.commit()
+    text = make_document(3)
+    correction_id = service.create_new_correction(original_text=text, prompt_id_refs=refs).correction_id
+
+    fused_service = CorrectionService(db=service.db, llm_model_name="mock", fuse_prompts=True)
+    run(fused_service.run_correction(correction_id=correction_id))
+    # One fused call per paragraph, and one call per paragraph for the prompt whose ref cannot be a field name.
+    assert mock_backend.requests == 6
+
+    service.db.expire_all()
+    assert service.db.get(Correction, correction_id).status == CorrectionStatusEnum.COMPLETED
+    steps = service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == correction_id)).all()
+    assert len(steps) == 9
+    for step in steps:
+        assert step.status == CorrectionStatusEnum.COMPLETED and step.llm_response["issues"]
+        for result in step.analysis_results:
+            assert step.original_text_start_char <= result.original_text_start_char < result.original_text_end_char <= step.original_text_end_char
@@ -0,0 +1,65 @@
+from sqlalchemy import select
+
+from src.models import Prompt, InputGranularityEnum
+from src.services.prompt_registry import PromptRegistry
+from src.utils import get_db_context
+
+
+def add_prompt(db, prompt_id_ref: str, text: str = "Check: {{ input_text }}") -> Prompt:
+    prompt = Prompt(prompt_id_ref=prompt_id_ref, text=text, input_granularity=InputGranularityEnum.PARAGRAPH, is_enabled=True)
+    db.add(prompt)
+    db.commit()
+    return prompt
+
+
+def test_prompts_are_reloaded_when_the_table_changes(database):
+    registry = PromptRegistry(refresh_seconds=0, template_cache_size=8)
+    with get_db_context() as db:
+        add_prompt(db, "spelling")
+        prompts, etag = registry.get_enabled_prompts_with_etag(db)
+        assert [prompt.prompt_id_ref for prompt in prompts] == ["spelling"]
+
+        # Checked again, but not reloaded while nothing changed.
+        assert registry.get_enabled_prompts_with_etag(db)[1] == etag
+        assert registry.reloads == 1
+
+        prompt = db.scalar(select(Prompt).where(Prompt.prompt_id_ref == "spelling"))
+        prompt.text = "Check the spelling of: {{ input_text }}"
+        db.commit()
+        prompts, edited_etag = registry.get_enabled_prompts_with_etag(db)
+        assert [prompt.text for prompt in prompts] == ["Check the spelling of: {{ input_text }}"]
+        assert edited_etag != etag
+
+        add_prompt(db, "style")
+        prompt.is_enabled = False
+        db.commit()
+        prompts, etag = registry.get_enabled_prompts_with_etag(db)
+        assert [prompt.prompt_id_ref for prompt in prompts] == ["style"]
+        assert etag != edited_etag and registry.reloads == 3
+
+
+def test_unknown_refs_refresh_right_away(database):
+    registry = PromptRegistry(refresh_seconds=3600, template_cache_size=8)
+    with get_db_context() as db:
+        add_prompt(db, "spelling")
+        assert list(registry.get_prompts_by_refs(db, ["spelling"])) == ["spelling"]
+
+        # Within refresh_seconds, an edit is only picked up once a ref is not known yet.
+        add_prompt(db, "style")
+        assert len(registry.get_enabled_prompts(db)) == 1
+        assert list(registry.get_prompts_by_refs(db, ["spelling", "style", "missing"])) == ["spelling", "style"]
+        assert registry.reloads == 2
+
+
+def test_templates_are_compiled_once_per_text():
+    registry = PromptRegistry(refresh_seconds=0, template_cache_size=2)
+    for _ in range(3):
+        assert registry.render("First: {{ input_text }}", input_text="text") == "First: text"
+    assert registry.template_compilations == 1
+
+    registry.render("Second: {{ input_text }}", input_text="text")
+    registry.render("Third: {{ input_text }}", input_text="text")
+    # The least recently used template was evicted.
+    assert registry.render("First: {{ input_text }}", input_text="again") == "First: again"
+    assert registry.template_compilations == 4
+    assert registry.stats()["templates"] == 2
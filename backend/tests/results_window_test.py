@@ -0,0 +1,76 @@
+import pytest
+
+from src.services.text_utils import split_text_into_paragraphs
+
+
+def get_segments(results):
+    return [(segment.start_char, segment.end_char, segment.text, [issue.issue for issue in segment.issues]) for segment in results.rich_segments]
+
+
+def clip(segments, start_char, end_char):
+    """The segments of the whole results cut at the edges of a window."""
+    clipped = []
+    for start, end, text, issues in segments:
+        if start < end_char and start_char < end:
+            low, high = max(start, start_char), min(end, end_char)
+            clipped.append((low, high, text[low - start:high - start], issues))
+    return clipped
+
+
+@pytest.fixture
+def completed(service, create_completed_correction, make_document):
+    """A completed correction, its text and its whole results."""
+    text = make_document(6)
+    correction_id = create_completed_correction(text)
+    return correction_id, text, get_segments(service.get_correction_results(correction_id=correction_id))
+
+
+@pytest.mark.parametrize("include_text", [True, False])
+def test_character_window_clips_the_results(service, completed, include_text):
+    correction_id, text, segments = completed
+    paragraphs = split_text_into_paragraphs(text)
+    # Starts inside the issue at the start of the second paragraph.
+    start_char, end_char = paragraphs[1][1] + 2, paragraphs[3][1] + 3
+
+    results = service.get_correction_results_window(correction_id=correction_id, start_char=start_char, end_char=end_char, include_text=include_text)
+    assert (results.start_char, results.end_char, results.next_cursor) == (start_char, end_char, None)
+    assert results.original_text == (text if include_text else None)
+    assert get_segments(results) == clip(segments, start_char, end_char)
+    assert get_segments(results)[0][3] == ["issue"]
+
+
+def test_paragraph_window_spans_its_paragraphs(service, completed):
+    correction_id, text, segments = completed
+    paragraphs = split_text_into_paragraphs(text)
+
+    results = service.get_correction_results_window(correction_id=correction_id, paragraph_start=2, paragraph_end=4, include_text=False)
+    assert (results.start_char, results.end_char) == (paragraphs[2][1], paragraphs[3][1] + len(paragraphs[3][0]))
+    assert get_segments(results) == clip(segments, results.start_char, results.end_char)
+
+    # Past the last paragraph, the window is empty.
+    results = service.get_correction_results_window(correction_id=correction_id, paragraph_start=10, include_text=False)
+    assert (results.start_char, results.end_char) == (len(text), len(text))
+
+
+@pytest.mark.parametrize("issues_only", [False, True])
+def test_pages_follow_the_cursor(service, completed, issues_only):
+    correction_id, text, segments = completed
+    pages, cursor = [], None
+    while True:
+        results = service.get_correction_results_window(correction_id=correction_id, cursor=cursor, limit=2, include_text=False, issues_only=issues_only)
+        page = get_segments(results)
+        assert len(page) <= 2
+        pages.extend(page)
+        cursor = results.next_cursor
+        if cursor is None:
+            break
+        assert cursor == page[-1][1]
+
+    assert pages == [segment for segment in segments if segment[3] or not issues_only]
+
+
+def test_window_of_a_pending_or_missing_correction(service, prompt_id_refs, make_document):
+    correction_id = service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs).correction_id
+    results = service.get_correction_results_window(correction_id=correction_id, start_char=0, end_char=10, include_text=False)
+    assert (results.status, results.rich_segments) == ("pending", None)
+    assert service.get_correction_results_window(correction_id=correction_id + 1, include_text=False) is None
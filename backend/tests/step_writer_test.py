@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import select, update
+
+from src.models import Correction, CorrectionStep, CorrectionStatusEnum, AnalysisResult
+from src.services.job_queue import JobQueue
+from src.services.step_writer import StepResultWriter, StepResult
+
+
+def test_failed_flush_without_the_job_queue_fails_the_run(run, service, mock_backend, prompt_id_refs, make_document, monkeypatch):
+    def failing_write(self, db, batch):
+        raise RuntimeError("database unavailable")
+
+    correction_id = service.create_new_correction(original_text=make_document(3), prompt_id_refs=prompt_id_refs).correction_id
+    monkeypatch.setattr(StepResultWriter, "_write", failing_write)
+    with pytest.raises(RuntimeError, match="database unavailable"):
+        run(service.run_correction(correction_id=correction_id))
+
+    # Not reported as completed with its results missing.
+    service.db.expire_all()
+    assert service.db.get(Correction, correction_id).status == CorrectionStatusEnum.PENDING
+
+
+def test_results_of_steps_no_longer_leased_are_dropped(run, service, prompt_id_refs, make_document):
+    correction_id = service.create_new_correction(original_text=make_document(2), prompt_id_refs=prompt_id_refs).correction_id
+    kept, requeued, taken_over = JobQueue("worker", lease_seconds=60, max_attempts=3).claim_steps(service.db, limit=3)
+    # One step was requeued and another one claimed by a second worker while their results were buffered.
+    JobQueue("worker", lease_seconds=60, max_attempts=3).release_steps(service.db, [requeued])
+    service.db.execute(update(CorrectionStep).where(CorrectionStep.correction_step_id == taken_over).values(lease_owner="other"))
+    service.db.commit()
+
+    async def write():
+        async with StepResultWriter(lease_owner="worker") as writer:
+            for step_id in (kept, requeued, taken_over):
+                writer.add_nowait(StepResult(
+                    correction_id=correction_id, correction_step_id=step_id, status=CorrectionStatusEnum.COMPLETED,
+                    llm_response={"issues": []}, model_name="mock",
+                    analysis_results=[{"correction_step_id": step_id, "snippet": "snippet", "issue": "issue", "revision": "revision",
+                                       "original_text_start_char": 0, "original_text_end_char": 7}]
+                ))
+    run(write())
+
+    service.db.expire_all()
+    statuses = {step.correction_step_id: step.status for step in service.db.scalars(select(CorrectionStep).where(CorrectionStep.correction_id == correction_id))}
+    assert statuses[kept] == CorrectionStatusEnum.COMPLETED
+    assert statuses[requeued] == statuses[taken_over] == CorrectionStatusEnum.PENDING
+    assert service.db.scalars(select(AnalysisResult.correction_step_id)).all() == [kept]
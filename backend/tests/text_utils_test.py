@@ -0,0 +1,197 @@
+import io
+import random
+
+import pytest
+
+from src.schemas.schemas_api import RichSegmentIssue
+from src.services.text_utils import (split_text_into_paragraphs, iter_paragraphs, split_text_into_sentences, split_text_into_chunks,
+                                     match_unchanged_paragraphs, build_rich_segments, SegmentSnippetLocator, normalize_for_matching,
+                                     estimate_token_count)
+
+# Separators of several shapes (whitespace-only lines, runs of blank lines, \r\n), whitespace-only paragraphs, leading and
+# trailing blank lines, and multibyte characters that a binary source splits across reads.
+PARAGRAPH_TEXTS = [
+    "",
+    "One paragraph without a separator.",
+    "\n\n  First.\nStill first.\n \t\n\nSecond, caf\u00e9 \u00fcber na\u00efve.\r\n\r\n   \n\n\u2014 Third \U0001F600 \u201cquoted\u201d.\n\n\n",
+    "A.\n\nB.\n\nC.\n \nD \u00e9\u00e9\u00e9\u00e9.\n\n \n\n",
+]
+
+
+def make_issue(name: str) -> RichSegmentIssue:
+    return RichSegmentIssue(prompt_id_ref="test", issue=name, revision=name)
+
+
+def assert_covers(segments, text: str, text_offset: int = 0):
+    """The segments tile the text without gaps or overlaps, and each holds its slice of the text."""
+    assert segments[0].start_char == text_offset and segments[-1].end_char == text_offset + len(text)
+    for previous, segment in zip(segments, segments[1:]):
+        assert previous.end_char == segment.start_char
+    for segment in segments:
+        assert segment.start_char < segment.end_char
+        assert segment.text == text[segment.start_char - text_offset:segment.end_char - text_offset]
+
+
+@pytest.mark.parametrize("text", PARAGRAPH_TEXTS)
+def test_paragraph_offsets_point_into_the_text(text):
+    paragraphs = split_text_into_paragraphs(text)
+    for paragraph, offset in paragraphs:
+        assert paragraph.strip() and text[offset:offset + len(paragraph)] == paragraph
+    # Nothing but the separators and whitespace-only paragraphs is left out.
+    assert " ".join(paragraph for paragraph, _ in paragraphs).split() == text.split()
+
+
+@pytest.mark.parametrize("text", PARAGRAPH_TEXTS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 64])
+def test_streamed_paragraphs_match_the_string_path(text, chunk_size):
+    expected = list(iter_paragraphs(text))
+    assert list(iter_paragraphs(io.StringIO(text), chunk_size=chunk_size)) == expected
+    assert list(iter_paragraphs(io.BytesIO(text.encode("utf-8")), chunk_size=chunk_size)) == expected
+
+
+def test_streamed_paragraphs_of_a_long_document(make_document):
+    text = make_document(200)
+    assert list(iter_paragraphs(io.StringIO(text), chunk_size=1000)) == split_text_into_paragraphs(text)
+
+
+def test_sentences_stay_within_their_paragraph(make_document):
+    text = make_document(10, words_per_paragraph=60) + '\n\nHe said \u201cStop.\u201d Then (he left.) 3 days passed! Why? e.g. not here.'
+    paragraphs = split_text_into_paragraphs(text)
+    sentences = split_text_into_sentences(text)
+    for sentence, offset in sentences:
+        assert text[offset:offset + len(sentence)] == sentence
+        assert any(start <= offset and offset + len(sentence) <= start + len(paragraph) for paragraph, start in paragraphs)
+    assert " ".join(sentence for sentence, _ in sentences).split() == text.split()
+    assert [sentence for sentence, _ in sentences[-4:]] == ["He said \u201cStop.\u201d", "Then (he left.)", "3 days passed!", "Why? e.g. not here."]
+
+
+@pytest.mark.parametrize("max_tokens,overlap_tokens", [(20, 0), (20, 10), (60, 0), (60, 20), (300, 100)])
+def test_chunk_owned_regions_are_disjoint_and_cover_the_text(make_document, max_tokens, overlap_tokens):
+    # Paragraphs of very different lengths, some above the budget, so that they are split into sentences.
+    text = "\n\n".join(make_document(1, words_per_paragraph=words, seed=seed) for seed, words in enumerate([5, 200, 30, 30, 8, 120, 60, 5]))
+    chunks = split_text_into_chunks(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+    owned_regions = []
+    for chunk, start, overlap in chunks:
+        assert text[start:start + len(chunk)] == chunk
+        owned_text = chunk[overlap:]
+        assert owned_text.strip()
+        # Only a single sentence above the budget makes a chunk go over it.
+        if estimate_token_count(chunk) > max_tokens:
+            assert overlap == 0 and len(split_text_into_sentences(owned_text)) == 1
+        owned_regions.append((start + overlap, start + len(chunk)))
+    assert chunks[0][2] == 0
+
+    # Owned regions are disjoint, in text order, and the overlap repeats the end of the previous chunk only.
+    for (previous_start, previous_end), (chunk, start, overlap) in zip(owned_regions, chunks[1:]):
+        assert previous_end <= start + overlap
+        assert overlap == 0 or previous_start <= start < previous_end
+    # Every character but the whitespace between paragraphs and sentences is owned by exactly one chunk.
+    owners = [0] * len(text)
+    for start, end in owned_regions:
+        for position in range(start, end):
+            owners[position] += 1
+    assert all(count == 1 for character, count in zip(text, owners) if not character.isspace())
+
+
+def test_snippets_are_looked_up_in_the_owned_region_first():
+    overlap = "The cat sat on the mat. "
+    segment = overlap + "Then the cat left."
+    locator = SegmentSnippetLocator(segment, 50, owned_start_char=len(overlap))
+    start, end = locator.locate("the cat", "")
+    assert start - 50 == segment.index("the cat", len(overlap))
+    # Snippets only found in the overlap are still located.
+    assert locator.locate("on the mat", "") == (50 + segment.index("on the mat"), 50 + segment.index("on the mat") + len("on the mat"))
+
+
+def test_unchanged_paragraphs_are_matched_across_edits(make_document):
+    old_text = make_document(6)
+    old_paragraphs = split_text_into_paragraphs(old_text)
+    old_texts = [paragraph for paragraph, _ in old_paragraphs]
+    # Paragraph 0 inserted, old paragraph 2 edited, old paragraph 4 deleted.
+    new_texts = ["An inserted paragraph."] + old_texts[:2] + [old_texts[2] + " Edited."] + [old_texts[3], old_texts[5]]
+    new_paragraphs = split_text_into_paragraphs("\n\n".join(new_texts))
+
+    assert match_unchanged_paragraphs(old_paragraphs, new_paragraphs) == {1: 0, 2: 1, 4: 3, 5: 5}
+
+
+def test_unchanged_paragraphs_of_identical_texts(make_document):
+    paragraphs = split_text_into_paragraphs(make_document(4))
+    assert match_unchanged_paragraphs(paragraphs, paragraphs) == {index: index for index in range(4)}
+    assert match_unchanged_paragraphs(paragraphs, []) == {}
+
+
+def test_rich_segments_cut_the_text_at_overlapping_issues():
+    text = "The quick brown fox jumps over the lazy dog."
+    first, second, third = make_issue("first"), make_issue("second"), make_issue("third")
+    # first overlaps second, third lies within second; unlocated issues are ignored.
+    segments = build_rich_segments(text, [(4, 15, first), (10, 30, second), (-1, -1, make_issue("unlocated")), (16, 19, third)])
+
+    assert_covers(segments, text)
+    assert [(segment.text, [issue.issue for issue in segment.issues]) for segment in segments] == [
+        ("The ", []), ("quick ", ["first"]), ("brown", ["first", "second"]), (" ", ["second"]),
+        ("fox", ["second", "third"]), (" jumps over", ["second"]), (" the lazy dog.", []),
+    ]
+
+
+def test_rich_segments_of_a_window_keep_global_offsets():
+    text = "First paragraph.\n\nSecond paragraph with an issue."
+    window_start = text.index("Second")
+    issue_start = text.index("issue")
+    segments = build_rich_segments(text[window_start:], [(issue_start, issue_start + 5, make_issue("issue"))], text_offset=window_start)
+
+    assert_covers(segments, text[window_start:], text_offset=window_start)
+    [located] = [segment for segment in segments if segment.issues]
+    assert (located.start_char, located.text) == (issue_start, "issue")
+
+
+def test_rich_segments_without_issues():
+    assert [(segment.text, segment.issues) for segment in build_rich_segments("No issues.", [])] == [("No issues.", [])]
+
+
+def test_located_snippets_have_global_offsets(make_document):
+    text = make_document(20)
+    rng = random.Random(0)
+    for paragraph, offset in split_text_into_paragraphs(text)[5:]:
+        locator = SegmentSnippetLocator(paragraph, offset)
+        words = paragraph.split(" ")
+        for _ in range(10):
+            first = rng.randrange(len(words) - 3)
+            snippet = " ".join(words[first:first + rng.randint(1, 3)])
+            start, end = locator.locate(snippet, paragraph)
+            assert text[start:end] == snippet and offset <= start
+
+
+def test_repeated_snippets_are_assigned_distinct_occurrences():
+    segment = "Teh cat sat. Then teh dog sat. And teh bird sat."
+    locator = SegmentSnippetLocator(segment, 100)
+    occurrences = [locator.locate("teh", "") for _ in range(2)]
+    assert occurrences == [(118, 121), (135, 138)]
+    # Once every occurrence is taken, the first one is reported again.
+    assert locator.locate("teh", "") == (118, 121)
+
+    # The sentence context picks the occurrence.
+    locator = SegmentSnippetLocator(segment, 100)
+    assert locator.locate("teh", "And teh bird sat.") == (135, 138)
+
+
+def test_snippets_match_across_quotes_dashes_and_whitespace():
+    segment = "He said \u201cit\u2019s fine\u201d \u2014 twice,\n   then   left."
+    locator = SegmentSnippetLocator(segment, 0)
+    for snippet, expected in [("\"it's fine\"", "\u201cit\u2019s fine\u201d"), ("- twice, then left", "\u2014 twice,\n   then   left")]:
+        start, end = locator.locate(snippet, "")
+        assert segment[start:end] == expected
+        assert normalize_for_matching(segment[start:end]) == normalize_for_matching(snippet)
+
+
+def test_snippets_are_matched_fuzzily():
+    segment = "The measurement of the participants was significant. The observation was not."
+    # The LLM echoed the snippet with its typo fixed.
+    start, end = SegmentSnippetLocator(segment, 10).locate("the measurements of the participants", "")
+    assert segment[start - 10:end - 10] == "The measurement of the participants"
+
+
+def test_missing_snippets_are_not_located():
+    locator = SegmentSnippetLocator("Nothing to see here.", 0)
+    assert locator.locate("completely different words", "and another sentence entirely") == (-1, -1)
+    assert locator.locate("  ", "") == (-1, -1)
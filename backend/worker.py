@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import multiprocessing
+import signal
+
+from config import LLM_MODEL_NAME, WORKER_METRICS_PORT, CORRECTION_EVENTS_BACKEND, LLM_SHARED_PROCESSES
+from src.services.worker import CorrectionWorker
+from src.services.llm_scheduler import llm_scheduler, per_process_concurrency
+from src.services.telemetry import start_metrics_server
+
+
+def run_worker(metrics_port: int = 0, processes: int = 1):
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    # The processes of this node share the rate limiter's budget at least among themselves.
+    llm_scheduler.set_max_concurrency(per_process_concurrency(max(LLM_SHARED_PROCESSES, processes)))
+    asyncio.run(CorrectionWorker(llm_model_name=LLM_MODEL_NAME).run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run correction workers that process the job queue.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes to start on this node.")
+    parser.add_argument("--metrics-port", type=int, default=WORKER_METRICS_PORT,
+                        help="Serve Prometheus metrics on this port, and the next ones for the other processes (0 disables).")
+    args = parser.parse_args()
+    if CORRECTION_EVENTS_BACKEND == "memory":
+        parser.error("CORRECTION_EVENTS_BACKEND=memory cannot reach the API's streams from a worker process; use postgres.")
+
+    if args.processes <= 1:
+        run_worker(args.metrics_port)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.metrics_port + i if args.metrics_port else 0, args.processes),
+                                name=f"correction-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # Forward SIGTERM so that every worker drains its in-flight steps before exiting.
+    def terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()